@@ -0,0 +1,189 @@
+"""Endpoint latency benchmarks: python -m benchmarks <command> [options]
+
+The database comes from the same DB_* settings as the app,
+`seed` replaces all its data - point them to a separate database."""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.accessors import measure as measure_accessors
+from benchmarks.dataset import SCALES, seed
+from benchmarks.runner import SCENARIOS, Bounds, run_scenarios
+from benchmarks.statements import measure as measure_statements
+from service.__main__ import app
+from service.cache import NoCache, statistic_cache
+from service.config import db_pool_settings
+from service.db_setup.db_settings import db_connector
+from service.manage import positive_int
+
+SCALE_OVERRIDES = (
+    "clients",
+    "category_depth",
+    "category_fanout",
+    "products",
+    "orders",
+    "items_per_order",
+)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def seed_command(args: argparse.Namespace) -> None:
+    scale = dataclasses.replace(
+        SCALES[args.scale],
+        **{
+            name: getattr(args, name)
+            for name in SCALE_OVERRIDES
+            if getattr(args, name) is not None
+        },
+    )
+    print(f"Seeding {scale.order_items} order items: {scale}")
+    await seed(db_connector.session_maker, scale)
+    print("Done")
+
+
+async def run_command(args: argparse.Namespace) -> None:
+    if not args.cache:
+        # measure the queries, not the cache hits
+        statistic_cache.backend = NoCache()
+    bounds = await Bounds.load(db_connector.session_maker)
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+        results = await run_scenarios(
+            client,
+            bounds,
+            args.scenario or list(SCENARIOS),
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            random_seed=args.random_seed,
+        )
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "dataset": vars(bounds),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "cache": args.cache,
+            "pool_size": db_pool_settings["pool_size"],
+            "max_overflow": db_pool_settings["max_overflow"],
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+async def compare_command(args: argparse.Namespace) -> None:
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    print(f"{base['commit']} -> {new['commit']}")
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+    for name, result in new["results"].items():
+        if name not in base["results"]:
+            continue
+        changes = []
+        for metric in metrics:
+            before, after = base["results"][name][metric], result[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            changes.append(f"{metric} {before} -> {after} ({change:+.1f}%)")
+        print(f"{name}: " + ", ".join(changes))
+
+
+async def statements_command(args: argparse.Namespace) -> None:
+    print(json.dumps(measure_statements(args.calls), indent=2))
+
+
+async def accessors_command(args: argparse.Namespace) -> None:
+    results = await measure_accessors(db_connector.session_maker, args.calls)
+    print(json.dumps(results, indent=2))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "seed", help="replace the database data with a synthetic dataset"
+    )
+    command.add_argument("--scale", choices=SCALES, default="small")
+    for name in SCALE_OVERRIDES:
+        command.add_argument(
+            f"--{name.replace('_', '-')}", type=positive_int, dest=name
+        )
+    command.set_defaults(handler=seed_command)
+
+    command = commands.add_parser("run", help="measure the endpoint latencies")
+    command.add_argument(
+        "--scenario",
+        choices=SCENARIOS,
+        action="append",
+        help="can be repeated, all scenarios by default",
+    )
+    command.add_argument("--requests", type=positive_int, default=500)
+    command.add_argument("--concurrency", type=positive_int, default=10)
+    command.add_argument("--warmup", type=int, default=20)
+    command.add_argument("--random-seed", type=int, default=0)
+    command.add_argument(
+        "--cache", action="store_true", help="keep the statistic cache on"
+    )
+    command.add_argument("--output", help="also write the JSON report here")
+    command.set_defaults(handler=run_command)
+
+    command = commands.add_parser(
+        "compare", help="compare two JSON reports of `run`"
+    )
+    command.add_argument("base")
+    command.add_argument("new")
+    command.set_defaults(handler=compare_command)
+
+    command = commands.add_parser(
+        "statements",
+        help="per call Python overhead of built vs cached statements",
+    )
+    command.add_argument("--calls", type=positive_int, default=2000)
+    command.set_defaults(handler=statements_command)
+
+    command = commands.add_parser(
+        "accessors",
+        help="per call latency of the SQLAlchemy vs asyncpg accessors",
+    )
+    command.add_argument("--calls", type=positive_int, default=500)
+    command.set_defaults(handler=accessors_command)
+
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    try:
+        await args.handler(args)
+    finally:
+        await db_connector.dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(build_parser().parse_args()))
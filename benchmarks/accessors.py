@@ -0,0 +1,46 @@
+"""Per call latency of the read accessors side by side:
+StatisticAccessor (SQLAlchemy) and RawStatisticAccessor (asyncpg),
+the same SQL on the seeded database, one session per accessor"""
+
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.runner import summarize
+from service.raw_accessors import STATISTIC_ACCESSORS
+
+CALLS: dict[str, Callable[[object], Awaitable]] = {
+    "client-order-sum": lambda accessor: accessor.get_client_orders_sum(
+        limit=100
+    ),
+    "count-subcategories": lambda accessor: accessor.get_count_subcategories(),
+    "statistic-order": lambda accessor: accessor.get_top_selling_products(),
+    "statistic-order-per-category": lambda accessor: (
+        accessor.get_top_selling_products(per_category=True)
+    ),
+}
+
+
+async def measure(
+    session_maker: async_sessionmaker, calls: int
+) -> dict[str, dict[str, dict]]:
+    results: dict[str, dict[str, dict]] = {}
+    for name, call in CALLS.items():
+        for implementation, accessor_class in STATISTIC_ACCESSORS.items():
+            async with session_maker() as session:
+                accessor = accessor_class(session)
+                # prepares the statement on the connection
+                await call(accessor)
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(calls):
+                    call_start = time.perf_counter()
+                    await call(accessor)
+                    latencies.append(time.perf_counter() - call_start)
+                elapsed = time.perf_counter() - start
+                await session.commit()
+            results.setdefault(name, {})[implementation] = summarize(
+                latencies, 0, elapsed
+            )
+    return results
@@ -0,0 +1,168 @@
+"""Synthetic dataset of a given scale, generated inside Postgres"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from service.db_accessors import (
+    PartitionAccessor,
+    RollupAccessor,
+    add_months,
+    create_partition_statements,
+    month_start,
+)
+from service.db_setup.models import Base
+
+
+@dataclass(frozen=True)
+class Scale:
+    clients: int
+    category_depth: int
+    category_fanout: int
+    products: int
+    orders: int
+    items_per_order: int
+    days: int = 365
+
+    @property
+    def order_items(self) -> int:
+        return self.orders * self.items_per_order
+
+
+SCALES = {
+    "tiny": Scale(
+        clients=50,
+        category_depth=2,
+        category_fanout=3,
+        products=100,
+        orders=200,
+        items_per_order=3,
+    ),
+    "small": Scale(
+        clients=10_000,
+        category_depth=3,
+        category_fanout=5,
+        products=10_000,
+        orders=100_000,
+        items_per_order=5,
+    ),
+    "medium": Scale(
+        clients=100_000,
+        category_depth=4,
+        category_fanout=6,
+        products=100_000,
+        orders=1_000_000,
+        items_per_order=5,
+    ),
+    # 10M order items
+    "large": Scale(
+        clients=1_000_000,
+        category_depth=5,
+        category_fanout=6,
+        products=200_000,
+        orders=2_000_000,
+        items_per_order=5,
+    ),
+}
+
+
+def category_statements(scale: Scale) -> tuple[list[str], int, int]:
+    """Inserts of the category tree level by level: `fanout` top-level
+    categories, every category has `fanout` children down to `depth`.
+    Returns the statements and the id range of the leaf level"""
+    statements = [
+        f"""
+        INSERT INTO category (title)
+        SELECT 'Category 1.' || g
+        FROM generate_series(1, {scale.category_fanout}) g
+        """
+    ]
+    first_id, last_id = 1, scale.category_fanout
+    for level in range(2, scale.category_depth + 1):
+        statements.append(
+            f"""
+            INSERT INTO category (title, parent_id)
+            SELECT 'Category {level}.' || parent.id || '.' || g, parent.id
+            FROM category AS parent
+            CROSS JOIN generate_series(1, {scale.category_fanout}) g
+            WHERE parent.id BETWEEN {first_id} AND {last_id}
+            ORDER BY parent.id, g
+            """
+        )
+        count = (last_id - first_id + 1) * scale.category_fanout
+        first_id, last_id = last_id + 1, last_id + count
+    return statements, first_id, last_id
+
+
+def data_statements(scale: Scale) -> list[str]:
+    """Every table is filled with one INSERT ... SELECT generate_series,
+    ids are sequential after TRUNCATE ... RESTART IDENTITY"""
+    if scale.items_per_order > scale.products:
+        raise ValueError("items_per_order can not exceed products")
+    statements, leaf_first, leaf_last = category_statements(scale)
+    leaves = leaf_last - leaf_first + 1
+    statements += [
+        f"""
+        INSERT INTO client (name, email)
+        SELECT 'Client ' || g, 'client' || g || '@mail.com'
+        FROM generate_series(1, {scale.clients}) g
+        """,
+        f"""
+        INSERT INTO product (title, price, category_id, quantity)
+        SELECT 'Product ' || g, g % 100 + 1, {leaf_first} + g % {leaves},
+            1000000
+        FROM generate_series(1, {scale.products}) g
+        """,
+        f"""
+        INSERT INTO "order" (client_id, date, created_at)
+        SELECT g % {scale.clients} + 1, moment, moment
+        FROM generate_series(1, {scale.orders}) g,
+            LATERAL (
+                SELECT now() - (g % {scale.days}) * interval '1 day'
+            ) AS m(moment)
+        """,
+        # distinct products within an order: consecutive ids
+        f"""
+        INSERT INTO order_item (
+            order_id, order_created_at, product_id, quantity, price_at_time
+        )
+        SELECT o.id, o.created_at, p, o.id % 3 + 1, p % 100 + 1
+        FROM "order" AS o,
+            LATERAL (
+                SELECT (o.id * 7919 + i) % {scale.products} + 1 AS p
+                FROM generate_series(0, {scale.items_per_order - 1}) i
+            ) AS items
+        """,
+    ]
+    return statements
+
+
+async def seed(session_maker: async_sessionmaker, scale: Scale) -> None:
+    """Replaces all the data of the database with the dataset"""
+    tables = ", ".join(
+        f'"{table.name}"' for table in reversed(Base.metadata.sorted_tables)
+    )
+    async with session_maker() as session:
+        await session.execute(
+            text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+        )
+        if await PartitionAccessor(session).is_partitioned():
+            current = month_start(datetime.now(timezone.utc))
+            for count in range(1, scale.days // 28 + 2):
+                for statement in create_partition_statements(
+                    add_months(current, -count)
+                ):
+                    await session.execute(text(statement))
+        for statement in data_statements(scale):
+            await session.execute(text(statement))
+        await session.commit()
+
+        await RollupAccessor(session).rebuild_product_sales_daily()
+        await RollupAccessor(session).reconcile_client_order_totals(
+            repair=True
+        )
+        # fresh statistics, otherwise the first runs get other plans
+        await session.execute(text("ANALYZE"))
+        await session.commit()
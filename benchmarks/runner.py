@@ -0,0 +1,151 @@
+"""Drives the endpoints through the ASGI app and measures the latency"""
+
+import asyncio
+import math
+import random
+import time
+from typing import Callable
+
+from httpx import AsyncClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from service.db_setup.models import Client, Order, Product
+from service.pagination import encode_cursor
+
+Request = tuple[str, str, dict]
+
+
+class Bounds:
+    """Largest ids of the seeded tables, requests pick ids below them"""
+
+    def __init__(self, clients: int, products: int, orders: int) -> None:
+        self.clients = clients
+        self.products = products
+        self.orders = orders
+
+    @classmethod
+    async def load(cls, session_maker: async_sessionmaker) -> "Bounds":
+        async with session_maker() as session:
+            row = (
+                await session.execute(
+                    select(
+                        select(func.max(Client.id)).scalar_subquery(),
+                        select(func.max(Product.id)).scalar_subquery(),
+                        select(func.max(Order.id)).scalar_subquery(),
+                    )
+                )
+            ).one()
+        return cls(*(value or 1 for value in row))
+
+
+def client_order_sum_page(bounds: Bounds, rnd: random.Random) -> Request:
+    cursor = encode_cursor(rnd.randint(0, bounds.clients))
+    return "GET", "/client-order-sum", {"limit": 100, "cursor": cursor}
+
+
+def client_order_sum_exact_page(bounds: Bounds, rnd: random.Random) -> Request:
+    method, url, params = client_order_sum_page(bounds, rnd)
+    return method, url, {**params, "exact": "true"}
+
+
+def add_to_cart(bounds: Bounds, rnd: random.Random) -> Request:
+    params = {
+        "order_id": rnd.randint(1, bounds.orders),
+        "product_id": rnd.randint(1, bounds.products),
+        "quantity": 1,
+    }
+    return "POST", "/add-to-cart", params
+
+
+SCENARIOS: dict[str, Callable[[Bounds, random.Random], Request]] = {
+    "client-order-sum": lambda bounds, rnd: (
+        "GET",
+        "/client-order-sum",
+        {"limit": 100},
+    ),
+    "client-order-sum-page": client_order_sum_page,
+    "client-order-sum-exact-page": client_order_sum_exact_page,
+    "count-subcategories": lambda bounds, rnd: (
+        "GET",
+        "/count-subcategories",
+        {},
+    ),
+    "statistic-order": lambda bounds, rnd: ("GET", "/statistic-order", {}),
+    "statistic-order-per-category": lambda bounds, rnd: (
+        "GET",
+        "/statistic-order",
+        {"per_category": "true"},
+    ),
+    "add-to-cart": add_to_cart,
+}
+
+
+def percentile(latencies: list[float], rank: float) -> float:
+    """Nearest-rank percentile of sorted latencies"""
+    index = max(math.ceil(rank / 100 * len(latencies)) - 1, 0)
+    return latencies[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 3),
+        "max_ms": round(latencies_ms[-1], 3),
+        "throughput_rps": round(len(latencies_ms) / elapsed, 1),
+    }
+
+
+async def measure(
+    client: AsyncClient,
+    make_request: Callable[[], Request],
+    requests: int,
+    concurrency: int,
+) -> dict:
+    """Sends `requests` requests from `concurrency` concurrent workers"""
+    latencies: list[float] = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for _ in pending:
+            method, url, params = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, params=params)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_scenarios(
+    client: AsyncClient,
+    bounds: Bounds,
+    scenarios: list[str],
+    requests: int,
+    concurrency: int,
+    warmup: int = 0,
+    random_seed: int = 0,
+) -> dict[str, dict]:
+    results = {}
+    for name in scenarios:
+        rnd = random.Random(random_seed)
+
+        def make_request() -> Request:
+            return SCENARIOS[name](bounds, rnd)
+
+        if warmup:
+            await measure(client, make_request, warmup, concurrency)
+        results[name] = await measure(
+            client, make_request, requests, concurrency
+        )
+    return results
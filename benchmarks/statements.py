@@ -0,0 +1,61 @@
+"""Python overhead of getting a statistic statement ready to execute,
+without the database: building it and finding its compiled SQL,
+which Connection.execute does on every call"""
+
+import time
+from typing import Callable
+
+from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+from sqlalchemy.util import LRUCache
+
+from service.db_accessors import StatisticAccessor
+
+# builder and the shape flags of the statement
+SHAPES = {
+    "top-selling": (
+        StatisticAccessor.top_selling_products_query,
+        (False, False, False),
+    ),
+    "top-selling-subtree-level-per-category": (
+        StatisticAccessor.top_selling_products_query,
+        (True, True, True),
+    ),
+    "client-order-sum-page": (
+        StatisticAccessor.client_orders_sum_page_query,
+        (False, True, True),
+    ),
+}
+
+
+def per_call_us(function: Callable[[], object], calls: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return round((time.perf_counter() - start) / calls * 1_000_000, 2)
+
+
+def measure(calls: int = 2000) -> dict[str, dict]:
+    """Per call: `rebuilt` - the statement is built for every call
+    (as before the statements were cached), `prebuilt` - the cached one"""
+    dialect = PGDialect_asyncpg()
+    results = {}
+    for name, (builder, flags) in SHAPES.items():
+        compiled_cache = LRUCache(500)
+
+        def prepare(statement):
+            return statement._compile_w_cache(
+                dialect, compiled_cache=compiled_cache, column_keys=[]
+            )
+
+        statement = builder(*flags)
+        rebuilt = per_call_us(
+            lambda: prepare(builder.__wrapped__(*flags)), calls
+        )
+        prebuilt = per_call_us(lambda: prepare(statement), calls)
+        results[name] = {
+            "rebuilt_us": rebuilt,
+            "prebuilt_us": prebuilt,
+            "speedup": round(rebuilt / prebuilt, 1) if prebuilt else None,
+        }
+    return results
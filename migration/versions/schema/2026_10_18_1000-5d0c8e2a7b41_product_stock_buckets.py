@@ -0,0 +1,49 @@
+"""product stock buckets.
+
+Revision ID: 5d0c8e2a7b41
+Revises: 4cbe34f35090
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d0c8e2a7b41'
+down_revision: Union[str, None] = '4cbe34f35090'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'product',
+        sa.Column('stock_buckets', sa.Integer(), server_default='0', nullable=False),
+    )
+    op.create_table('product_stock_bucket',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), server_default='0', nullable=False),
+    sa.CheckConstraint('quantity >= 0', name='ck_stock_bucket_quantity'),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    # return the stock kept in buckets back to the product rows
+    op.execute(
+        """
+        UPDATE product SET quantity = bucket_total.quantity
+        FROM (
+            SELECT product_id, sum(quantity) AS quantity
+            FROM product_stock_bucket GROUP BY product_id
+        ) AS bucket_total
+        WHERE product.id = bucket_total.product_id
+        """
+    )
+    op.drop_table('product_stock_bucket')
+    op.drop_column('product', 'stock_buckets')
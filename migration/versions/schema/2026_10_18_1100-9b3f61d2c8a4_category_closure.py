@@ -0,0 +1,122 @@
+"""category closure table.
+
+Revision ID: 9b3f61d2c8a4
+Revises: 5d0c8e2a7b41
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3f61d2c8a4'
+down_revision: Union[str, None] = '5d0c8e2a7b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('category_closure',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['category.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['category.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index(
+        'ix_category_closure_descendant_id',
+        'category_closure',
+        ['descendant_id', 'ancestor_id'],
+        unique=False,
+    )
+
+    # a new category: itself plus every ancestor of its parent
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION category_closure_insert() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+            SELECT NEW.id, NEW.id, 0
+            UNION ALL
+            SELECT ancestor_id, NEW.id, depth + 1
+            FROM category_closure
+            WHERE descendant_id = NEW.parent_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    # re-parenting moves the whole subtree: links from the old ancestors
+    # are removed, links from the new ones are added.
+    # ON DELETE SET NULL of parent_id fires it too, the children of
+    # a deleted category become top-level categories
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION category_closure_update() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM category_closure AS link
+            USING category_closure AS subtree, category_closure AS above
+            WHERE link.descendant_id = subtree.descendant_id
+                AND link.ancestor_id = above.ancestor_id
+                AND subtree.ancestor_id = NEW.id
+                AND above.descendant_id = NEW.id
+                AND above.ancestor_id <> NEW.id;
+
+            INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+            SELECT above.ancestor_id, subtree.descendant_id,
+                above.depth + subtree.depth + 1
+            FROM category_closure AS above, category_closure AS subtree
+            WHERE above.descendant_id = NEW.parent_id
+                AND subtree.ancestor_id = NEW.id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER category_closure_insert
+        AFTER INSERT ON category
+        FOR EACH ROW EXECUTE FUNCTION category_closure_insert();
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER category_closure_update
+        AFTER UPDATE OF parent_id ON category
+        FOR EACH ROW
+        WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+        EXECUTE FUNCTION category_closure_update();
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE hierarchy(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM category
+            UNION ALL
+            SELECT category.parent_id, hierarchy.descendant_id,
+                hierarchy.depth + 1
+            FROM hierarchy
+            JOIN category ON category.id = hierarchy.ancestor_id
+            WHERE category.parent_id IS NOT NULL
+        )
+        SELECT ancestor_id, descendant_id, depth FROM hierarchy
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS category_closure_update ON category")
+    op.execute("DROP TRIGGER IF EXISTS category_closure_insert ON category")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_update()")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_insert()")
+    op.drop_index(
+        'ix_category_closure_descendant_id', table_name='category_closure'
+    )
+    op.drop_table('category_closure')
@@ -0,0 +1,52 @@
+"""product sales daily rollup.
+
+Revision ID: c47e0a19f3d5
+Revises: 9b3f61d2c8a4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47e0a19f3d5'
+down_revision: Union[str, None] = '9b3f61d2c8a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('product_sales_daily',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('quantity', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'day')
+    )
+    op.create_index(
+        'ix_product_sales_daily_day',
+        'product_sales_daily',
+        ['day', 'product_id'],
+        unique=False,
+        postgresql_include=['quantity'],
+    )
+
+    op.execute(
+        """
+        INSERT INTO product_sales_daily (product_id, day, quantity)
+        SELECT order_item.product_id,
+            ("order".date AT TIME ZONE 'UTC')::date,
+            sum(order_item.quantity)
+        FROM order_item
+        JOIN "order" ON "order".id = order_item.order_id
+        GROUP BY 1, 2
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_sales_daily_day', table_name='product_sales_daily')
+    op.drop_table('product_sales_daily')
@@ -0,0 +1,42 @@
+"""client order totals.
+
+Revision ID: e81b5f7c20a6
+Revises: c47e0a19f3d5
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81b5f7c20a6'
+down_revision: Union[str, None] = 'c47e0a19f3d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('client_order_totals',
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('total_sum', sa.BigInteger(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('client_id')
+    )
+
+    op.execute(
+        """
+        INSERT INTO client_order_totals (client_id, total_sum)
+        SELECT "order".client_id,
+            coalesce(sum(order_item.quantity * order_item.price_at_time), 0)
+        FROM "order"
+        LEFT OUTER JOIN order_item ON "order".id = order_item.order_id
+        GROUP BY "order".client_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('client_order_totals')
@@ -0,0 +1,29 @@
+"""product category index.
+
+Revision ID: 3a9d7e52b1c8
+Revises: e81b5f7c20a6
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9d7e52b1c8'
+down_revision: Union[str, None] = 'e81b5f7c20a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_product_category_id', 'product', ['category_id', 'id'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS ix_product_category_id')
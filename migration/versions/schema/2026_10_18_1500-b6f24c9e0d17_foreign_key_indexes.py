@@ -0,0 +1,57 @@
+"""foreign key indexes.
+
+Revision ID: b6f24c9e0d17
+Revises: 3a9d7e52b1c8
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f24c9e0d17'
+down_revision: Union[str, None] = '3a9d7e52b1c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# built CONCURRENTLY so that orders keep coming in meanwhile,
+# CREATE INDEX CONCURRENTLY can not run inside a transaction
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_category_parent_id', 'category', ['parent_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_order_client_id', 'order', ['client_id', 'id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_order_item_product_id', 'order_item', ['product_id'],
+            postgresql_include=['quantity', 'order_id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        # (date, id) serves everything ix_order_date did
+        op.create_index(
+            'ix_order_date_id', 'order', ['date', 'id'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_order_date')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_order_date', 'order', ['date'],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_order_date_id')
+        op.execute(
+            'DROP INDEX CONCURRENTLY IF EXISTS ix_order_item_product_id'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_order_client_id')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_category_parent_id')
@@ -0,0 +1,190 @@
+"""order partitions.
+
+Revision ID: d52c8f1e9a37
+Revises: b6f24c9e0d17
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd52c8f1e9a37'
+down_revision: Union[str, None] = 'b6f24c9e0d17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# partitions made past the current month,
+# `manage maintain-partitions` keeps them ahead afterwards
+MONTHS_AHEAD = 3
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def create_partitions(
+    table: str, parent: str, first: date, last: date
+) -> None:
+    """Partitions of the months from first to last, table_y2026m10 etc."""
+    month = first
+    while month <= last:
+        op.execute(
+            f'CREATE TABLE "{table}_y{month.year}m{month.month:02d}" '
+            f'PARTITION OF "{parent}" '
+            f"FOR VALUES FROM ('{month} 00:00:00+00') "
+            f"TO ('{next_month(month)} 00:00:00+00')"
+        )
+        month = next_month(month)
+
+
+def create_order_tables(partitioned: bool) -> None:
+    partition_by = (
+        {'postgresql_partition_by': 'RANGE (created_at)'}
+        if partitioned else {}
+    )
+    op.create_table('order_new',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('order_id_seq')"), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.DateTime(timezone=True), server_default=sa.text("timezone('UTC', now())"), nullable=False),
+    sa.Column('active', sa.Integer(), server_default='1', nullable=False),
+    *(
+        [sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False)]
+        if partitioned else []
+    ),
+    **partition_by,
+    )
+    partition_by = (
+        {'postgresql_partition_by': 'RANGE (order_created_at)'}
+        if partitioned else {}
+    )
+    op.create_table('order_item_new',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('order_item_id_seq')"), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('price_at_time', sa.Integer(), nullable=False),
+    *(
+        [sa.Column('order_created_at', sa.DateTime(timezone=True), nullable=False)]
+        if partitioned else []
+    ),
+    **partition_by,
+    )
+
+
+def replace_order_tables() -> None:
+    """Drops the old tables, the _new ones take their names and sequences"""
+    op.execute('ALTER SEQUENCE order_id_seq OWNED BY NONE')
+    op.execute('ALTER SEQUENCE order_item_id_seq OWNED BY NONE')
+    op.execute('DROP TABLE order_item')
+    op.execute('DROP TABLE "order"')
+    op.rename_table('order_new', 'order')
+    op.rename_table('order_item_new', 'order_item')
+    op.execute('ALTER SEQUENCE order_id_seq OWNED BY "order".id')
+    op.execute('ALTER SEQUENCE order_item_id_seq OWNED BY order_item.id')
+
+
+def create_order_constraints(partitioned: bool) -> None:
+    # a unique constraint of a partitioned table has its partition key
+    order_key = ['id', 'created_at'] if partitioned else ['id']
+    item_key = ['order_id', 'order_created_at'] if partitioned else ['order_id']
+    op.create_primary_key('order_pkey', 'order', order_key)
+    op.create_foreign_key(
+        'order_client_id_fkey', 'order', 'client',
+        ['client_id'], ['id'], ondelete='RESTRICT',
+    )
+    op.create_index('ix_order_id', 'order', ['id'])
+    op.create_index('ix_order_client_id', 'order', ['client_id', 'id'])
+    op.create_index('ix_order_date_id', 'order', ['date', 'id'])
+
+    op.create_primary_key(
+        'order_item_pkey', 'order_item',
+        ['id', 'order_created_at'] if partitioned else ['id'],
+    )
+    op.create_foreign_key(
+        f"order_item_{'_'.join(item_key)}_fkey", 'order_item', 'order',
+        item_key, order_key, ondelete='CASCADE',
+    )
+    op.create_foreign_key(
+        'order_item_product_id_fkey', 'order_item', 'product',
+        ['product_id'], ['id'], ondelete='CASCADE',
+    )
+    op.create_unique_constraint(
+        'uq_order_product', 'order_item',
+        ['order_id', 'product_id', *item_key[1:]],
+    )
+    op.create_index('ix_order_item_id', 'order_item', ['id'])
+    op.create_index(
+        'ix_order_item_product_id', 'order_item', ['product_id'],
+        postgresql_include=['quantity', 'order_id'],
+    )
+
+
+# the tables are rewritten, orders wait for the migration meanwhile.
+# created_at of the existing orders is their date, the best known value
+def upgrade() -> None:
+    op.execute('LOCK TABLE "order", order_item IN ACCESS EXCLUSIVE MODE')
+    bounds = op.get_bind().execute(
+        sa.text('SELECT min(date), max(date) FROM "order"')
+    ).one()
+    days = [
+        moment.astimezone(timezone.utc).date()
+        for moment in bounds if moment is not None
+    ]
+    days.append(datetime.now(timezone.utc).date())
+    first = min(days).replace(day=1)
+    last = max(days).replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = next_month(last)
+
+    create_order_tables(partitioned=True)
+    create_partitions('order', 'order_new', first, last)
+    create_partitions('order_item', 'order_item_new', first, last)
+    op.execute(
+        """
+        INSERT INTO order_new (id, client_id, date, active, created_at)
+        SELECT id, client_id, date, active, date FROM "order"
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO order_item_new (
+            id, order_id, product_id, quantity, price_at_time,
+            order_created_at
+        )
+        SELECT order_item.id, order_item.order_id, order_item.product_id,
+            order_item.quantity, order_item.price_at_time, "order".date
+        FROM order_item
+        JOIN "order" ON "order".id = order_item.order_id
+        """
+    )
+    replace_order_tables()
+    create_order_constraints(partitioned=True)
+
+
+# archived partitions (detached by `manage maintain-partitions`)
+# are left as they are, their orders do not come back
+def downgrade() -> None:
+    op.execute('LOCK TABLE "order", order_item IN ACCESS EXCLUSIVE MODE')
+    create_order_tables(partitioned=False)
+    op.execute(
+        """
+        INSERT INTO order_new (id, client_id, date, active)
+        SELECT id, client_id, date, active FROM "order"
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO order_item_new (
+            id, order_id, product_id, quantity, price_at_time
+        )
+        SELECT id, order_id, product_id, quantity, price_at_time
+        FROM order_item
+        """
+    )
+    replace_order_tables()
+    create_order_constraints(partitioned=False)
@@ -0,0 +1,54 @@
+"""sales rollup buckets.
+
+Revision ID: 7c2e9d40a5b3
+Revises: d52c8f1e9a37
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e9d40a5b3'
+down_revision: Union[str, None] = 'd52c8f1e9a37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# the existing rows become bucket 0
+def upgrade() -> None:
+    op.add_column(
+        'product_sales_daily',
+        sa.Column('bucket', sa.SmallInteger(), server_default='0', nullable=False),
+    )
+    op.drop_constraint('product_sales_daily_pkey', 'product_sales_daily')
+    op.create_primary_key(
+        'product_sales_daily_pkey', 'product_sales_daily',
+        ['product_id', 'day', 'bucket'],
+    )
+
+
+def downgrade() -> None:
+    op.execute('LOCK TABLE product_sales_daily IN EXCLUSIVE MODE')
+    # the buckets of a product and day are added up into bucket 0
+    op.execute(
+        """
+        WITH merged AS (
+            DELETE FROM product_sales_daily WHERE bucket <> 0
+            RETURNING product_id, day, quantity
+        )
+        INSERT INTO product_sales_daily (product_id, day, bucket, quantity)
+        SELECT product_id, day, 0, sum(quantity) FROM merged
+        GROUP BY product_id, day
+        ON CONFLICT (product_id, day, bucket) DO UPDATE
+        SET quantity = product_sales_daily.quantity + excluded.quantity
+        """
+    )
+    op.drop_constraint('product_sales_daily_pkey', 'product_sales_daily')
+    op.drop_column('product_sales_daily', 'bucket')
+    op.create_primary_key(
+        'product_sales_daily_pkey', 'product_sales_daily', ['product_id', 'day']
+    )
@@ -0,0 +1,45 @@
+"""sales rollup by order creation day.
+
+Revision ID: f3a1b7c69e02
+Revises: 7c2e9d40a5b3
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a1b7c69e02'
+down_revision: Union[str, None] = '7c2e9d40a5b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def refill_rollup(order_day: str) -> None:
+    op.execute('LOCK TABLE product_sales_daily IN EXCLUSIVE MODE')
+    op.execute('DELETE FROM product_sales_daily')
+    op.execute(
+        f"""
+        INSERT INTO product_sales_daily (product_id, day, quantity)
+        SELECT order_item.product_id,
+            ("order".{order_day} AT TIME ZONE 'UTC')::date,
+            sum(order_item.quantity)
+        FROM order_item
+        JOIN "order" ON "order".id = order_item.order_id
+            AND "order".created_at = order_item.order_created_at
+        GROUP BY 1, 2
+        """
+    )
+
+
+# an item counts on the day its order was created, as add-to-cart
+# records it now: order.date moves with every add
+def upgrade() -> None:
+    refill_rollup('created_at')
+
+
+def downgrade() -> None:
+    refill_rollup('date')
@@ -0,0 +1,35 @@
+"""sales rollup unfolded index.
+
+Revision ID: 9e4b2d7a6c15
+Revises: f3a1b7c69e02
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b2d7a6c15'
+down_revision: Union[str, None] = 'f3a1b7c69e02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# the compaction finds the rows to fold into bucket 0 without a scan
+def upgrade() -> None:
+    op.create_index(
+        'ix_product_sales_daily_unfolded',
+        'product_sales_daily',
+        ['day', 'product_id'],
+        unique=False,
+        postgresql_where=sa.text('bucket <> 0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        'ix_product_sales_daily_unfolded', table_name='product_sales_daily'
+    )
@@ -1,28 +1,87 @@
-from contextlib import asynccontextmanager
+import asyncio
+import os
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 
-from service.config import logger
+from service.background_tasks import (
+    compact_sales_rollup_periodically,
+    rebalance_stock_periodically,
+)
+from service.config import (
+    GZIP_MINIMUM_SIZE,
+    SALES_ROLLUP_COMPACT_INTERVAL,
+    STOCK_REBALANCE_INTERVAL,
+    logger,
+    server_settings,
+)
+from service.db_accessors import StatisticAccessor
 from service.db_setup.db_settings import db_connector
 from service.endpoints.data_handlers import api_router as data_routes
+from service.endpoints.export_handlers import api_router as export_routes
+from service.endpoints.import_handlers import api_router as import_routes
+from service.endpoints.monitoring_handlers import (
+    api_router as monitoring_routes,
+)
+from service.group_commit import close_cart_batcher
 from service.http_exceptions import add_exception_handlers
+from service.instrumentation import InstrumentationMiddleware
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up...")
+    StatisticAccessor.prepare_statements()
+    background_tasks = []
+    if STOCK_REBALANCE_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                rebalance_stock_periodically(STOCK_REBALANCE_INTERVAL)
+            )
+        )
+    else:
+        logger.warning(
+            "STOCK_REBALANCE_INTERVAL is 0, product.quantity of sharded "
+            "products is only updated by manage rebalance-stock"
+        )
+    if SALES_ROLLUP_COMPACT_INTERVAL > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                compact_sales_rollup_periodically(
+                    SALES_ROLLUP_COMPACT_INTERVAL
+                )
+            )
+        )
     yield
     logger.warning("Shutting down...")
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await close_cart_batcher()
+    # requests still running after the server's graceful timeout
+    # were cancelled, their transactions are rolled back meanwhile
+    await db_connector.wait_idle(server_settings["graceful_timeout"])
     await db_connector.dispose_engine()
 
 
 app = FastAPI(lifespan=lifespan)
 
 app = add_exception_handlers(app)
+if GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+app.add_middleware(InstrumentationMiddleware)
 
 app.include_router(data_routes)
+app.include_router(export_routes)
+app.include_router(import_routes)
+app.include_router(monitoring_routes)
 
 
+# development server, python -m service.server runs the production one
 if __name__ == "__main__":
+    # the reloaded app runs in one process with the whole pool
+    os.environ["WEB_WORKERS"] = "1"
     uvicorn.run("service.__main__:app", host="0.0.0.0", port=8000, reload=True)
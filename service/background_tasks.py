@@ -0,0 +1,27 @@
+import asyncio
+
+from service.config import logger
+from service.db_accessors import RollupAccessor, StockAccessor
+from service.db_setup.db_settings import db_connector
+
+
+async def rebalance_stock_periodically(interval: float) -> None:
+    """Spreads the stock of sharded products evenly over their buckets"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with db_connector.session_maker() as session:
+                await StockAccessor(session).rebalance_all()
+        except Exception as exc:
+            logger.error("Stock rebalance failed", exc_info=exc)
+
+
+async def compact_sales_rollup_periodically(interval: float) -> None:
+    """Folds the product_sales_daily buckets of the past days"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with db_connector.session_maker() as session:
+                await RollupAccessor(session).compact_product_sales_daily()
+        except Exception as exc:
+            logger.error("Sales rollup compaction failed", exc_info=exc)
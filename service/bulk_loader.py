@@ -0,0 +1,436 @@
+"""Bulk loading of catalog, client and order data with binary COPY.
+
+Rows come from a source (CSV files or generated) as dicts and are written
+chunk by chunk with asyncpg copy_records_to_table, ids are reserved from
+the table sequences up front so that references resolve in memory."""
+
+import csv
+import random
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from service.cache import COUNT_SUBCATEGORIES, statistic_cache
+from service.config import BULK_LOAD_CHUNK_ROWS
+from service.db_accessors import (
+    IS_PARTITIONED_SQL,
+    RollupAccessor,
+    create_partition_statements,
+    month_start,
+)
+
+LOADED_TABLES = ("category", "product", "client", "order", "order_item")
+
+
+def chunks(rows: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def optional(value):
+    return None if value in ("", None) else value
+
+
+class LoadReport:
+    """Rows written per table and the time spent on them"""
+
+    def __init__(self) -> None:
+        self.tables: dict[str, dict] = {}
+
+    def add(self, table: str, rows: int, seconds: float) -> None:
+        entry = self.tables.setdefault(table, {"rows": 0, "seconds": 0.0})
+        entry["rows"] += rows
+        entry["seconds"] += seconds
+
+    def summary(self) -> dict[str, dict]:
+        return {
+            table: {
+                "rows": entry["rows"],
+                "seconds": round(entry["seconds"], 3),
+                "rows_per_second": (
+                    round(entry["rows"] / entry["seconds"])
+                    if entry["seconds"]
+                    else 0
+                ),
+            }
+            for table, entry in self.tables.items()
+        }
+
+
+class BulkLoader:
+    """Writes rows in the transaction of the session's connection"""
+
+    def __init__(self, connection, chunk_rows: int = BULK_LOAD_CHUNK_ROWS):
+        self.connection = connection
+        self.chunk_rows = chunk_rows
+        self.report = LoadReport()
+        self.partitioned: bool | None = None
+        self.partition_months: set = set()
+
+    @classmethod
+    async def from_session(cls, session: AsyncSession, **kwargs):
+        """Uses the asyncpg connection under the session"""
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        return cls(raw_connection.driver_connection, **kwargs)
+
+    async def reserve_ids(self, table: str, count: int) -> list[int]:
+        return [
+            row[0]
+            for row in await self.connection.fetch(
+                "SELECT nextval(pg_get_serial_sequence($1, 'id')) "
+                "FROM generate_series(1, $2)",
+                f'"{table}"',
+                count,
+            )
+        ]
+
+    async def copy(
+        self, table: str, columns: tuple[str, ...], records: list[tuple]
+    ) -> None:
+        start = time.perf_counter()
+        await self.connection.copy_records_to_table(
+            table, records=records, columns=columns
+        )
+        self.report.add(table, len(records), time.perf_counter() - start)
+
+    async def ensure_partitions(self, moments: Iterable[datetime]) -> None:
+        """Partitions of the months of the orders, if the tables are
+        partitioned. They are created in the load transaction"""
+        if self.partitioned is None:
+            self.partitioned = await self.connection.fetchval(
+                IS_PARTITIONED_SQL
+            )
+        if not self.partitioned:
+            return
+        months = {month_start(moment) for moment in moments}
+        for month in sorted(months - self.partition_months):
+            for statement in create_partition_statements(month):
+                await self.connection.execute(statement)
+            self.partition_months.add(month)
+
+    async def drop_secondary_indexes(self, tables=LOADED_TABLES) -> list[str]:
+        """Drops the indexes which back neither a primary key nor
+        a constraint, returns their definitions for restore_indexes"""
+        rows = await self.connection.fetch(
+            """
+            SELECT index.indexrelid::regclass::text AS name,
+                -- an index of a partitioned table is restored
+                -- on its partitions too
+                replace(
+                    pg_get_indexdef(index.indexrelid), ' ON ONLY ', ' ON '
+                ) AS definition
+            FROM pg_index AS index
+            WHERE index.indrelid IN (
+                SELECT to_regclass(quote_ident(name))
+                FROM unnest($1::text[]) AS name
+            )
+            AND NOT index.indisprimary
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE pg_constraint.conindid = index.indexrelid
+            )
+            """,
+            list(tables),
+        )
+        for row in rows:
+            await self.connection.execute(f"DROP INDEX {row['name']}")
+        return [row["definition"] for row in rows]
+
+    async def restore_indexes(self, definitions: list[str]) -> None:
+        start = time.perf_counter()
+        for definition in definitions:
+            await self.connection.execute(definition)
+        self.report.add(
+            "indexes", len(definitions), time.perf_counter() - start
+        )
+
+    async def load_categories(self, rows: Iterable[dict]) -> dict[str, int]:
+        """Rows: key, title, parent_key (empty for top-level).
+        Parents are written before their children, so the closure
+        triggers find the parent's ancestors. Returns key -> id"""
+        categories = {row["key"]: row for row in rows}
+        ids = dict(
+            zip(
+                categories,
+                await self.reserve_ids("category", len(categories)),
+            )
+        )
+        ordered: list[tuple] = []
+        placed: set[str] = set()
+        for key in categories:
+            path = []
+            # walk up to a placed category or a root
+            while key is not None and key not in placed:
+                if key in path:
+                    raise ValueError(f"Category cycle at {key}")
+                path.append(key)
+                key = optional(categories[key].get("parent_key"))
+                if key is not None and key not in categories:
+                    raise ValueError(f"Unknown parent category {key}")
+            for key in reversed(path):
+                parent_key = optional(categories[key].get("parent_key"))
+                ordered.append(
+                    (
+                        ids[key],
+                        categories[key]["title"],
+                        ids[parent_key] if parent_key else None,
+                    )
+                )
+                placed.add(key)
+
+        for chunk in chunks(ordered, self.chunk_rows):
+            await self.copy("category", ("id", "title", "parent_id"), chunk)
+        return ids
+
+    async def load_products(
+        self, rows: Iterable[dict], category_ids: dict[str, int]
+    ) -> array:
+        """Rows: title, price, quantity and category_key of this load
+        or category_id of an existing category. Returns the new ids"""
+        product_ids = array("q")
+        for chunk in chunks(rows, self.chunk_rows):
+            ids = await self.reserve_ids("product", len(chunk))
+            records = [
+                (
+                    product_id,
+                    row["title"],
+                    Decimal(str(row["price"])),
+                    int(
+                        optional(row.get("category_id"))
+                        or category_ids[row["category_key"]]
+                    ),
+                    int(row.get("quantity") or 0),
+                )
+                for product_id, row in zip(ids, chunk)
+            ]
+            await self.copy(
+                "product",
+                ("id", "title", "price", "category_id", "quantity"),
+                records,
+            )
+            product_ids.extend(ids)
+        return product_ids
+
+    async def load_clients(self, rows: Iterable[dict]) -> array:
+        """Rows: name, email, address. Returns the new ids"""
+        client_ids = array("q")
+        for chunk in chunks(rows, self.chunk_rows):
+            ids = await self.reserve_ids("client", len(chunk))
+            records = [
+                (
+                    client_id,
+                    row["name"],
+                    row["email"],
+                    optional(row.get("address")),
+                )
+                for client_id, row in zip(ids, chunk)
+            ]
+            await self.copy(
+                "client", ("id", "name", "email", "address"), records
+            )
+            client_ids.extend(ids)
+        return client_ids
+
+    async def load_orders(self, rows: Iterable[dict]) -> int:
+        """Rows, one per order item, grouped by order_key: order_key,
+        client_id, date, product_id, quantity, price_at_time.
+        Returns the number of orders"""
+        orders = 0
+        current_key, current_id = None, None
+        for chunk in chunks(rows, self.chunk_rows):
+            new_orders, previous_key = 0, current_key
+            for row in chunk:
+                if row["order_key"] != previous_key:
+                    new_orders, previous_key = new_orders + 1, row["order_key"]
+            ids = iter(await self.reserve_ids("order", new_orders))
+
+            # a loaded order was created at its date
+            order_records, item_records = [], []
+            for row in chunk:
+                if row["order_key"] != current_key:
+                    current_key, current_id = row["order_key"], next(ids)
+                    created_at = as_datetime(row["date"])
+                    order_records.append(
+                        (
+                            current_id,
+                            int(row["client_id"]),
+                            created_at,
+                            created_at,
+                        )
+                    )
+                item_records.append(
+                    (
+                        current_id,
+                        created_at,
+                        int(row["product_id"]),
+                        int(row["quantity"]),
+                        int(row["price_at_time"]),
+                    )
+                )
+            await self.ensure_partitions(
+                created_at for _, _, _, created_at in order_records
+            )
+            await self.copy(
+                "order",
+                ("id", "client_id", "date", "created_at"),
+                order_records,
+            )
+            await self.copy(
+                "order_item",
+                (
+                    "order_id",
+                    "order_created_at",
+                    "product_id",
+                    "quantity",
+                    "price_at_time",
+                ),
+                item_records,
+            )
+            orders += len(order_records)
+        return orders
+
+
+class CsvSource:
+    """categories.csv, products.csv, clients.csv and orders.csv
+    of a directory, every file is optional and read lazily"""
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+
+    def _read(self, name: str) -> Iterator[dict]:
+        path = self.directory / name
+        if not path.exists():
+            return
+        with path.open(newline="") as file:
+            yield from csv.DictReader(file)
+
+    def categories(self) -> Iterable[dict]:
+        return self._read("categories.csv")
+
+    def products(self) -> Iterable[dict]:
+        return self._read("products.csv")
+
+    def clients(self) -> Iterable[dict]:
+        return self._read("clients.csv")
+
+    def orders(self, client_ids: array, product_ids: array) -> Iterable[dict]:
+        return self._read("orders.csv")
+
+
+class SyntheticSource:
+    """Generated catalog: `fanout` top-level categories, each with
+    `fanout` children down to `depth`, products in the leaf categories,
+    clients and orders over the last year"""
+
+    def __init__(
+        self,
+        clients: int,
+        products: int,
+        orders: int,
+        items_per_order: int = 3,
+        category_depth: int = 3,
+        category_fanout: int = 5,
+        seed: int = 0,
+    ) -> None:
+        self.clients_count = clients
+        self.products_count = products
+        self.orders_count = orders
+        self.items_per_order = items_per_order
+        self.category_depth = category_depth
+        self.category_fanout = category_fanout
+        self.random = random.Random(seed)
+        self.leaf_keys: list[str] = []
+
+    def categories(self) -> Iterator[dict]:
+        level = [None]
+        for depth in range(1, self.category_depth + 1):
+            children = []
+            for parent_key in level:
+                for number in range(1, self.category_fanout + 1):
+                    key = f"{parent_key or 'c'}.{number}"
+                    children.append(key)
+                    yield {
+                        "key": key,
+                        "title": f"Category {key[2:]}",
+                        "parent_key": parent_key,
+                    }
+            level = children
+        self.leaf_keys = level
+
+    def products(self) -> Iterator[dict]:
+        for number in range(1, self.products_count + 1):
+            yield {
+                "title": f"Product {number}",
+                "price": number % 100 + 1,
+                "category_key": self.leaf_keys[number % len(self.leaf_keys)],
+                "quantity": 1_000_000,
+            }
+
+    def clients(self) -> Iterator[dict]:
+        for number in range(1, self.clients_count + 1):
+            yield {
+                "name": f"Client {number}",
+                "email": f"client{number}@mail.com",
+                "address": None,
+            }
+
+    def orders(self, client_ids: array, product_ids: array) -> Iterator[dict]:
+        if not client_ids or not product_ids:
+            return
+        now = datetime.now(timezone.utc)
+        items = min(self.items_per_order, len(product_ids))
+        for number in range(self.orders_count):
+            date = now - timedelta(days=self.random.randrange(365))
+            client_id = self.random.choice(client_ids)
+            for product_index in self.random.sample(
+                range(len(product_ids)), items
+            ):
+                yield {
+                    "order_key": number,
+                    "client_id": client_id,
+                    "date": date,
+                    "product_id": product_ids[product_index],
+                    "quantity": self.random.randint(1, 3),
+                    "price_at_time": self.random.randint(1, 100),
+                }
+
+
+async def load(
+    session: AsyncSession, source, drop_indexes: bool = False
+) -> LoadReport:
+    """Loads everything the source has in one transaction"""
+    loader = await BulkLoader.from_session(session)
+    definitions = await loader.drop_secondary_indexes() if drop_indexes else []
+    category_ids = await loader.load_categories(source.categories())
+    product_ids = await loader.load_products(source.products(), category_ids)
+    client_ids = await loader.load_clients(source.clients())
+    orders = await loader.load_orders(source.orders(client_ids, product_ids))
+    await loader.restore_indexes(definitions)
+    await session.commit()
+    if category_ids:
+        await statistic_cache.invalidate(COUNT_SUBCATEGORIES)
+
+    if orders:
+        # COPY bypasses the updates made by add-to-cart
+        await RollupAccessor(session).rebuild_product_sales_daily()
+        await RollupAccessor(session).reconcile_client_order_totals(
+            repair=True
+        )
+    return loader.report
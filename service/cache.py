@@ -0,0 +1,233 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from service.config import cache_settings
+
+MISSING = object()
+
+# cache namespaces, one per statistic endpoint
+CLIENT_ORDER_SUM = "client-order-sum"
+COUNT_SUBCATEGORIES = "count-subcategories"
+STATISTIC_ORDER = "statistic-order"
+
+
+class CacheBackend(ABC):
+    """Storage of the cached values and of the namespace generations.
+    A backend shared between workers (e.g. redis) has to serialize
+    the values itself, implement delete_prefix with a key scan and keep
+    the generations shared too (e.g. INCR), so that an invalidation by
+    one worker reaches the others"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        """Returns the value or MISSING"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str) -> None: ...
+
+    @abstractmethod
+    async def clear(self) -> None: ...
+
+    @abstractmethod
+    async def get_generation(self, namespace: str) -> int:
+        """Incremented by every invalidation of the namespace"""
+
+    @abstractmethod
+    async def bump_generation(self, namespace: str) -> None: ...
+
+
+class InMemoryCache(CacheBackend):
+    """LRU cache of one worker process, entries expire after their ttl.
+    An invalidation reaches only this process: the writes of the other
+    workers and of the manage commands are seen after at most max_ttl
+    seconds, which caps the ttls (None - not capped)"""
+
+    def __init__(self, max_entries: int, max_ttl: float | None = None) -> None:
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._generations: dict[str, int] = {}
+
+    async def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        if self.max_ttl is not None:
+            ttl = min(ttl, self.max_ttl)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete_prefix(self, prefix: str) -> None:
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    async def bump_generation(self, namespace: str) -> None:
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+
+class NoCache(CacheBackend):
+    async def get(self, key: str) -> Any:
+        return MISSING
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        pass
+
+    async def delete_prefix(self, prefix: str) -> None:
+        pass
+
+    async def clear(self) -> None:
+        pass
+
+    async def get_generation(self, namespace: str) -> int:
+        return 0
+
+    async def bump_generation(self, namespace: str) -> None:
+        pass
+
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    """Marks the exception as retrieved when nobody waited for it"""
+    if not future.cancelled():
+        future.exception()
+
+
+class StatisticCache:
+    """Keys look like "<namespace>:<arguments>", a namespace is invalidated
+    as a whole. Concurrent misses of one key run the loader once"""
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def get_or_load(
+        self, key: str, ttl: float, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = await self.backend.get(key)
+        if value is not MISSING:
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                return await asyncio.shield(in_flight)
+            except Exception:
+                # the first caller failed, load with our own session
+                return await loader()
+
+        namespace = key.split(":", 1)[0]
+        generation = await self.backend.get_generation(namespace)
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._in_flight[key] = future
+        try:
+            value = await loader()
+        except BaseException as exc:
+            future.set_exception(
+                exc if isinstance(exc, Exception) else RuntimeError(exc)
+            )
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+        # a write during the load could make the value stale
+        if await self.backend.get_generation(namespace) == generation:
+            await self.backend.set(key, value, ttl)
+        future.set_result(value)
+        return value
+
+    async def invalidate(self, *namespaces: str) -> None:
+        for namespace in namespaces:
+            await self.backend.bump_generation(namespace)
+            for key in [
+                key
+                for key in self._in_flight
+                if key.startswith(f"{namespace}:")
+            ]:
+                del self._in_flight[key]
+            await self.backend.delete_prefix(f"{namespace}:")
+
+    async def clear(self) -> None:
+        self._in_flight.clear()
+        await self.backend.clear()
+
+
+class CachedStatisticAccessor:
+    """Same methods as StatisticAccessor, answers are served from the cache.
+    max_ttl caps the ttls, e.g. for answers of a lagging replica"""
+
+    def __init__(
+        self, accessor, cache: StatisticCache, max_ttl: float | None = None
+    ) -> None:
+        self.accessor = accessor
+        self.cache = cache
+        self.max_ttl = max_ttl
+
+    def _ttl(self, setting: str) -> float:
+        if self.max_ttl is None:
+            return cache_settings[setting]
+        return min(cache_settings[setting], self.max_ttl)
+
+    async def get_client_orders_sum(
+        self, exact: bool = False, after_id=None, limit=None
+    ):
+        if exact:
+            return await self.accessor.get_client_orders_sum(
+                exact=True, after_id=after_id, limit=limit
+            )
+        return await self.cache.get_or_load(
+            f"{CLIENT_ORDER_SUM}:{after_id}:{limit}",
+            self._ttl("ttl_client_order_sum"),
+            lambda: self.accessor.get_client_orders_sum(
+                after_id=after_id, limit=limit
+            ),
+        )
+
+    async def get_count_subcategories(self):
+        return await self.cache.get_or_load(
+            f"{COUNT_SUBCATEGORIES}:",
+            self._ttl("ttl_count_subcategories"),
+            self.accessor.get_count_subcategories,
+        )
+
+    async def get_top_selling_products(self, **params):
+        arguments = ":".join(
+            f"{name}={value}" for name, value in sorted(params.items())
+        )
+        return await self.cache.get_or_load(
+            f"{STATISTIC_ORDER}:{arguments}",
+            self._ttl("ttl_statistic_order"),
+            lambda: self.accessor.get_top_selling_products(**params),
+        )
+
+
+CACHE_BACKENDS: dict[str, Callable[[], CacheBackend]] = {
+    "memory": lambda: InMemoryCache(
+        cache_settings["max_entries"], cache_settings["memory_max_ttl"] or None
+    ),
+    "none": NoCache,
+}
+
+statistic_cache = StatisticCache(CACHE_BACKENDS[cache_settings["backend"]]())
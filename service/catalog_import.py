@@ -0,0 +1,388 @@
+"""Bulk upsert of products and clients from an uploaded NDJSON or CSV body.
+
+The body is parsed line by line and staged chunk by chunk into a temporary
+table with COPY, then merged with one INSERT ... ON CONFLICT, so memory
+stays bounded whatever the upload size."""
+
+import csv
+import json
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import AsyncIterator, Callable
+
+from sqlalchemy import JSON, Integer, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from service.bulk_loader import BulkLoader
+from service.cache import CLIENT_ORDER_SUM, STATISTIC_ORDER, statistic_cache
+from service.config import BULK_LOAD_CHUNK_ROWS
+
+MAX_REPORTED_ERRORS = 100
+# longer lines are rejected without being buffered
+MAX_LINE_BYTES = 64 * 1024
+# a quoted CSV field may span lines, a record is rejected past this
+MAX_RECORD_LINES = 100
+
+# the largest values of the integer and numeric(10, 2) columns
+INT4_MAX = 2**31 - 1
+PRICE_MAX = Decimal("99999999.99")
+CENTS = Decimal("0.01")
+
+
+class RowRejected(ValueError):
+    pass
+
+
+def decode_line(line: bytes) -> str | RowRejected:
+    if len(line) > MAX_LINE_BYTES:
+        return RowRejected(f"longer than {MAX_LINE_BYTES} bytes")
+    try:
+        return line.decode().rstrip("\r")
+    except UnicodeDecodeError:
+        return RowRejected("invalid UTF-8")
+
+
+async def read_lines(
+    body: AsyncIterator[bytes],
+) -> AsyncIterator[str | RowRejected]:
+    """Lines of the body, a RowRejected in place of a line which
+    can not be read"""
+    buffer, too_long = b"", False
+    async for chunk in body:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if too_long:
+                too_long = False
+                yield RowRejected(f"longer than {MAX_LINE_BYTES} bytes")
+            else:
+                yield decode_line(line)
+        if len(buffer) > MAX_LINE_BYTES:
+            # the rest of the line is dropped up to its newline
+            buffer, too_long = b"", True
+    if too_long:
+        yield RowRejected(f"longer than {MAX_LINE_BYTES} bytes")
+    elif buffer:
+        yield decode_line(buffer)
+
+
+async def read_ndjson(
+    lines: AsyncIterator[str | RowRejected],
+) -> AsyncIterator[tuple[int, dict | RowRejected]]:
+    number = 0
+    async for line in lines:
+        number += 1
+        if isinstance(line, RowRejected):
+            yield number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, RowRejected("invalid JSON")
+            continue
+        if not isinstance(row, dict):
+            yield number, RowRejected("a JSON object is expected")
+            continue
+        yield number, row
+
+
+async def read_csv(
+    lines: AsyncIterator[str | RowRejected],
+) -> AsyncIterator[tuple[int, dict | RowRejected]]:
+    """The first record is the header. A quoted field may hold newlines,
+    its lines are joined until the quotes are balanced, for up to
+    MAX_RECORD_LINES lines and MAX_LINE_BYTES characters"""
+    header = None
+    record: list[str] = []
+    start = number = quotes = size = 0
+    async for line in lines:
+        number += 1
+        if isinstance(line, RowRejected):
+            yield (start if record else number), line
+            record, quotes, size = [], 0, 0
+            continue
+        if not record:
+            start = number
+        record.append(line)
+        quotes += line.count('"')
+        size += len(line)
+        if quotes % 2:
+            if len(record) >= MAX_RECORD_LINES or size > MAX_LINE_BYTES:
+                yield start, RowRejected("unterminated quoted field")
+                record, quotes, size = [], 0, 0
+            continue
+        values = next(csv.reader(["\n".join(record)]))
+        record, quotes, size = [], 0, 0
+        if header is None:
+            header = values
+        elif len(values) != len(header):
+            yield start, RowRejected(f"{len(header)} fields are expected")
+        elif any(values):
+            yield start, dict(zip(header, values))
+    if record:
+        yield start, RowRejected("unterminated quoted field")
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+async def achunks(
+    rows: AsyncIterator, size: int = BULK_LOAD_CHUNK_ROWS
+) -> AsyncIterator[list]:
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def field(row: dict, name: str, convert: Callable, **limits):
+    """The value of an optional field, None when it is absent or empty"""
+    value = row.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        value = convert(value)
+    except (TypeError, ValueError, InvalidOperation):
+        raise RowRejected(f"{name}: invalid value {value!r}")
+    if isinstance(value, Decimal) and not value.is_finite():
+        raise RowRejected(f"{name}: not a finite number")
+    try:
+        if "max_length" in limits and len(value) > limits["max_length"]:
+            raise RowRejected(f"{name}: longer than {limits['max_length']}")
+        if "minimum" in limits and value < limits["minimum"]:
+            raise RowRejected(f"{name}: less than {limits['minimum']}")
+        if "maximum" in limits and value > limits["maximum"]:
+            raise RowRejected(f"{name}: more than {limits['maximum']}")
+    except (TypeError, InvalidOperation):
+        raise RowRejected(f"{name}: invalid value {value!r}")
+    return value
+
+
+def to_price(value) -> Decimal:
+    """Rounded to cents as numeric(10, 2) stores it"""
+    return Decimal(str(value)).quantize(CENTS, ROUND_HALF_UP)
+
+
+def parse_product(row: dict) -> tuple:
+    return (
+        field(row, "id", int, minimum=1, maximum=INT4_MAX),
+        field(row, "title", str, max_length=50),
+        field(row, "price", to_price, minimum=0, maximum=PRICE_MAX),
+        field(row, "category_id", int, minimum=1, maximum=INT4_MAX),
+        field(row, "quantity", int, minimum=0, maximum=INT4_MAX),
+    )
+
+
+def parse_client(row: dict) -> tuple:
+    email = field(row, "email", str, max_length=30)
+    if email is None:
+        raise RowRejected("email is required")
+    return (
+        email,
+        field(row, "name", str, max_length=40),
+        field(row, "address", str, max_length=120),
+    )
+
+
+# every candidate row gets a reason when it can not be merged,
+# of several rows with one key the last line wins
+PRODUCT_MERGE = """
+WITH staged AS (
+    SELECT import_product.*,
+        row_number() OVER (
+            PARTITION BY coalesce(import_product.id, -line)
+            ORDER BY line DESC
+        ) AS position
+    FROM import_product
+),
+checked AS (
+    SELECT staged.line,
+        coalesce(staged.id, product.id) AS id,
+        coalesce(staged.title, product.title) AS title,
+        coalesce(staged.price, product.price) AS price,
+        coalesce(staged.category_id, product.category_id) AS category_id,
+        -- product.quantity of a sharded product is as of the last
+        -- rebalance, its stock is the sum of the buckets
+        coalesce(
+            staged.quantity,
+            CASE WHEN product.stock_buckets > 0 THEN (
+                SELECT sum(product_stock_bucket.quantity)
+                FROM product_stock_bucket
+                WHERE product_stock_bucket.product_id = product.id
+            ) ELSE product.quantity END,
+            0
+        ) AS quantity,
+        CASE
+            WHEN staged.position > 1 THEN 'superseded by a later line'
+            WHEN staged.id IS NOT NULL AND product.id IS NULL
+                THEN 'unknown product id'
+            WHEN staged.id IS NULL AND (staged.title IS NULL
+                OR staged.price IS NULL OR staged.category_id IS NULL)
+                THEN 'title, price and category_id are required'
+            WHEN staged.category_id IS NOT NULL AND category.id IS NULL
+                THEN 'unknown category_id'
+            WHEN staged.quantity IS NOT NULL AND product.stock_buckets > 0
+                THEN 'the stock is sharded, unshard it first'
+        END AS reason
+    FROM staged
+    LEFT JOIN product ON product.id = staged.id
+    LEFT JOIN category ON category.id = staged.category_id
+),
+merged AS (
+    INSERT INTO product (id, title, price, category_id, quantity)
+    SELECT coalesce(id, nextval(pg_get_serial_sequence('product', 'id'))),
+        title, price, category_id, quantity
+    FROM checked
+    WHERE reason IS NULL
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        price = EXCLUDED.price,
+        category_id = EXCLUDED.category_id,
+        quantity = EXCLUDED.quantity
+    RETURNING xmax = 0 AS inserted
+)
+"""
+
+CLIENT_MERGE = """
+WITH staged AS (
+    SELECT import_client.*,
+        row_number() OVER (PARTITION BY email ORDER BY line DESC)
+            AS position
+    FROM import_client
+),
+checked AS (
+    SELECT staged.line, staged.email,
+        coalesce(staged.name, client.name) AS name,
+        coalesce(staged.address, client.address) AS address,
+        CASE
+            WHEN staged.position > 1 THEN 'superseded by a later line'
+            WHEN staged.name IS NULL AND client.id IS NULL
+                THEN 'name is required'
+        END AS reason
+    FROM staged
+    LEFT JOIN client ON client.email = staged.email
+),
+merged AS (
+    INSERT INTO client (email, name, address)
+    SELECT email, name, address
+    FROM checked
+    WHERE reason IS NULL
+    ON CONFLICT (email) DO UPDATE SET
+        name = EXCLUDED.name,
+        address = EXCLUDED.address
+    RETURNING xmax = 0 AS inserted
+)
+"""
+
+MERGE_RESULT = """
+SELECT
+    (SELECT count(*) FROM merged WHERE inserted) AS inserted,
+    (SELECT count(*) FROM merged WHERE NOT inserted) AS updated,
+    (SELECT count(*) FROM checked WHERE reason IS NOT NULL) AS rejected,
+    (
+        SELECT coalesce(json_agg(errors ORDER BY line), '[]')
+        FROM (
+            SELECT line, reason FROM checked
+            WHERE reason IS NOT NULL
+            ORDER BY line
+            LIMIT :max_errors
+        ) AS errors
+    ) AS errors
+"""
+
+
+@dataclass(frozen=True)
+class ImportSpec:
+    table: str
+    columns: tuple[str, ...]
+    column_types: str
+    parse: Callable[[dict], tuple]
+    merge: str
+
+
+IMPORTS = {
+    "products": ImportSpec(
+        table="import_product",
+        columns=("id", "title", "price", "category_id", "quantity"),
+        column_types="id integer, title varchar(50), price numeric(10, 2), "
+        "category_id integer, quantity integer",
+        parse=parse_product,
+        merge=PRODUCT_MERGE,
+    ),
+    "clients": ImportSpec(
+        table="import_client",
+        columns=("email", "name", "address"),
+        column_types="email varchar(30), name varchar(40), "
+        "address varchar(120)",
+        parse=parse_client,
+        merge=CLIENT_MERGE,
+    ),
+}
+
+
+class CatalogImporter:
+    def __init__(self, session: AsyncSession, spec: ImportSpec) -> None:
+        self.session = session
+        self.spec = spec
+        self.rejected = 0
+        self.errors: list[dict] = []
+
+    def reject(self, line: int, reason: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "reason": reason})
+
+    async def _parsed(self, rows) -> AsyncIterator[tuple]:
+        async for line, row in rows:
+            try:
+                if isinstance(row, RowRejected):
+                    raise row
+                yield (line, *self.spec.parse(row))
+            except RowRejected as exc:
+                self.reject(line, str(exc))
+
+    async def run(self, body: AsyncIterator[bytes], body_format: str) -> dict:
+        """Stages the body and merges it in one transaction"""
+        rows = READERS[body_format](read_lines(body))
+        async with self.session.begin():
+            await self.session.execute(
+                text(
+                    f"CREATE TEMPORARY TABLE {self.spec.table} "
+                    f"(line integer, {self.spec.column_types}) "
+                    "ON COMMIT DROP"
+                )
+            )
+            loader = await BulkLoader.from_session(self.session)
+            async for chunk in achunks(self._parsed(rows)):
+                await loader.copy(
+                    self.spec.table, ("line", *self.spec.columns), chunk
+                )
+            result = (
+                await self.session.execute(
+                    text(self.spec.merge + MERGE_RESULT).columns(
+                        inserted=Integer,
+                        updated=Integer,
+                        rejected=Integer,
+                        errors=JSON,
+                    ),
+                    {"max_errors": MAX_REPORTED_ERRORS},
+                )
+            ).one()
+
+        if result.inserted or result.updated:
+            await statistic_cache.invalidate(CLIENT_ORDER_SUM, STATISTIC_ORDER)
+        errors = sorted(
+            self.errors + result.errors, key=lambda error: error["line"]
+        )
+        return {
+            "inserted": result.inserted,
+            "updated": result.updated,
+            "rejected": self.rejected + result.rejected,
+            "errors": errors[:MAX_REPORTED_ERRORS],
+        }
@@ -1,8 +1,10 @@
 import logging
-from os import environ
+from os import cpu_count, environ
 
 from dotenv import load_dotenv
 
+from service.logging_setup import configure_logging, parse_sampling
+
 load_dotenv()
 
 DEBUG = environ.get("DEBUG", None) == "True"
@@ -16,14 +18,125 @@ db_settings = {
     "db_driver": environ.get("DB_DRIVER"),
 }
 
-logging.basicConfig(
-    filename=("logs.log" if DEBUG else None),
-    level=(logging.INFO if DEBUG else logging.WARNING),
-    format=(
-        "[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s"
+db_pool_settings = {
+    "pool_size": int(environ.get("DB_POOL_SIZE", 10)),
+    "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 5)),
+    "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 20)),
+    "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 280)),
+    "pool_pre_ping": environ.get("DB_POOL_PRE_PING", "True") == "True",
+    "statement_cache_size": int(environ.get("DB_STATEMENT_CACHE_SIZE", 100)),
+    "echo": environ.get("DB_ECHO", None) == "True",
+    # connections of all the workers to one server, 0 - no limit
+    "connection_budget": int(environ.get("DB_CONNECTION_BUDGET", 0)),
+}
+
+server_settings = {
+    "host": environ.get("WEB_HOST", "0.0.0.0"),
+    "port": int(environ.get("WEB_PORT", 8000)),
+    # 0 - one per CPU
+    "workers": int(environ.get("WEB_WORKERS", 0)) or cpu_count() or 1,
+    "loop": environ.get("WEB_LOOP", "uvloop"),
+    "http": environ.get("WEB_HTTP", "httptools"),
+    "backlog": int(environ.get("WEB_BACKLOG", 2048)),
+    "keep_alive": int(environ.get("WEB_KEEP_ALIVE", 5)),
+    # for the running requests and transactions on shutdown
+    "graceful_timeout": float(environ.get("WEB_GRACEFUL_TIMEOUT", 30)),
+}
+
+db_replica_settings = {
+    # SQLAlchemy URLs of the read replicas, comma separated
+    "urls": [
+        url.strip()
+        for url in environ.get("DB_REPLICA_URLS", "").split(",")
+        if url.strip()
+    ],
+    "max_lag_seconds": float(environ.get("DB_REPLICA_MAX_LAG", 5)),
+    "check_interval": float(environ.get("DB_REPLICA_CHECK_INTERVAL", 5)),
+    "check_timeout": float(environ.get("DB_REPLICA_CHECK_TIMEOUT", 1)),
+}
+
+CART_SINGLE_STATEMENT = environ.get("CART_SINGLE_STATEMENT", None) == "True"
+
+cart_batch_settings = {
+    # add-to-cart requests of this window share a transaction, 0 - off
+    "window_ms": float(environ.get("CART_BATCH_WINDOW_MS", 0)),
+    "max_items": int(environ.get("CART_BATCH_MAX_ITEMS", 64)),
+}
+
+cache_settings = {
+    "backend": environ.get("CACHE_BACKEND", "memory"),
+    "max_entries": int(environ.get("CACHE_MAX_ENTRIES", 1024)),
+    "ttl_client_order_sum": float(
+        environ.get("CACHE_TTL_CLIENT_ORDER_SUM", 30)
     ),
-    datefmt=("%H:%M:%S" if DEBUG else "%Y-%m-%d %H:%M:%S"),
+    "ttl_count_subcategories": float(
+        environ.get("CACHE_TTL_COUNT_SUBCATEGORIES", 300)
+    ),
+    "ttl_statistic_order": float(environ.get("CACHE_TTL_STATISTIC_ORDER", 60)),
+    # the memory cache of a worker does not see the invalidations by the
+    # other workers and the manage commands, its ttls are capped, 0 - off
+    "memory_max_ttl": float(environ.get("CACHE_MEMORY_MAX_TTL", 10)),
+}
+
+STOCK_BUCKETS = int(environ.get("STOCK_BUCKETS", 8))
+# product_sales_daily rows per product and day, concurrent sales of a
+# product are spread over them by the database connection
+SALES_ROLLUP_BUCKETS = int(environ.get("SALES_ROLLUP_BUCKETS", 8))
+# seconds, 0 - off: the buckets of the past days are folded into one row
+SALES_ROLLUP_COMPACT_INTERVAL = float(
+    environ.get("SALES_ROLLUP_COMPACT_INTERVAL", 3600)
 )
+# seconds, 0 - off: product.quantity of sharded products is not refreshed
+STOCK_REBALANCE_INTERVAL = float(environ.get("STOCK_REBALANCE_INTERVAL", 30))
+
+# sqlalchemy or asyncpg (the same SQL run by the driver directly)
+STATISTIC_ACCESSOR = environ.get("STATISTIC_ACCESSOR", "sqlalchemy")
+
+# list endpoints encode the rows with orjson / msgpack,
+# without validating them through the response models
+FAST_RESPONSES = environ.get("FAST_RESPONSES", None) == "True"
+# responses from this size are gzipped for clients which accept it, 0 - off
+GZIP_MINIMUM_SIZE = int(environ.get("GZIP_MINIMUM_SIZE", 1000))
+
+partition_settings = {
+    # partitions of order / order_item kept ready past the current month
+    "months_ahead": int(environ.get("ORDER_PARTITION_MONTHS_AHEAD", 3)),
+    # older months with only inactive orders are archived
+    "retention_months": int(
+        environ.get("ORDER_PARTITION_RETENTION_MONTHS", 12)
+    ),
+    "archive_schema": environ.get("ORDER_ARCHIVE_SCHEMA", "archive"),
+}
+
+EXPORT_BATCH_SIZE = int(environ.get("EXPORT_BATCH_SIZE", 1000))
+BULK_LOAD_CHUNK_ROWS = int(environ.get("BULK_LOAD_CHUNK_ROWS", 10000))
+
+slow_query_settings = {
+    # 0 - the slow query log is off
+    "threshold_ms": float(environ.get("SLOW_QUERY_MS", 200)),
+    "explain_sample_rate": float(
+        environ.get("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0)
+    ),
+    "buffer_size": int(environ.get("SLOW_QUERY_BUFFER_SIZE", 100)),
+}
+
+log_settings = {
+    "level": environ.get("LOG_LEVEL", "INFO" if DEBUG else "WARNING"),
+    "filename": environ.get("LOG_FILE", "logs.log" if DEBUG else None),
+    # json or text
+    "log_format": environ.get("LOG_FORMAT", "json"),
+    "sampling": parse_sampling(environ.get("LOG_SAMPLING", "")),
+    "queue_size": int(environ.get("LOG_QUEUE_SIZE", 10000)),
+}
+
+configure_logging(**log_settings)
 logger = logging.getLogger(__name__)
 
-logger.info(f"DB settings: {db_settings}")
+logger.info(
+    "DB settings: %s",
+    {
+        name: value
+        for name, value in db_settings.items()
+        if name != "db_password"
+    },
+)
@@ -1,29 +1,70 @@
-from datetime import datetime, timedelta
-from typing import Optional
+import itertools
+import re
+from datetime import date, datetime, timedelta, timezone
+from functools import cache
+from typing import AsyncIterator, Optional
 
 import pytz
-from sqlalchemy import Integer, func, join, select, text
+from sqlalchemy import (
+    ARRAY,
+    Date,
+    Integer,
+    and_,
+    any_,
+    bindparam,
+    case,
+    column,
+    delete,
+    exists,
+    func,
+    join,
+    literal,
+    select,
+    text,
+    true,
+    tuple_,
+    update,
+    values,
+)
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
-from service.config import logger
+from service.cache import CLIENT_ORDER_SUM, STATISTIC_ORDER, statistic_cache
+from service.config import EXPORT_BATCH_SIZE, SALES_ROLLUP_BUCKETS, logger
 from service.db_setup.models import (
     Category,
+    CategoryClosure,
     Client,
+    ClientOrderTotal,
     Order,
     OrderItem,
     Product,
+    ProductSalesDaily,
+    ProductStockBucket,
 )
 from service.exceptions import (
     ClientNotFound,
+    InvalidDateRange,
     OrderNotFound,
     ProductNotAvailable,
     ProductNotFound,
 )
 
 
+def sales_bucket():
+    """The product_sales_daily bucket of the current connection: a
+    connection runs one transaction at a time, so concurrent sales of a
+    product are added to different rows"""
+    return func.pg_backend_pid() % SALES_ROLLUP_BUCKETS
+
+
+def sale_day(order_created_at):
+    """SQL of OrderProductAccessor._sales_day"""
+    return func.date(func.timezone("UTC", order_created_at))
+
+
 class DbAccessor:
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -34,13 +75,20 @@ class OrderClientAccessor(DbAccessor):
     async def create_new_order(self, client_id: int) -> int | None:
         if not await self.get_client(client_id):
             logger.info(
-                f"Client {client_id} not found when creating new order"
+                "Client %s not found when creating new order", client_id
             )
             raise ClientNotFound(f"Client {client_id} not found")
 
         stmt = insert(Order).values(client_id=client_id)
         result = await self.session.execute(stmt)
+        # a client with orders is listed with a zero sum until items appear
+        await self.session.execute(
+            insert(ClientOrderTotal)
+            .values(client_id=client_id, total_sum=0)
+            .on_conflict_do_nothing(index_elements=["client_id"])
+        )
         await self.session.commit()
+        await statistic_cache.invalidate(CLIENT_ORDER_SUM)
         return (
             result.inserted_primary_key[0]
             if result.inserted_primary_key
@@ -61,6 +109,7 @@ class OrderProductAccessor(DbAccessor):
         #     # Database errors
         #     logger.error(f"Database error in upsert_order_item: {e}")
         #     raise
+        await statistic_cache.invalidate(CLIENT_ORDER_SUM, STATISTIC_ORDER)
 
     async def _add_product_to_order(
         self, order_id: int, product_id: int, quantity: int
@@ -77,19 +126,243 @@ class OrderProductAccessor(DbAccessor):
             product = await self._get_product_with_lock(
                 product_id, current_session
             )
-            if not product:
-                raise ProductNotFound(f"Product {product_id} not found")
+            if product:
+                if product.quantity < quantity:
+                    raise ProductNotAvailable(
+                        f"Insufficient stock. Available: {product.quantity}"
+                    )
+                product.quantity -= quantity
+            else:
+                product = await current_session.get(Product, product_id)
+                if not product:
+                    raise ProductNotFound(f"Product {product_id} not found")
+                await self._take_sharded_stock(product_id, quantity)
 
-            if product.quantity < quantity:
-                raise ProductNotAvailable(
-                    f"Insufficient stock. Available: {product.quantity}"
+            price_at_time = await self._upsert_order_item(
+                order_id, order.created_at, product_id, quantity, product.price
+            )
+            await self._add_to_client_total(
+                order.client_id, quantity * price_at_time
+            )
+            await self._record_sales(
+                {(product_id, self._sales_day(order.created_at)): quantity}
+            )
+
+    async def _take_sharded_stock(self, product_id: int, quantity: int):
+        stock_accessor = StockAccessor(self.session)
+        if not await stock_accessor.take_from_buckets(product_id, quantity):
+            available = await stock_accessor.get_stock(product_id)
+            raise ProductNotAvailable(
+                f"Insufficient stock. Available: {available}"
+            )
+
+    async def add_products_to_order(
+        self, order_id: int, lines: list[tuple[int, int]]
+    ) -> list[dict]:
+        """Adds many (product_id, quantity) lines in one transaction.
+        Products are locked in id order, stock is decremented and
+        order items are upserted with one statement each.
+        Returns an outcome for every line in the input order."""
+        current_session = self.session
+
+        async with current_session.begin():
+            order = await self._get_order_with_lock(order_id, current_session)
+            if not order:
+                raise OrderNotFound(f"Order {order_id} not found")
+
+            order.date = datetime.now(self.local_tz)
+
+            product_ids = {product_id for product_id, _ in lines}
+            products = await self._get_products_with_lock(
+                product_ids, current_session
+            )
+            stock = {product.id: product.quantity for product in products}
+            sharded_products = await self._get_products(
+                product_ids - stock.keys(), current_session
+            )
+            prices = {
+                product.id: product.price
+                for product in products + sharded_products
+            }
+            stock_accessor = StockAccessor(current_session)
+
+            results: list[dict] = [{} for _ in lines]
+            taken: dict[int, int] = {}
+            # lines are applied in product id order, as the locks are taken
+            for index, (product_id, quantity) in sorted(
+                enumerate(lines), key=lambda line: line[1][0]
+            ):
+                result = {"product_id": product_id, "quantity": quantity}
+                if product_id not in prices:
+                    result["status"] = "not_found"
+                elif product_id not in stock:
+                    if await stock_accessor.take_from_buckets(
+                        product_id, quantity
+                    ):
+                        result["status"] = "added"
+                        taken[product_id] = taken.get(product_id, 0) + quantity
+                    else:
+                        result["status"] = "not_available"
+                        result["available"] = await stock_accessor.get_stock(
+                            product_id
+                        )
+                elif stock[product_id] < quantity:
+                    result["status"] = "not_available"
+                    result["available"] = stock[product_id]
+                else:
+                    result["status"] = "added"
+                    stock[product_id] -= quantity
+                    taken[product_id] = taken.get(product_id, 0) + quantity
+                results[index] = result
+
+            if taken:
+                unsharded_taken = {
+                    product_id: quantity
+                    for product_id, quantity in taken.items()
+                    if product_id in stock
+                }
+                if unsharded_taken:
+                    await self._decrement_products(
+                        unsharded_taken, current_session
+                    )
+                item_prices = await self._upsert_order_items(
+                    order, taken, prices
+                )
+                await self._add_to_client_total(
+                    order.client_id,
+                    sum(
+                        quantity * item_prices[product_id]
+                        for product_id, quantity in taken.items()
+                    ),
+                )
+                day = self._sales_day(order.created_at)
+                await self._record_sales(
+                    {
+                        (product_id, day): quantity
+                        for product_id, quantity in taken.items()
+                    }
                 )
 
-            product.quantity -= quantity
+        if taken:
+            await statistic_cache.invalidate(CLIENT_ORDER_SUM, STATISTIC_ORDER)
+        return results
+
+    async def add_to_orders(
+        self, lines: list[tuple[int, int, int]]
+    ) -> list[Optional[Exception]]:
+        """Applies (order_id, product_id, quantity) lines of many callers
+        in one transaction. Orders and then products are locked in id
+        order, the lines are applied by product id and then position.
+        Returns None for an added line, the exception for the others
+        (which do not stop the rest)"""
+        async with self.session.begin():
+            orders = {
+                order.id: order
+                for order in await self._get_orders_with_lock(
+                    {order_id for order_id, _, _ in lines}
+                )
+            }
+            product_ids = {product_id for _, product_id, _ in lines}
+            products = await self._get_products_with_lock(
+                product_ids, self.session
+            )
+            stock = {product.id: product.quantity for product in products}
+            sharded_products = await self._get_products(
+                product_ids - stock.keys(), self.session
+            )
+            prices = {
+                product.id: product.price
+                for product in products + sharded_products
+            }
+            stock_accessor = StockAccessor(self.session)
+
+            outcomes: list[Optional[Exception]] = [None] * len(lines)
+            taken: dict[tuple[int, int], int] = {}
+            for index, (order_id, product_id, quantity) in sorted(
+                enumerate(lines), key=lambda line: (line[1][1], line[0])
+            ):
+                if order_id not in orders:
+                    outcomes[index] = OrderNotFound(
+                        f"Order {order_id} not found"
+                    )
+                    continue
+                if product_id not in prices:
+                    outcomes[index] = ProductNotFound(
+                        f"Product {product_id} not found"
+                    )
+                    continue
+                if product_id in stock:
+                    available = stock[product_id]
+                    if available >= quantity:
+                        stock[product_id] -= quantity
+                        available = None
+                elif await stock_accessor.take_from_buckets(
+                    product_id, quantity
+                ):
+                    available = None
+                else:
+                    available = await stock_accessor.get_stock(product_id)
+                if available is not None:
+                    outcomes[index] = ProductNotAvailable(
+                        f"Insufficient stock. Available: {available}"
+                    )
+                    continue
+                key = (order_id, product_id)
+                taken[key] = taken.get(key, 0) + quantity
+
+            if taken:
+                await self._apply_taken(orders, taken, stock, prices)
+        return outcomes
+
+    async def _apply_taken(
+        self,
+        orders: dict[int, Order],
+        taken: dict[tuple[int, int], int],
+        stock: dict[int, int],
+        prices: dict,
+    ) -> None:
+        now = datetime.now(self.local_tz)
+        for order_id in sorted({order_id for order_id, _ in taken}):
+            orders[order_id].date = now
+
+        sold: dict[int, int] = {}
+        sales: dict[tuple[int, date], int] = {}
+        for (order_id, product_id), quantity in taken.items():
+            sold[product_id] = sold.get(product_id, 0) + quantity
+            key = (product_id, self._sales_day(orders[order_id].created_at))
+            sales[key] = sales.get(key, 0) + quantity
+        unsharded_sold = {
+            product_id: quantity
+            for product_id, quantity in sold.items()
+            if product_id in stock
+        }
+        if unsharded_sold:
+            await self._decrement_products(unsharded_sold, self.session)
 
-            await self._upsert_order_item(
-                order_id, product_id, quantity, product.price
+        item_prices = await self._upsert_items(
+            taken,
+            prices,
+            {order_id: order.created_at for order_id, order in orders.items()},
+        )
+        amounts: dict[int, int] = {}
+        for (order_id, product_id), quantity in taken.items():
+            client_id = orders[order_id].client_id
+            amounts[client_id] = (
+                amounts.get(client_id, 0)
+                + quantity * item_prices[(order_id, product_id)]
             )
+        await self._add_to_client_totals(amounts)
+        await self._record_sales(sales)
+
+    async def _get_orders_with_lock(self, order_ids: set[int]) -> list[Order]:
+        stmt = (
+            select(Order)
+            .where(Order.id.in_(order_ids))
+            .order_by(Order.id)
+            .with_for_update()
+        )
+        result = await self.session.execute(stmt)
+        return list(result.scalars().all())
 
     async def _get_order_with_lock(
         self, order_id: int, current_session
@@ -101,21 +374,171 @@ class OrderProductAccessor(DbAccessor):
     async def _get_product_with_lock(
         self, product_id: int, current_session
     ) -> Optional[Product]:
+        """Locks the product row unless its stock is sharded:
+        sharded products are not returned and their row is not locked"""
         stmt = (
-            select(Product).where(Product.id == product_id).with_for_update()
+            select(Product)
+            .where(Product.id == product_id, Product.stock_buckets == 0)
+            .with_for_update()
         )
         result = await current_session.execute(stmt)
         return result.scalar_one_or_none()
 
+    async def _get_products_with_lock(
+        self, product_ids: set[int], current_session
+    ) -> list[Product]:
+        """Locks products in id order, so that concurrent batches
+        always take the locks in the same order and do not deadlock.
+        Sharded products are skipped, as in _get_product_with_lock"""
+        stmt = (
+            select(Product)
+            .where(Product.id.in_(product_ids), Product.stock_buckets == 0)
+            .order_by(Product.id)
+            .with_for_update()
+        )
+        result = await current_session.execute(stmt)
+        return list(result.scalars().all())
+
+    async def _get_products(
+        self, product_ids: set[int], current_session
+    ) -> list[Product]:
+        if not product_ids:
+            return []
+        stmt = select(Product).where(Product.id.in_(product_ids))
+        result = await current_session.execute(stmt)
+        return list(result.scalars().all())
+
+    async def _decrement_products(
+        self, taken: dict[int, int], current_session
+    ) -> None:
+        decrement = values(
+            column("id", Integer),
+            column("quantity", Integer),
+            name="decrement",
+        ).data(sorted(taken.items()))
+        stmt = (
+            update(Product)
+            .where(Product.id == decrement.c.id)
+            .values(quantity=Product.quantity - decrement.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
+        await current_session.execute(stmt)
+
+    async def _upsert_order_items(
+        self, order: Order, taken: dict[int, int], prices: dict
+    ) -> dict[int, int]:
+        """Returns price_at_time of every upserted item by product id"""
+        item_prices = await self._upsert_items(
+            {
+                (order.id, product_id): quantity
+                for product_id, quantity in taken.items()
+            },
+            prices,
+            {order.id: order.created_at},
+        )
+        return {
+            product_id: price for (_, product_id), price in item_prices.items()
+        }
+
+    async def _upsert_items(
+        self,
+        taken: dict[tuple[int, int], int],
+        prices: dict,
+        created: dict[int, datetime],
+    ) -> dict[tuple[int, int], int]:
+        """Upserts the quantities by (order_id, product_id),
+        returns price_at_time of every upserted item by the same key.
+        created is created_at of the orders, their partition key"""
+        stmt = insert(OrderItem).values(
+            [
+                {
+                    "order_id": order_id,
+                    "order_created_at": created[order_id],
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "price_at_time": prices[product_id],
+                }
+                for (order_id, product_id), quantity in sorted(taken.items())
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_order_product",
+            set_={
+                "quantity": OrderItem.quantity + stmt.excluded.quantity,
+            },
+        ).returning(
+            OrderItem.order_id, OrderItem.product_id, OrderItem.price_at_time
+        )
+        return {
+            (order_id, product_id): price
+            for order_id, product_id, price in (
+                await self.session.execute(stmt)
+            ).tuples()
+        }
+
+    async def _add_to_client_total(self, client_id: int, amount) -> None:
+        await self._add_to_client_totals({client_id: amount})
+
+    async def _add_to_client_totals(self, amounts: dict[int, int]) -> None:
+        """Rows are upserted in client id order, as concurrent writers
+        lock them"""
+        stmt = insert(ClientOrderTotal).values(
+            [
+                {"client_id": client_id, "total_sum": amount}
+                for client_id, amount in sorted(amounts.items())
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["client_id"],
+            set_={
+                "total_sum": ClientOrderTotal.total_sum
+                + stmt.excluded.total_sum,
+            },
+        )
+        await self.session.execute(stmt)
+
+    async def _record_sales(self, sold: dict[tuple[int, date], int]) -> None:
+        """Adds sold quantities by (product_id, day) to the product_sales_daily
+        rows of the connection's bucket. Called last, so the rollup rows
+        stay locked only until commit"""
+        stmt = insert(ProductSalesDaily).values(
+            [
+                {
+                    "product_id": product_id,
+                    "day": day,
+                    "bucket": sales_bucket(),
+                    "quantity": quantity,
+                }
+                for (product_id, day), quantity in sorted(sold.items())
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["product_id", "day", "bucket"],
+            set_={
+                "quantity": ProductSalesDaily.quantity
+                + stmt.excluded.quantity,
+            },
+        )
+        await self.session.execute(stmt)
+
+    def _sales_day(self, order_created_at: datetime) -> date:
+        """An item counts on the day its order was created: unlike
+        order.date it does not change, so a rebuild from the order items
+        gives the same days"""
+        return order_created_at.astimezone(self.local_tz).date()
+
     async def _upsert_order_item(
         self,
         order_id: int,
+        order_created_at: datetime,
         product_id: int,
         quantity: int,
         price: float,
-    ):
+    ) -> int:
+        """Returns price_at_time of the item: the price of the first add"""
         stmt = insert(OrderItem).values(
             order_id=order_id,
+            order_created_at=order_created_at,
             product_id=product_id,
             quantity=quantity,
             price_at_time=price,
@@ -126,15 +549,418 @@ class OrderProductAccessor(DbAccessor):
             set_={
                 "quantity": OrderItem.quantity + quantity,
             },
+        ).returning(OrderItem.price_at_time)
+
+        return (await self.session.execute(stmt)).scalar_one()
+
+
+class AtomicOrderProductAccessor(OrderProductAccessor):
+    """Adds a product to an order with a single statement:
+    the order touch, the conditional stock decrement and the order item
+    upsert are chained through data-modifying CTEs, so row locks are
+    held only while that one statement runs."""
+
+    async def _add_product_to_order(
+        self, order_id: int, product_id: int, quantity: int
+    ) -> None:
+        current_session = self.session
+
+        async with current_session.begin():
+            stmt = self._add_product_statement(order_id, product_id, quantity)
+            outcome = (await current_session.execute(stmt)).one()
+
+            if outcome.client_id is None:
+                raise OrderNotFound(f"Order {order_id} not found")
+            if outcome.available is None:
+                raise ProductNotFound(f"Product {product_id} not found")
+            if outcome.sharded:
+                product = await current_session.get(Product, product_id)
+                await self._take_sharded_stock(product_id, quantity)
+                price_at_time = await self._upsert_order_item(
+                    order_id,
+                    outcome.order_created_at,
+                    product_id,
+                    quantity,
+                    product.price,
+                )
+                await self._add_to_client_total(
+                    outcome.client_id, quantity * price_at_time
+                )
+                await self._record_sales(
+                    {
+                        (
+                            product_id,
+                            self._sales_day(outcome.order_created_at),
+                        ): quantity
+                    }
+                )
+            elif not outcome.added:
+                raise ProductNotAvailable(
+                    f"Insufficient stock. Available: {outcome.available}"
+                )
+
+    def _add_product_statement(
+        self, order_id: int, product_id: int, quantity: int
+    ):
+        touched_order = (
+            update(Order)
+            .where(Order.id == order_id)
+            .values(date=datetime.now(self.local_tz))
+            .returning(Order.id, Order.client_id, Order.created_at)
+            .cte("touched_order")
+        )
+        taken_product = (
+            update(Product)
+            .where(
+                Product.id == product_id,
+                Product.quantity >= quantity,
+                Product.stock_buckets == 0,
+                exists(select(touched_order.c.id)),
+            )
+            .values(quantity=Product.quantity - quantity)
+            .returning(Product.id, Product.price)
+            .cte("taken_product")
+        )
+        item = insert(OrderItem).from_select(
+            [
+                "order_id",
+                "order_created_at",
+                "product_id",
+                "quantity",
+                "price_at_time",
+            ],
+            select(
+                touched_order.c.id,
+                touched_order.c.created_at,
+                taken_product.c.id,
+                literal(quantity),
+                taken_product.c.price,
+            ).select_from(touched_order.join(taken_product, true())),
+        )
+        upserted_item = (
+            item.on_conflict_do_update(
+                constraint="uq_order_product",
+                set_={"quantity": OrderItem.quantity + item.excluded.quantity},
+            )
+            .returning(OrderItem.id, OrderItem.price_at_time)
+            .cte("upserted_item")
+        )
+        # the client total and the sales rollup are not referenced
+        # by the final select, they are attached with add_cte
+        total = insert(ClientOrderTotal).from_select(
+            ["client_id", "total_sum"],
+            select(
+                touched_order.c.client_id,
+                upserted_item.c.price_at_time * quantity,
+            ).select_from(touched_order.join(upserted_item, true())),
+        )
+        added_to_total = total.on_conflict_do_update(
+            index_elements=["client_id"],
+            set_={
+                "total_sum": ClientOrderTotal.total_sum
+                + total.excluded.total_sum
+            },
+        ).cte("added_to_total")
+        sale = insert(ProductSalesDaily).from_select(
+            ["product_id", "day", "bucket", "quantity"],
+            select(
+                taken_product.c.id,
+                sale_day(touched_order.c.created_at),
+                sales_bucket(),
+                literal(quantity),
+            ).select_from(touched_order.join(taken_product, true())),
+        )
+        recorded_sale = sale.on_conflict_do_update(
+            index_elements=["product_id", "day", "bucket"],
+            set_={
+                "quantity": ProductSalesDaily.quantity + sale.excluded.quantity
+            },
+        ).cte("recorded_sale")
+        # the product is read from the statement snapshot, so "available"
+        # is the stock before this statement and NULL for a missing product
+        return select(
+            select(touched_order.c.client_id)
+            .scalar_subquery()
+            .label("client_id"),
+            select(touched_order.c.created_at)
+            .scalar_subquery()
+            .label("order_created_at"),
+            select(Product.quantity)
+            .where(Product.id == product_id)
+            .scalar_subquery()
+            .label("available"),
+            select(Product.stock_buckets > 0)
+            .where(Product.id == product_id)
+            .scalar_subquery()
+            .label("sharded"),
+            exists(select(upserted_item.c.id)).label("added"),
+        ).add_cte(added_to_total, recorded_sale)
+
+
+class StockAccessor(DbAccessor):
+    """Sharded stock: the quantity of a product is split across
+    product_stock_bucket rows, so concurrent orders of one hot product
+    lock different rows instead of waiting on the single product row."""
+
+    async def take_from_buckets(self, product_id: int, quantity: int) -> bool:
+        """Decrements a random bucket which holds enough stock, skipping
+        buckets locked by other transactions. If no single bucket can
+        serve the quantity, all buckets are locked and drained.
+        Runs inside the caller's transaction."""
+        bucket = (
+            select(ProductStockBucket.bucket)
+            .where(
+                ProductStockBucket.product_id == product_id,
+                ProductStockBucket.quantity >= quantity,
+            )
+            .order_by(func.random())
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(ProductStockBucket)
+            .where(
+                ProductStockBucket.product_id == product_id,
+                ProductStockBucket.bucket == bucket,
+            )
+            .values(quantity=ProductStockBucket.quantity - quantity)
+            .returning(ProductStockBucket.bucket)
+            .execution_options(synchronize_session=False)
+        )
+        if (await self.session.execute(stmt)).first():
+            return True
+        return await self._drain_buckets(product_id, quantity)
+
+    async def _drain_buckets(self, product_id: int, quantity: int) -> bool:
+        buckets = await self._get_buckets_with_lock(product_id)
+        if sum(bucket.quantity for bucket in buckets) < quantity:
+            return False
+
+        remaining = quantity
+        new_quantities = {}
+        for bucket in sorted(buckets, key=lambda row: -row.quantity):
+            if not remaining:
+                break
+            part = min(bucket.quantity, remaining)
+            new_quantities[bucket.bucket] = bucket.quantity - part
+            remaining -= part
+
+        await self._set_bucket_quantities(product_id, new_quantities)
+        return True
+
+    @staticmethod
+    def stock_column():
+        """Exact available stock of a Product row, for sharded products
+        the sum of the buckets (product.quantity is as of the last
+        rebalance). For the queries which read the stock"""
+        bucket_total = (
+            select(func.coalesce(func.sum(ProductStockBucket.quantity), 0))
+            .where(ProductStockBucket.product_id == Product.id)
+            .scalar_subquery()
+        )
+        return case(
+            (Product.stock_buckets == 0, Product.quantity),
+            else_=bucket_total,
+        )
+
+    async def get_stock(self, product_id: int) -> Optional[int]:
+        """Exact available stock, for sharded products - sum of buckets"""
+        stmt = select(self.stock_column()).where(Product.id == product_id)
+        return (await self.session.execute(stmt)).scalar_one_or_none()
+
+    async def shard_product(self, product_id: int, buckets: int) -> None:
+        """Moves the stock of the product into `buckets` bucket rows"""
+        async with self.session.begin():
+            product = await self._get_product_with_lock(product_id)
+            total = await self._take_all_stock(product)
+            self.session.add_all(
+                [
+                    ProductStockBucket(
+                        product_id=product_id, bucket=bucket, quantity=part
+                    )
+                    for bucket, part in enumerate(self._split(total, buckets))
+                ]
+            )
+            product.stock_buckets = buckets
+            product.quantity = total
+
+    async def unshard_product(self, product_id: int) -> None:
+        """Returns the stock from the buckets back to the product row"""
+        async with self.session.begin():
+            product = await self._get_product_with_lock(product_id)
+            product.quantity = await self._take_all_stock(product)
+            product.stock_buckets = 0
+
+    async def rebalance_product(self, product_id: int) -> None:
+        """Spreads the stock evenly over the buckets of the product
+        and refreshes product.quantity with the exact total"""
+        async with self.session.begin():
+            buckets = await self._get_buckets_with_lock(product_id)
+            if not buckets:
+                return
+            total = sum(bucket.quantity for bucket in buckets)
+            await self._set_bucket_quantities(
+                product_id,
+                {
+                    bucket.bucket: part
+                    for bucket, part in zip(
+                        buckets, self._split(total, len(buckets))
+                    )
+                },
+            )
+            await self.session.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .values(quantity=total)
+                .execution_options(synchronize_session=False)
+            )
+
+    async def rebalance_all(self) -> int:
+        """Rebalances every sharded product, each in its own transaction"""
+        async with self.session.begin():
+            product_ids = (
+                (
+                    await self.session.execute(
+                        select(Product.id).where(Product.stock_buckets > 0)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+        for product_id in product_ids:
+            await self.rebalance_product(product_id)
+        return len(product_ids)
+
+    async def _get_product_with_lock(self, product_id: int) -> Product:
+        stmt = (
+            select(Product).where(Product.id == product_id).with_for_update()
+        )
+        product = (await self.session.execute(stmt)).scalar_one_or_none()
+        if not product:
+            raise ProductNotFound(f"Product {product_id} not found")
+        return product
+
+    async def _get_buckets_with_lock(self, product_id: int):
+        stmt = (
+            select(ProductStockBucket.bucket, ProductStockBucket.quantity)
+            .where(ProductStockBucket.product_id == product_id)
+            .order_by(ProductStockBucket.bucket)
+            .with_for_update()
+        )
+        return (await self.session.execute(stmt)).all()
+
+    async def _take_all_stock(self, product: Product) -> int:
+        """Deletes the buckets of the locked product and returns its stock"""
+        if not product.stock_buckets:
+            return product.quantity
+        buckets = await self._get_buckets_with_lock(product.id)
+        await self.session.execute(
+            delete(ProductStockBucket).where(
+                ProductStockBucket.product_id == product.id
+            )
         )
+        return sum(bucket.quantity for bucket in buckets)
 
+    async def _set_bucket_quantities(
+        self, product_id: int, quantities: dict[int, int]
+    ) -> None:
+        new_quantity = values(
+            column("bucket", Integer),
+            column("quantity", Integer),
+            name="new_quantity",
+        ).data(sorted(quantities.items()))
+        stmt = (
+            update(ProductStockBucket)
+            .where(
+                ProductStockBucket.product_id == product_id,
+                ProductStockBucket.bucket == new_quantity.c.bucket,
+            )
+            .values(quantity=new_quantity.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
         await self.session.execute(stmt)
 
+    @staticmethod
+    def _split(total: int, parts: int) -> list[int]:
+        base, extra = divmod(total, parts)
+        return [base + (1 if part < extra else 0) for part in range(parts)]
+
 
 class StatisticAccessor(DbAccessor):
-    async def get_client_orders_sum(self):
-        query = (
+    """The statements are built once per shape and cached (the *_query
+    builders), the values are bound at execution. A prebuilt statement
+    keeps its memoized cache key, so SQLAlchemy finds the compiled SQL
+    without walking the statement again, and the same SQL text reuses
+    asyncpg's prepared statement of the connection"""
+
+    async def get_client_orders_sum(
+        self,
+        exact: bool = False,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ):
+        """Reads the totals maintained by add-to-cart,
+        exact=True aggregates all order items instead (for audits).
+        Keyset pagination: clients with id > after_id, by id"""
+        query = self.client_orders_sum_page_query(
+            exact, after_id is not None, limit is not None
+        )
+        result = await self.session.execute(
+            query, {"after_id": after_id, "limit": limit}
+        )
+        return result.all()
+
+    async def stream_client_orders_sum(
+        self, exact: bool = False
+    ) -> AsyncIterator[list]:
+        """Every row of get_client_orders_sum, read from a server-side
+        cursor and yielded in batches of EXPORT_BATCH_SIZE rows"""
+        query = self.client_orders_sum_page_query(exact, False, False)
+        async for rows in self._stream(query):
+            yield rows
+
+    @staticmethod
+    @cache
+    def client_orders_sum_page_query(exact: bool, paged: bool, limited: bool):
+        """Binds after_id when paged and limit when limited"""
+        if exact:
+            query = StatisticAccessor.client_orders_sum_query().order_by(
+                Client.id
+            )
+            client_id = Client.id
+        else:
+            query = (
+                select(
+                    ClientOrderTotal.client_id.label("id"),
+                    Client.name,
+                    ClientOrderTotal.total_sum,
+                )
+                .join(Client, ClientOrderTotal.client_id == Client.id)
+                .order_by(ClientOrderTotal.client_id)
+            )
+            client_id = ClientOrderTotal.client_id
+        if paged:
+            query = query.where(client_id > bindparam("after_id"))
+        if limited:
+            query = query.limit(bindparam("limit"))
+        return query
+
+    async def _stream(self, query) -> AsyncIterator[list]:
+        result = await self.session.stream(
+            query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        try:
+            async for rows in result.partitions():
+                yield rows
+        finally:
+            await result.close()
+
+    @staticmethod
+    def client_orders_sum_query():
+        return (
             select(
+                Client.id,
                 Client.name,
                 func.coalesce(
                     func.sum(OrderItem.quantity * OrderItem.price_at_time), 0
@@ -144,17 +970,24 @@ class StatisticAccessor(DbAccessor):
                 Order, Client.id == Order.client_id
             )  # INNER JOIN - only clients with orders
             .outerjoin(
-                OrderItem, Order.id == OrderItem.order_id
+                OrderItem,
+                and_(
+                    Order.id == OrderItem.order_id,
+                    Order.created_at == OrderItem.order_created_at,
+                ),
             )  # LEFT JOIN - orders may have no items
             .group_by(Client.id, Client.name)
         )
-        result = await self.session.execute(query)
-        return result.all()
 
     async def get_count_subcategories(self):
-        subcategories = aliased(Category)
+        result = await self.session.execute(self.count_subcategories_query())
+        return result.mappings().all()
 
-        query = (
+    @staticmethod
+    @cache
+    def count_subcategories_query():
+        subcategories = aliased(Category)
+        return (
             select(
                 Category.title,
                 func.count(subcategories.id).label("subcategories_count"),
@@ -163,60 +996,605 @@ class StatisticAccessor(DbAccessor):
             .group_by(Category.id, Category.title)
             .order_by(Category.id)
         )
-        result = await self.session.execute(query)
+
+    async def get_top_selling_products(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        limit: int = 5,
+        category_id: Optional[int] = None,
+        level: int = 1,
+        per_category: bool = False,
+    ):
+        """Products sold the most from date_from to date_to inclusive,
+        by default over the last 30 days, with the category of the given
+        hierarchy level above them (1 - top-level).
+        category_id - only products of that category subtree,
+        per_category - top `limit` products of every such category"""
+        query, params = self.top_selling_products_statement(
+            date_from, date_to, limit, category_id, level, per_category
+        )
+        result = await self.session.execute(query, params)
         return result.mappings().all()
 
-    async def get_top_selling_products(self):
-        MONTH_AGO = datetime.now(self.local_tz) - timedelta(days=30)
-        parent = aliased(Category, name="parent")
+    def top_selling_products_statement(
+        self,
+        date_from: Optional[date],
+        date_to: Optional[date],
+        limit: int,
+        category_id: Optional[int],
+        level: int,
+        per_category: bool,
+    ):
+        """The statement of get_top_selling_products and its parameters"""
+        date_to = date_to or datetime.now(self.local_tz).date()
+        # the 30 days up to date_to, both ends included
+        date_from = date_from or date_to - timedelta(days=29)
+        if date_from > date_to:
+            raise InvalidDateRange(f"from {date_from} is after to {date_to}")
+
+        query = self.top_selling_products_query(
+            category_id is not None, level > 1, per_category
+        )
+        return query, {
+            "date_from": date_from,
+            "date_to": date_to,
+            "limit": limit,
+            "category_id": category_id,
+            "depth": level - 1,
+        }
 
-        cte = select(
-            Category.id.label("child_id"),
-            Category.id.label("parent_id"),
-            Category.parent_id.label("immediate_parent_id"),
-            func.cast(0, Integer).label("level"),
-        ).cte(name="category_hierarchy", recursive=True)
+    @staticmethod
+    @cache
+    def top_selling_products_query(
+        filtered: bool, nested: bool, per_category: bool
+    ):
+        """Binds date_from, date_to and limit, category_id when filtered
+        and depth (level - 1) when nested"""
+        # the rollup has a row per product and past day (the compaction
+        # folds the buckets), a window is read from ix_product_sales_daily_day
+        sold = select(
+            ProductSalesDaily.product_id,
+            func.sum(ProductSalesDaily.quantity).label("quantity"),
+        ).where(
+            ProductSalesDaily.day.between(
+                bindparam("date_from", type_=Date),
+                bindparam("date_to", type_=Date),
+            )
+        )
+        if filtered:
+            sold = sold.where(
+                ProductSalesDaily.product_id.in_(
+                    StatisticAccessor._subtree_products_query()
+                )
+            )
+        sold = sold.group_by(ProductSalesDaily.product_id).subquery("sold")
 
-        recursive_part = (
+        group_category = aliased(Category, name="top_parent")
+        query = (
+            select(
+                Product.title.label("product_title"),
+                group_category.title.label("top_parent_title"),
+                sold.c.quantity.label("total_quantity"),
+            )
+            .select_from(sold)
+            .join(Product, Product.id == sold.c.product_id)
+        )
+        query = StatisticAccessor._join_group_category(
+            query, group_category, nested
+        )
+
+        if not per_category:
+            return query.order_by(sold.c.quantity.desc(), Product.id).limit(
+                bindparam("limit")
+            )
+
+        ranked = query.add_columns(
+            group_category.id.label("top_parent_id"),
+            func.row_number()
+            .over(
+                partition_by=group_category.id,
+                order_by=(sold.c.quantity.desc(), Product.id),
+            )
+            .label("rank"),
+        ).subquery("ranked")
+        return (
             select(
-                cte.c.child_id.label("child_id"),
-                parent.id.label("parent_id"),
-                parent.parent_id.label("immediate_parent_id"),
-                (cte.c.level + 1).label("level"),
+                ranked.c.product_title,
+                ranked.c.top_parent_title,
+                ranked.c.total_quantity,
+            )
+            .where(ranked.c.rank <= bindparam("limit"))
+            .order_by(
+                ranked.c.top_parent_title,
+                ranked.c.top_parent_id,
+                ranked.c.rank,
             )
-            .select_from(cte)
-            .join(parent, cte.c.immediate_parent_id == parent.id)
-            .where(cte.c.immediate_parent_id.isnot(None))
         )
 
-        category_hierarchy = cte.union_all(recursive_part)
+    @staticmethod
+    def _subtree_products_query():
+        """Ids of the products of the category_id and all its
+        subcategories, read from the closure and ix_product_category_id
+        indexes"""
+        return (
+            select(Product.id)
+            .join(
+                CategoryClosure,
+                CategoryClosure.descendant_id == Product.category_id,
+            )
+            .where(
+                CategoryClosure.ancestor_id
+                == bindparam("category_id", type_=Integer)
+            )
+        )
 
-        cat_parent = aliased(Category, name="cat_parent")
+    @staticmethod
+    def _join_group_category(query, group_category, nested: bool):
+        """Joins the ancestor of Product's category at the hierarchy level:
+        a root category or, when nested, the one `depth` steps below
+        a root. Products of shallower categories are left out"""
+        # the ancestors are found in the closure table
+        # instead of walking the hierarchy with a recursive CTE
+        query = query.join(
+            CategoryClosure,
+            CategoryClosure.descendant_id == Product.category_id,
+        )
+        if not nested:
+            return query.join(
+                group_category,
+                and_(
+                    group_category.id == CategoryClosure.ancestor_id,
+                    group_category.parent_id.is_(None),
+                ),
+            )
+        path_from_root = aliased(CategoryClosure, name="path_from_root")
+        root = aliased(Category, name="root")
+        return (
+            query.join(
+                group_category,
+                group_category.id == CategoryClosure.ancestor_id,
+            )
+            .join(
+                path_from_root,
+                and_(
+                    path_from_root.descendant_id == group_category.id,
+                    path_from_root.depth == bindparam("depth", type_=Integer),
+                ),
+            )
+            .join(
+                root,
+                and_(
+                    root.id == path_from_root.ancestor_id,
+                    root.parent_id.is_(None),
+                ),
+            )
+        )
+
+    async def stream_product_sales(self) -> AsyncIterator[list]:
+        """Sold quantity of every product for all time, by product id,
+        yielded in batches of EXPORT_BATCH_SIZE rows"""
+        async for rows in self._stream(self.product_sales_query()):
+            yield rows
 
-        main_query = (
+    @staticmethod
+    @cache
+    def product_sales_query():
+        top_parent = aliased(Category, name="top_parent")
+        sold = (
             select(
+                ProductSalesDaily.product_id,
+                func.sum(ProductSalesDaily.quantity).label("quantity"),
+            )
+            .group_by(ProductSalesDaily.product_id)
+            .subquery("sold")
+        )
+        query = (
+            select(
+                Product.id.label("product_id"),
                 Product.title.label("product_title"),
-                cat_parent.title.label("top_parent_title"),
-                func.sum(OrderItem.quantity).label("total_quantity"),
+                top_parent.title.label("top_parent_title"),
+                sold.c.quantity.label("total_quantity"),
             )
-            .select_from(category_hierarchy)
-            .join(
-                Product, Product.category_id == category_hierarchy.c.child_id
+            .select_from(sold)
+            .join(Product, Product.id == sold.c.product_id)
+            .order_by(Product.id)
+        )
+        return StatisticAccessor._join_group_category(
+            query, top_parent, nested=False
+        )
+
+    @classmethod
+    def prepare_statements(cls) -> None:
+        """Builds every statement shape up front, e.g. at startup"""
+        for flags in itertools.product((False, True), repeat=3):
+            cls.client_orders_sum_page_query(*flags)
+            cls.top_selling_products_query(*flags)
+        cls.count_subcategories_query()
+        cls.product_sales_query()
+
+
+class RollupAccessor(DbAccessor):
+    """Rebuilds the precomputed statistic tables from the orders.
+    The orders of archived partitions are not counted, archiving takes
+    them out of the tables (PartitionAccessor.archive_partitions)"""
+
+    async def rebuild_product_sales_daily(self) -> int:
+        """Recomputes product_sales_daily from order items,
+        an item counts on the day its order was created"""
+        day = sale_day(Order.created_at)
+        async with self.session.begin():
+            await self.session.execute(delete(ProductSalesDaily))
+            stmt = insert(ProductSalesDaily).from_select(
+                ["product_id", "day", "quantity"],
+                select(
+                    OrderItem.product_id,
+                    day,
+                    func.sum(OrderItem.quantity),
+                )
+                .join(
+                    Order,
+                    and_(
+                        Order.id == OrderItem.order_id,
+                        Order.created_at == OrderItem.order_created_at,
+                    ),
+                )
+                .group_by(OrderItem.product_id, day),
+            )
+            result = await self.session.execute(stmt)
+        await statistic_cache.invalidate(STATISTIC_ORDER)
+        return result.rowcount
+
+    async def compact_product_sales_daily(
+        self, before: Optional[date] = None
+    ) -> int:
+        """Folds the bucket rows of the days before `before` (the current
+        day by default) into bucket 0, so that a read of a past window gets
+        one row per product and day. Returns the number of folded days.
+        A sale can still come to a past day (an item added to an older
+        order), its bucket row is folded by the next compaction"""
+        before = before or datetime.now(self.local_tz).date()
+        unfolded = select(ProductSalesDaily.product_id, ProductSalesDaily.day)
+        unfolded = unfolded.where(
+            ProductSalesDaily.day < before, ProductSalesDaily.bucket != 0
+        )
+        # the rows are locked in key order, as add-to-cart does
+        locked = (
+            select(
+                ProductSalesDaily.product_id,
+                ProductSalesDaily.day,
+                ProductSalesDaily.bucket,
             )
-            .join(cat_parent, cat_parent.id == category_hierarchy.c.parent_id)
-            .join(OrderItem, OrderItem.product_id == Product.id)
-            .join(Order, OrderItem.order_id == Order.id)
             .where(
-                category_hierarchy.c.immediate_parent_id.is_(None),
-                Order.date >= MONTH_AGO,
+                ProductSalesDaily.day < before,
+                tuple_(
+                    ProductSalesDaily.product_id, ProductSalesDaily.day
+                ).in_(unfolded),
+            )
+            .order_by(
+                ProductSalesDaily.product_id,
+                ProductSalesDaily.day,
+                ProductSalesDaily.bucket,
+            )
+            .with_for_update()
+            .cte("locked")
+        )
+        folded = (
+            delete(ProductSalesDaily)
+            .where(
+                ProductSalesDaily.product_id == locked.c.product_id,
+                ProductSalesDaily.day == locked.c.day,
+                ProductSalesDaily.bucket == locked.c.bucket,
+                locked.c.bucket != 0,
             )
-            .group_by(
-                Product.title,
-                cat_parent.title,
+            .returning(
+                ProductSalesDaily.product_id,
+                ProductSalesDaily.day,
+                ProductSalesDaily.quantity,
             )
-            .order_by(func.sum(OrderItem.quantity).desc())
-            .limit(5)
+            .cte("folded")
         )
+        stmt = insert(ProductSalesDaily).from_select(
+            ["product_id", "day", "bucket", "quantity"],
+            select(
+                folded.c.product_id,
+                folded.c.day,
+                literal(0),
+                func.sum(folded.c.quantity),
+            ).group_by(folded.c.product_id, folded.c.day),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["product_id", "day", "bucket"],
+            set_={
+                "quantity": ProductSalesDaily.quantity + stmt.excluded.quantity
+            },
+        )
+        async with self.session.begin():
+            result = await self.session.execute(stmt)
+        return result.rowcount
+
+    async def reconcile_client_order_totals(self, repair: bool = False):
+        """Compares client_order_totals with the live aggregate and returns
+        (client_id, stored, actual) of every client that drifted.
+        With repair=True the stored totals are replaced by the actual ones,
+        writers wait on the table lock meanwhile"""
+        async with self.session.begin():
+            if repair:
+                await self.session.execute(
+                    text(
+                        "LOCK TABLE client_order_totals "
+                        "IN SHARE ROW EXCLUSIVE MODE"
+                    )
+                )
+            actual = StatisticAccessor.client_orders_sum_query().subquery(
+                "actual"
+            )
+            drift_query = (
+                select(
+                    func.coalesce(
+                        actual.c.id, ClientOrderTotal.client_id
+                    ).label("client_id"),
+                    ClientOrderTotal.total_sum.label("stored"),
+                    actual.c.total_sum.label("actual"),
+                )
+                .select_from(actual)
+                .join(
+                    ClientOrderTotal,
+                    ClientOrderTotal.client_id == actual.c.id,
+                    full=True,
+                )
+                .where(
+                    ClientOrderTotal.total_sum.is_distinct_from(
+                        actual.c.total_sum
+                    )
+                )
+                .order_by("client_id")
+            )
+            drift = (await self.session.execute(drift_query)).all()
+
+            if repair and drift:
+                await self._repair_client_order_totals(drift)
+        if repair and drift:
+            await statistic_cache.invalidate(CLIENT_ORDER_SUM)
+        return drift
+
+    async def _repair_client_order_totals(self, drift) -> None:
+        # the drift can be any size: one array parameter for the delete,
+        # executemany (sent in batches) for the upsert
+        stale = [row.client_id for row in drift if row.actual is None]
+        if stale:
+            await self.session.execute(
+                delete(ClientOrderTotal).where(
+                    ClientOrderTotal.client_id
+                    == any_(bindparam("stale", type_=ARRAY(Integer)))
+                ),
+                {"stale": stale},
+            )
+        actual = [
+            {"client_id": row.client_id, "total_sum": row.actual}
+            for row in drift
+            if row.actual is not None
+        ]
+        if actual:
+            stmt = insert(ClientOrderTotal)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["client_id"],
+                set_={"total_sum": stmt.excluded.total_sum},
+            )
+            await self.session.execute(stmt, actual)
+
+
+# partitioned by month, the referenced table first
+PARTITIONED_TABLES = ("order", "order_item")
+PARTITION_NAME = re.compile(r"^order_y(\d{4})m(\d{2})$")
+IS_PARTITIONED_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('"order"')
+    )
+"""
 
-        result = (await self.session.execute(main_query)).mappings().all()
-        return result
+
+def month_start(moment: date | datetime) -> date:
+    if isinstance(moment, datetime):
+        moment = moment.astimezone(timezone.utc)
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def create_partition_statements(month: date) -> list[str]:
+    """CREATE TABLE of the order and order_item partitions of a month"""
+    return [
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(table, month)}" '
+        f'PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{month} 00:00:00+00') "
+        f"TO ('{add_months(month, 1)} 00:00:00+00')"
+        for table in PARTITIONED_TABLES
+    ]
+
+
+class PartitionAccessor(DbAccessor):
+    """Monthly partitions of order and order_item: order_y2026m10 has the
+    orders created in that month (UTC), order_item_y2026m10 their items.
+    Adding and detaching a partition locks the parent table, the DDL
+    gives up after lock_timeout instead of queueing the requests"""
+
+    lock_timeout = "5s"
+
+    async def _execute_ddl(self, statement: str) -> None:
+        await self.session.execute(text(statement))
+
+    async def is_partitioned(self) -> bool:
+        return await self.session.scalar(text(IS_PARTITIONED_SQL))
+
+    async def get_partition_months(self) -> list[date]:
+        """Months of the attached order partitions"""
+        names = await self.session.scalars(
+            text(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = '"order"'::regclass
+                """
+            )
+        )
+        return sorted(
+            date(int(match[1]), int(match[2]), 1)
+            for match in map(PARTITION_NAME.match, names)
+            if match
+        )
+
+    async def create_partitions(self, months_ahead: int) -> list[date]:
+        """Creates the missing partitions of the current month and
+        months_ahead after it, returns their months"""
+        current = month_start(datetime.now(self.local_tz))
+        async with self.session.begin():
+            if not await self.is_partitioned():
+                return []
+            existing = set(await self.get_partition_months())
+            missing = [
+                month
+                for month in (
+                    add_months(current, count)
+                    for count in range(months_ahead + 1)
+                )
+                if month not in existing
+            ]
+            await self._execute_ddl(
+                f"SET LOCAL lock_timeout = '{self.lock_timeout}'"
+            )
+            for month in missing:
+                for statement in create_partition_statements(month):
+                    await self._execute_ddl(statement)
+        return missing
+
+    async def archive_partitions(
+        self, retention_months: int, schema: str
+    ) -> tuple[list[date], list[date]]:
+        """Detaches the partitions older than retention_months whose orders
+        are all inactive (active = 0) and moves them to schema, the orders
+        are not in the tables and the statistic any more: client_order_totals
+        and product_sales_daily lose them as well, so reconcile and rebuild
+        agree with them. One transaction per month.
+        Returns the archived months and the old months with active orders"""
+        cutoff = add_months(
+            month_start(datetime.now(self.local_tz)), -retention_months
+        )
+        async with self.session.begin():
+            if not await self.is_partitioned():
+                return [], []
+            old_months = [
+                month
+                for month in await self.get_partition_months()
+                if month < cutoff
+            ]
+        archived, kept = [], []
+        for month in old_months:
+            if await self._archive_partition(month, schema):
+                archived.append(month)
+            else:
+                kept.append(month)
+        return archived, kept
+
+    async def _archive_partition(self, month: date, schema: str) -> bool:
+        orders = partition_name("order", month)
+        async with self.session.begin():
+            await self._execute_ddl(
+                f"SET LOCAL lock_timeout = '{self.lock_timeout}'"
+            )
+            # adding an item updates its order, so the orders of the
+            # partition can not change and get items meanwhile
+            await self._execute_ddl(f'LOCK TABLE "{orders}" IN SHARE MODE')
+            if await self.session.scalar(
+                text(
+                    f'SELECT EXISTS (SELECT 1 FROM "{orders}" '
+                    "WHERE active <> 0)"
+                )
+            ):
+                return False
+            await self._execute_ddl(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+            # the items first, their foreign key refers to the orders
+            for table in reversed(PARTITIONED_TABLES):
+                await self._execute_ddl(
+                    f'ALTER TABLE "{table}" '
+                    f'DETACH PARTITION "{partition_name(table, month)}"'
+                )
+            # the order tables stay locked until the commit, no order
+            # of the clients is added or changed meanwhile
+            await self._remove_from_statistic(month)
+            for table in reversed(PARTITIONED_TABLES):
+                partition = partition_name(table, month)
+                # an archive does not hold back changes of the live tables
+                await self._drop_foreign_keys(partition)
+                await self._execute_ddl(
+                    f'ALTER TABLE "{partition}" SET SCHEMA "{schema}"'
+                )
+        await statistic_cache.invalidate(CLIENT_ORDER_SUM, STATISTIC_ORDER)
+        return True
+
+    async def _remove_from_statistic(self, month: date) -> None:
+        """Takes the detached orders of the month out of client_order_totals
+        and product_sales_daily, as rebuilding them from the live tables
+        would (an item counts on the day its order was created)"""
+        orders = partition_name("order", month)
+        items = partition_name("order_item", month)
+        await self.session.execute(
+            text(
+                f"""
+                WITH archived AS (
+                    SELECT archived_order.client_id,
+                        sum(item.quantity * item.price_at_time) AS total_sum
+                    FROM "{orders}" AS archived_order
+                    JOIN "{items}" AS item
+                        ON item.order_id = archived_order.id
+                        AND item.order_created_at = archived_order.created_at
+                    GROUP BY archived_order.client_id
+                )
+                UPDATE client_order_totals
+                SET total_sum = client_order_totals.total_sum
+                    - archived.total_sum
+                FROM archived
+                WHERE client_order_totals.client_id = archived.client_id
+                """
+            )
+        )
+        # a row exists only for the clients with orders
+        await self.session.execute(
+            text(
+                f"""
+                DELETE FROM client_order_totals
+                WHERE client_id IN (SELECT client_id FROM "{orders}")
+                    AND NOT EXISTS (
+                        SELECT 1 FROM "order"
+                        WHERE "order".client_id = client_order_totals.client_id
+                    )
+                """
+            )
+        )
+        await self.session.execute(
+            delete(ProductSalesDaily).where(
+                ProductSalesDaily.day >= month,
+                ProductSalesDaily.day < add_months(month, 1),
+            )
+        )
+
+    async def _drop_foreign_keys(self, table: str) -> None:
+        names = await self.session.scalars(
+            text(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = to_regclass(:table) AND contype = 'f'"
+            ),
+            {"table": f'"{table}"'},
+        )
+        for name in names.all():
+            await self._execute_ddl(
+                f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"'
+            )
@@ -1,19 +1,166 @@
+import asyncio
+import time
 from typing import AsyncGenerator
 
+from sqlalchemy import make_url, text
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from service.config import db_settings, logger
+from service.config import (
+    db_pool_settings,
+    db_replica_settings,
+    db_settings,
+    logger,
+    server_settings,
+)
+from service.instrumentation import instrument_engine, record_pool_wait
 
 
-class DbConnector:
+class PoolStats:
+    """Counters of pool checkouts: how many and how long they waited"""
+
     def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+
+pool_stats = PoolStats()
+
+
+class MonitoredQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool which measures the time spent waiting for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats.record_wait(waited)
+            record_pool_wait(waited)
+
+
+def split_connection_budget(
+    pool_size: int, max_overflow: int, budget: int, workers: int
+) -> tuple[int, int]:
+    """pool_size and max_overflow of a worker's engine, so that
+    the pools of all the workers hold at most budget connections
+    to one server. A budget of 0 keeps the settings"""
+    if not budget:
+        return pool_size, max_overflow
+    per_worker = budget // workers
+    if per_worker < 1:
+        raise ValueError(
+            f"DB_CONNECTION_BUDGET={budget} is less than one connection "
+            f"for each of {workers} workers"
+        )
+    pool_size = min(pool_size, per_worker)
+    return pool_size, min(max_overflow, per_worker - pool_size)
+
+
+# a replica which streams WAL from the primary and has replayed all of
+# it is not behind, however old its last replayed transaction is.
+# Without a WAL receiver (disconnected from the primary) nothing new
+# arrives and the received and replayed positions stay equal, then the
+# lag is the age of the last replayed transaction, unknown - infinite
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN 0
+        ELSE coalesce(
+            extract(epoch FROM now() - pg_last_xact_replay_timestamp()),
+            'Infinity'
+        )
+    END
+    """
+)
+
+
+class Replica:
+    """A read replica and the result of its last health check"""
+
+    def __init__(self, uri: str, engine: AsyncEngine) -> None:
+        self.uri = uri
+        self.engine = engine
+        self.session_maker = async_sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        self.available = False
+        self.lag: float | None = None
+        self.checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    @property
+    def name(self) -> str:
+        return make_url(self.uri).render_as_string(hide_password=True)
+
+    async def check(self, timeout: float) -> None:
+        try:
+            async with asyncio.timeout(timeout):
+                async with self.engine.connect() as connection:
+                    self.lag = float(
+                        await connection.scalar(REPLICA_LAG_QUERY)
+                    )
+            if not self.available:
+                logger.warning("Replica %s is available", self.name)
+            self.available = True
+        except Exception as exc:
+            if self.available or self.checked_at == float("-inf"):
+                logger.warning(
+                    "Replica %s is unavailable", self.name, exc_info=exc
+                )
+            self.available = False
+            self.lag = None
+        self.checked_at = time.monotonic()
+
+    async def refresh(self, interval: float, timeout: float) -> None:
+        """Checks the replica when the last check is older than interval.
+        Requests which come during a check use its previous result"""
+        if (
+            time.monotonic() - self.checked_at < interval
+            or self._lock.locked()
+        ):
+            return
+        async with self._lock:
+            await self.check(timeout)
+
+    def usable(self, max_lag_seconds: float) -> bool:
+        return self.available and self.lag <= max_lag_seconds
+
+
+class DbConnector:
+    def __init__(
+        self,
+        replica_urls: list[str] | None = None,
+        replica_settings: dict | None = None,
+    ) -> None:
         self.engine: AsyncEngine | None = None
         self._session_maker: async_sessionmaker | None = None
+        self.replica_settings = replica_settings or db_replica_settings
+        self.replica_urls = (
+            self.replica_settings["urls"]
+            if replica_urls is None
+            else replica_urls
+        )
+        self.replicas: list[Replica] | None = None
+        self._next_replica = 0
+        self.read_fallbacks = 0
 
     @property
     def uri(self) -> str:
@@ -25,27 +172,145 @@ class DbConnector:
             f"/{db_settings['db_name']}"
         )
 
-    def get_engine(self) -> AsyncEngine:
-        self.engine = create_async_engine(
-            self.uri,
-            pool_size=1,
-            max_overflow=0,
-            pool_recycle=280,
-            pool_timeout=20,
-            echo=True,
+    @staticmethod
+    def pool_limits() -> tuple[int, int]:
+        """pool_size and max_overflow of this worker process"""
+        return split_connection_budget(
+            db_pool_settings["pool_size"],
+            db_pool_settings["max_overflow"],
+            db_pool_settings["connection_budget"],
+            server_settings["workers"],
+        )
+
+    def create_engine(self, uri: str, **connect_args) -> AsyncEngine:
+        pool_size, max_overflow = self.pool_limits()
+        engine = create_async_engine(
+            uri,
+            poolclass=MonitoredQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=db_pool_settings["pool_recycle"],
+            pool_timeout=db_pool_settings["pool_timeout"],
+            pool_pre_ping=db_pool_settings["pool_pre_ping"],
+            connect_args={
+                "prepared_statement_cache_size": db_pool_settings[
+                    "statement_cache_size"
+                ],
+                **connect_args,
+            },
+            echo=db_pool_settings["echo"],
             future=True,
         )
+        instrument_engine(engine)
+        return engine
+
+    def get_engine(self) -> AsyncEngine:
+        self.engine = self.create_engine(self.uri)
         return self.engine
 
+    def get_replicas(self) -> list[Replica]:
+        if self.replicas is None:
+            self.replicas = [
+                Replica(
+                    uri,
+                    self.create_engine(
+                        uri, timeout=self.replica_settings["check_timeout"]
+                    ),
+                )
+                for uri in self.replica_urls
+            ]
+        return self.replicas
+
+    async def read_session_maker(self) -> async_sessionmaker:
+        """Session maker of the next replica (round robin) which answers
+        and lags behind at most DB_REPLICA_MAX_LAG seconds.
+        The primary when there are no replicas or none of them is usable"""
+        replicas = self.get_replicas()
+        for offset in range(len(replicas)):
+            position = (self._next_replica + offset) % len(replicas)
+            replica = replicas[position]
+            await replica.refresh(
+                self.replica_settings["check_interval"],
+                self.replica_settings["check_timeout"],
+            )
+            if replica.usable(self.replica_settings["max_lag_seconds"]):
+                self._next_replica = (position + 1) % len(replicas)
+                return replica.session_maker
+        if replicas:
+            self.read_fallbacks += 1
+        return self.session_maker
+
+    def on_replica(self, session: AsyncSession) -> bool:
+        """Whether the session was made by read_session_maker
+        for one of the replicas"""
+        return any(
+            session.bind is replica.engine for replica in self.replicas or []
+        )
+
     @property
     def session_maker(self) -> async_sessionmaker:
-        if not self.engine:
-            self.get_engine()
-        return async_sessionmaker(
-            self.engine,
-            class_=AsyncSession,
-            expire_on_commit=False,
-        )
+        if not self._session_maker:
+            if not self.engine:
+                self.get_engine()
+            self._session_maker = async_sessionmaker(
+                self.engine,
+                class_=AsyncSession,
+                expire_on_commit=False,
+            )
+        return self._session_maker
+
+    def pool_status(self) -> dict:
+        """Current pool usage and checkout wait statistics"""
+        pool_size, max_overflow = self.pool_limits()
+        status = {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "in_use": 0,
+            "idle": 0,
+            "overflow": 0,
+            "checkouts": pool_stats.checkouts,
+            "wait_total_ms": round(pool_stats.wait_total * 1000, 3),
+            "wait_max_ms": round(pool_stats.wait_max * 1000, 3),
+            "wait_avg_ms": (
+                round(pool_stats.wait_total * 1000 / pool_stats.checkouts, 3)
+                if pool_stats.checkouts
+                else 0.0
+            ),
+        }
+        if self.engine:
+            pool = self.engine.pool
+            status["in_use"] = pool.checkedout()
+            status["idle"] = pool.checkedin()
+            status["overflow"] = max(pool.overflow(), 0)
+        if self.replica_urls:
+            status["read_fallbacks"] = self.read_fallbacks
+            status["replicas"] = [
+                {
+                    "name": replica.name,
+                    "available": replica.available,
+                    "lag_seconds": replica.lag,
+                    "in_use": replica.engine.pool.checkedout(),
+                    "idle": replica.engine.pool.checkedin(),
+                }
+                for replica in self.get_replicas()
+            ]
+        return status
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Waits until no connection of the primary is checked out,
+        i.e. the running transactions have ended, at most timeout seconds.
+        Returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while self.engine and self.engine.pool.checkedout():
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    "%d connection(s) still in use after %.1fs",
+                    self.engine.pool.checkedout(),
+                    timeout,
+                )
+                return False
+            await asyncio.sleep(0.05)
+        return True
 
     async def dispose_engine(self):
         """Dispose engine when application shuts down"""
@@ -53,6 +318,9 @@ class DbConnector:
             await self.engine.dispose()
             self.engine = None
             self._session_maker = None
+        for replica in self.replicas or []:
+            await replica.engine.dispose()
+        self.replicas = None
 
 
 db_connector = DbConnector()
@@ -69,3 +337,29 @@ async def get_session() -> AsyncGenerator:
         raise exc
     finally:
         await session.close()
+
+
+def get_session_maker() -> async_sessionmaker:
+    """For handlers which open sessions themselves, e.g. streaming
+    responses: get_session is closed before the body is sent"""
+    return db_connector.session_maker
+
+
+async def get_read_session() -> AsyncGenerator:
+    """Session for read-only handlers, on a replica when one is usable.
+    It may lag behind the writes of the primary"""
+    session = (await db_connector.read_session_maker())()
+    try:
+        yield session
+        await session.commit()
+    except Exception as exc:
+        logger.error("Error in read session", exc_info=exc)
+        await session.rollback()
+        raise exc
+    finally:
+        await session.close()
+
+
+async def get_read_session_maker() -> async_sessionmaker:
+    """get_session_maker for read-only streaming handlers"""
+    return await db_connector.read_session_maker()
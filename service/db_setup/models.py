@@ -3,14 +3,21 @@ from decimal import Decimal
 from typing import Optional
 
 from sqlalchemy import (
+    BigInteger,
+    CheckConstraint,
+    Date,
     DateTime,
     ForeignKey,
+    ForeignKeyConstraint,
+    Index,
     Integer,
     Numeric,
+    SmallInteger,
     String,
     Text,
     UniqueConstraint,
     func,
+    text,
 )
 from sqlalchemy.orm import (
     Mapped,
@@ -37,6 +44,30 @@ class Category(Base):
     # children = relationship("Category", back_populates="parent", foreign_keys=[parent_id])
     # parent = relationship("Category", back_populates="children", remote_side=[id])
 
+    __table_args__ = (Index("ix_category_parent_id", "parent_id"),)
+
+
+class CategoryClosure(Base):
+    """Every (ancestor, descendant) pair of the category tree,
+    including (id, id) with depth 0. Maintained by triggers on category"""
+
+    __tablename__ = "category_closure"
+    ancestor_id: Mapped[int] = mapped_column(
+        ForeignKey("category.id", ondelete="CASCADE"), primary_key=True
+    )
+    descendant_id: Mapped[int] = mapped_column(
+        ForeignKey("category.id", ondelete="CASCADE"), primary_key=True
+    )
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_category_closure_descendant_id",
+            "descendant_id",
+            "ancestor_id",
+        ),
+    )
+
 
 class Product(Base):
     __tablename__ = "product"
@@ -48,7 +79,33 @@ class Product(Base):
     category_id: Mapped[int] = mapped_column(
         ForeignKey("category.id", ondelete="RESTRICT"), nullable=False
     )
+    # for sharded products the stock lives in product_stock_bucket rows
+    # and quantity is their total as of the last rebalance: read the
+    # stock with StockAccessor.stock_column() / get_stock
     quantity: Mapped[int] = mapped_column(Integer, server_default="0")
+    stock_buckets: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default="0"
+    )
+
+    __table_args__ = (
+        # products of a category subtree without reading the table
+        Index("ix_product_category_id", "category_id", "id"),
+    )
+
+
+class ProductStockBucket(Base):
+    __tablename__ = "product_stock_bucket"
+    product_id: Mapped[int] = mapped_column(
+        ForeignKey("product.id", ondelete="CASCADE"), primary_key=True
+    )
+    bucket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    quantity: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default="0"
+    )
+
+    __table_args__ = (
+        CheckConstraint("quantity >= 0", name="ck_stock_bucket_quantity"),
+    )
 
 
 class Client(Base):
@@ -62,7 +119,25 @@ class Client(Base):
     address: Mapped[str] = mapped_column(String(120), nullable=True)
 
 
+class ClientOrderTotal(Base):
+    """Sum of quantity * price_at_time over all order items of a client,
+    a row exists for every client with orders. Archived orders are not
+    counted"""
+
+    __tablename__ = "client_order_totals"
+    client_id: Mapped[int] = mapped_column(
+        ForeignKey("client.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_sum: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default="0"
+    )
+
+
 class Order(Base):
+    """Partitioned by month of created_at in the database (the partitions
+    are made by the migration and `manage maintain-partitions`), date is
+    the last change of the order"""
+
     __tablename__ = "order"
     id: Mapped[int] = mapped_column(
         primary_key=True, autoincrement=True, index=True
@@ -74,20 +149,34 @@ class Order(Base):
         DateTime(timezone=True),
         nullable=False,
         server_default=func.now(),
-        index=True,
     )
     active: Mapped[int] = mapped_column(
         Integer, nullable=False, server_default="1"
     )
+    # the partition key is a part of every unique constraint
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        server_default=func.now(),
+    )
+
+    __table_args__ = (
+        Index("ix_order_client_id", "client_id", "id"),
+        Index("ix_order_date_id", "date", "id"),
+    )
 
 
 class OrderItem(Base):
+    """Partitioned like its order, by month of order_created_at"""
+
     __tablename__ = "order_item"
     id: Mapped[int] = mapped_column(
         primary_key=True, autoincrement=True, index=True
     )
-    order_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("order.id", ondelete="CASCADE"), nullable=False
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # created_at of the order
+    order_created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), primary_key=True
     )
     product_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("product.id", ondelete="CASCADE"), nullable=False
@@ -98,5 +187,57 @@ class OrderItem(Base):
     # order = relationship("Order", back_populates="items")
     # product = relationship("Product", back_populates="order_items")
     __table_args__ = (
-        UniqueConstraint("order_id", "product_id", name="uq_order_product"),
+        ForeignKeyConstraint(
+            ["order_id", "order_created_at"],
+            ["order.id", "order.created_at"],
+            ondelete="CASCADE",
+        ),
+        UniqueConstraint(
+            "order_id",
+            "product_id",
+            "order_created_at",
+            name="uq_order_product",
+        ),
+        # sales of a product without reading the table
+        Index(
+            "ix_order_item_product_id",
+            "product_id",
+            postgresql_include=["quantity", "order_id"],
+        ),
+    )
+
+
+class ProductSalesDaily(Base):
+    """Sold quantity of a product per day, updated by add-to-cart.
+    The sales of a day are split over bucket rows (by the database
+    connection), so concurrent orders of a product lock different rows.
+    The compaction folds the buckets of the past days into bucket 0,
+    a read of a window gets one row per product and day, up to
+    SALES_ROLLUP_BUCKETS for the current day"""
+
+    __tablename__ = "product_sales_daily"
+    product_id: Mapped[int] = mapped_column(
+        ForeignKey("product.id", ondelete="CASCADE"), primary_key=True
+    )
+    day: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    bucket: Mapped[int] = mapped_column(
+        SmallInteger, primary_key=True, server_default="0"
+    )
+    quantity: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default="0"
+    )
+
+    __table_args__ = (
+        Index(
+            "ix_product_sales_daily_day",
+            "day",
+            "product_id",
+            postgresql_include=["quantity"],
+        ),
+        Index(
+            "ix_product_sales_daily_unfolded",
+            "day",
+            "product_id",
+            postgresql_where=text("bucket <> 0"),
+        ),
     )
@@ -1,72 +1,184 @@
-from typing import List, Tuple
+from datetime import date
+from typing import Optional, Tuple
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Request, status
 from fastapi.params import Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from service.config import logger
+from service.cache import CachedStatisticAccessor, statistic_cache
+from service.config import (
+    CART_SINGLE_STATEMENT,
+    FAST_RESPONSES,
+    STATISTIC_ACCESSOR,
+    db_replica_settings,
+    logger,
+)
 from service.db_accessors import (
+    AtomicOrderProductAccessor,
     OrderClientAccessor,
     OrderProductAccessor,
-    StatisticAccessor,
 )
-from service.db_setup.db_settings import get_session
-from service.schemas import ClientOrderSum, SubcategoryCount, TopProducts
+from service.db_setup.db_settings import (
+    db_connector,
+    get_read_session,
+    get_session,
+)
+from service.group_commit import CartBatcher, get_cart_batcher
+from service.pagination import decode_cursor, encode_cursor
+from service.raw_accessors import STATISTIC_ACCESSORS
+from service.responses import FAST_RESPONSE_CONTENT, encoded_response
+from service.schemas import (
+    CartBatchInput,
+    CartBatchResult,
+    CartLineResult,
+    ClientOrderSum,
+    ClientOrderSumPage,
+    SubcategoryCount,
+    TopProducts,
+)
 
 api_router = APIRouter()
 
 
+def get_statistic_accessor(session: AsyncSession) -> CachedStatisticAccessor:
+    # an answer of a replica may miss the writes which invalidated
+    # the cache, it is kept no longer than the replica may lag behind
+    max_ttl = (
+        db_replica_settings["max_lag_seconds"]
+        if db_connector.on_replica(session)
+        else None
+    )
+    return CachedStatisticAccessor(
+        STATISTIC_ACCESSORS[STATISTIC_ACCESSOR](session),
+        statistic_cache,
+        max_ttl=max_ttl,
+    )
+
+
+def get_order_product_accessor(session: AsyncSession) -> OrderProductAccessor:
+    if CART_SINGLE_STATEMENT:
+        return AtomicOrderProductAccessor(session)
+    return OrderProductAccessor(session)
+
+
 @api_router.get(
     "/client-order-sum",
     responses={
+        **FAST_RESPONSE_CONTENT,
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
         status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
     },
-    response_model=List[ClientOrderSum],
+    response_model=ClientOrderSumPage,
 )
-async def show_client_orders_sum(db: AsyncSession = Depends(get_session)):
+async def show_client_orders_sum(
+    request: Request,
+    exact: bool = Query(False),
+    limit: int = Query(100, gt=0, le=1000),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_read_session),
+):
     """Покажет список [имя клиента, сумма стоимости товаров],
     если в заказе нет товаров, то сумма будет 0,
     если у клиента нет заказов, то он не будет в списке.
+    Суммы берутся из предвычисленной таблицы,
+    exact=true - посчитать по всем позициям заказов (для сверки).
+    Постранично: следующая страница - по cursor=next_cursor.
     """
-    result = await StatisticAccessor(db).get_client_orders_sum()
-    return [
-        ClientOrderSum(name=row.name, total_sum=row.total_sum)
-        for row in result
-    ]
+    result = await get_statistic_accessor(db).get_client_orders_sum(
+        exact=exact, after_id=decode_cursor(cursor), limit=limit + 1
+    )
+    page = result[:limit]
+    next_cursor = encode_cursor(page[-1].id) if len(result) > limit else None
+    if FAST_RESPONSES:
+        return encoded_response(
+            request,
+            {
+                "items": [
+                    {"name": row.name, "total_sum": float(row.total_sum)}
+                    for row in page
+                ],
+                "next_cursor": next_cursor,
+            },
+        )
+    return ClientOrderSumPage(
+        items=[
+            ClientOrderSum(name=row.name, total_sum=row.total_sum)
+            for row in page
+        ],
+        next_cursor=next_cursor,
+    )
 
 
 @api_router.get(
     "/count-subcategories",
     responses={
+        **FAST_RESPONSE_CONTENT,
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
         status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
     },
 )
-async def count_subcategories(db: AsyncSession = Depends(get_session)):
+async def count_subcategories(
+    request: Request, db: AsyncSession = Depends(get_read_session)
+):
     """Количество подкатегорий первого уровня вложенности
     для каждой категории."""
-    categories = await StatisticAccessor(db).get_count_subcategories()
+    categories = await get_statistic_accessor(db).get_count_subcategories()
+    if FAST_RESPONSES:
+        return encoded_response(request, [dict(row) for row in categories])
     return [SubcategoryCount(**dict(row)) for row in categories]
 
 
 @api_router.get(
     "/statistic-order",
     responses={
+        **FAST_RESPONSE_CONTENT,
         status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
         status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
     },
     response_model=list[TopProducts],
 )
-async def show_statistic(db: AsyncSession = Depends(get_session)):
+async def show_statistic(
+    request: Request,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    limit: int = Query(5, gt=0, le=100),
+    category_id: Optional[int] = Query(None, gt=0),
+    level: int = Query(1, gt=0, le=20),
+    per_category: bool = Query(False),
+    db: AsyncSession = Depends(get_read_session),
+):
     """Get statistic
     Топ 5 количества проданных товаров за последний месяц,
     Наименование товара, Категория верхнего уровня,
     Общее количество проданных штук.
+    from/to - период (включительно), по умолчанию последние 30 дней,
+    limit - сколько товаров в топе,
+    category_id - только товары из поддерева категории,
+    level - уровень категории в иерархии (1 - верхний),
+    per_category=true - топ limit товаров в каждой категории уровня level.
     """
 
-    result = await StatisticAccessor(db).get_top_selling_products()
+    result = await get_statistic_accessor(db).get_top_selling_products(
+        date_from=date_from,
+        date_to=date_to,
+        limit=limit,
+        category_id=category_id,
+        level=level,
+        per_category=per_category,
+    )
 
+    if FAST_RESPONSES:
+        return encoded_response(
+            request,
+            [
+                {
+                    "product_name": row.product_title,
+                    "category_name": row.top_parent_title,
+                    "total_quantity": row.total_quantity,
+                }
+                for row in result
+            ],
+        )
     return [
         TopProducts(
             product_name=row.product_title,
@@ -92,13 +204,21 @@ async def add_to_order_cart(
     product_id: int = Query(..., gt=0),
     quantity: int = Query(..., gt=0),
     session: AsyncSession = Depends(get_session),
+    cart_batcher: Optional[CartBatcher] = Depends(get_cart_batcher),
 ):
     """Add to order cart some product"""
     logger.debug(
-        f"order_id={order_id}, product_id={product_id}, quantity={quantity}"
+        "order_id=%s, product_id=%s, quantity=%s",
+        order_id,
+        product_id,
+        quantity,
     )
 
-    order_product_accessor = OrderProductAccessor(session)
+    if cart_batcher is not None:
+        await cart_batcher.add(order_id, product_id, quantity)
+        return {"result": "success"}
+
+    order_product_accessor = get_order_product_accessor(session)
     await order_product_accessor.add_product_to_order(
         order_id, product_id, quantity
     )
@@ -106,6 +226,32 @@ async def add_to_order_cart(
     return {"result": "success"}
 
 
+@api_router.post(
+    "/add-to-cart-batch",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Bad request"},
+        status.HTTP_404_NOT_FOUND: {"description": "Order not found"},
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
+    },
+    response_model=CartBatchResult,
+)
+async def add_batch_to_order_cart(
+    cart: CartBatchInput,
+    session: AsyncSession = Depends(get_session),
+):
+    """Add to order cart many products in one transaction.
+    Every line gets its own status: added, not_found or not_available."""
+    order_product_accessor = OrderProductAccessor(session)
+    results = await order_product_accessor.add_products_to_order(
+        cart.order_id,
+        [(line.product_id, line.quantity) for line in cart.items],
+    )
+    return CartBatchResult(
+        order_id=cart.order_id,
+        results=[CartLineResult(**result) for result in results],
+    )
+
+
 @api_router.post(
     "/create-order",
     responses={
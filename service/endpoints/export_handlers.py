@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+from contextlib import aclosing
+from typing import AsyncIterator, Callable
+
+from fastapi import APIRouter, Depends, Request, status
+from fastapi.params import Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from service.config import STATISTIC_ACCESSOR, logger
+from service.db_accessors import StatisticAccessor
+from service.db_setup.db_settings import get_read_session_maker
+from service.raw_accessors import STATISTIC_ACCESSORS
+
+api_router = APIRouter(prefix="/export")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+CLIENT_ORDER_SUM_FIELDS = ("id", "name", "total_sum")
+PRODUCT_SALES_FIELDS = (
+    "product_id",
+    "product_title",
+    "top_parent_title",
+    "total_quantity",
+)
+
+
+def encode_ndjson(rows: list, fields: tuple[str, ...]) -> str:
+    return "".join(
+        json.dumps(dict(zip(fields, row)), ensure_ascii=False, default=str)
+        + "\n"
+        for row in rows
+    )
+
+
+def encode_csv(rows: list, fields: tuple[str, ...] | None = None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if fields:
+        writer.writerow(fields)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def stream_export(
+    request: Request,
+    session_maker: async_sessionmaker,
+    export_format: str,
+    fields: tuple[str, ...],
+    batches: Callable[[StatisticAccessor], AsyncIterator[list]],
+) -> StreamingResponse:
+    """Sends the rows batch by batch while the cursor is read,
+    only one batch is held in memory"""
+
+    async def body() -> AsyncIterator[str]:
+        if export_format == "csv":
+            yield encode_csv([], fields)
+        # the request session is already closed when the body is sent
+        async with session_maker() as session:
+            accessor = STATISTIC_ACCESSORS[STATISTIC_ACCESSOR](session)
+            async with aclosing(batches(accessor)) as rows:
+                async for batch in rows:
+                    if await request.is_disconnected():
+                        logger.warning("Export stopped, client disconnected")
+                        return
+                    if export_format == "csv":
+                        yield encode_csv(batch)
+                    else:
+                        yield encode_ndjson(batch, fields)
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[export_format])
+
+
+@api_router.get(
+    "/client-order-sum",
+    responses={
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
+    },
+)
+async def export_client_orders_sum(
+    request: Request,
+    exact: bool = Query(False),
+    export_format: str = Query(
+        "ndjson", alias="format", pattern="^(ndjson|csv)$"
+    ),
+    session_maker: async_sessionmaker = Depends(get_read_session_maker),
+):
+    """Все строки /client-order-sum одним потоком: id, name, total_sum.
+    format=ndjson (по умолчанию) или csv."""
+    return stream_export(
+        request,
+        session_maker,
+        export_format,
+        CLIENT_ORDER_SUM_FIELDS,
+        lambda accessor: accessor.stream_client_orders_sum(exact=exact),
+    )
+
+
+@api_router.get(
+    "/product-sales",
+    responses={
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
+    },
+)
+async def export_product_sales(
+    request: Request,
+    export_format: str = Query(
+        "ndjson", alias="format", pattern="^(ndjson|csv)$"
+    ),
+    session_maker: async_sessionmaker = Depends(get_read_session_maker),
+):
+    """Продажи каждого товара за всё время одним потоком:
+    product_id, product_title, top_parent_title, total_quantity.
+    format=ndjson (по умолчанию) или csv."""
+    return stream_export(
+        request,
+        session_maker,
+        export_format,
+        PRODUCT_SALES_FIELDS,
+        lambda accessor: accessor.stream_product_sales(),
+    )
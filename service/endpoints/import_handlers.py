@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, Request, status
+from fastapi.params import Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from service.catalog_import import IMPORTS, CatalogImporter
+from service.db_setup.db_settings import get_session
+from service.schemas import ImportResult
+
+api_router = APIRouter(prefix="/import")
+
+
+async def import_catalog(
+    request: Request, session: AsyncSession, kind: str, body_format: str
+) -> ImportResult:
+    importer = CatalogImporter(session, IMPORTS[kind])
+    result = await importer.run(request.stream(), body_format)
+    return ImportResult(**result)
+
+
+@api_router.post(
+    "/products",
+    responses={
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
+    },
+    response_model=ImportResult,
+)
+async def import_products(
+    request: Request,
+    body_format: str = Query(
+        "ndjson", alias="format", pattern="^(ndjson|csv)$"
+    ),
+    session: AsyncSession = Depends(get_session),
+):
+    """Загрузка товаров построчно (NDJSON или CSV в теле запроса):
+    id, title, price, category_id, quantity.
+    Строка с id обновляет товар (пустые поля не меняются),
+    без id - создаёт новый (title, price, category_id обязательны).
+    Ответ: сколько создано, обновлено и отклонено, причины отказов."""
+    return await import_catalog(request, session, "products", body_format)
+
+
+@api_router.post(
+    "/clients",
+    responses={
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {"description": "Bad request"},
+    },
+    response_model=ImportResult,
+)
+async def import_clients(
+    request: Request,
+    body_format: str = Query(
+        "ndjson", alias="format", pattern="^(ndjson|csv)$"
+    ),
+    session: AsyncSession = Depends(get_session),
+):
+    """Загрузка клиентов построчно (NDJSON или CSV в теле запроса):
+    email, name, address. Клиент с существующим email обновляется,
+    новый создаётся (name обязателен)."""
+    return await import_catalog(request, session, "clients", body_format)
@@ -0,0 +1,52 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from service import logging_setup
+from service.db_setup.db_settings import db_connector
+from service.group_commit import get_cart_batcher
+from service.instrumentation import registry
+from service.slow_queries import slow_query_log
+
+api_router = APIRouter()
+
+
+@api_router.get("/pool-status")
+async def show_pool_status():
+    """Connection pool usage: connections in use and idle,
+    how many checkouts were made and how long they waited."""
+    return db_connector.pool_status()
+
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def show_metrics():
+    """Prometheus metrics: request latency histograms, SQL statements,
+    DB time, pool wait and rows per route, connection pool gauges
+    the log records dropped on a full logging queue and, with group
+    commit on, the add-to-cart batch sizes and queue delays."""
+    status = db_connector.pool_status()
+    gauges = {
+        f"db_pool_{name}": status[name]
+        for name in ("in_use", "idle", "overflow", "checkouts")
+    }
+    if logging_setup.queue_handler is not None:
+        gauges["log_records_dropped"] = logging_setup.queue_handler.dropped
+    text = registry.render(gauges)
+    cart_batcher = get_cart_batcher()
+    if cart_batcher is not None:
+        text += cart_batcher.metrics.render()
+    return PlainTextResponse(
+        text,
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@api_router.get("/admin/slow-queries")
+async def show_slow_queries():
+    """The last statements over SLOW_QUERY_MS, newest first: duration,
+    calling function, statement, parameter types and, for a sampled part
+    of them, the EXPLAIN (ANALYZE, BUFFERS) plan."""
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "explain_sample_rate": slow_query_log.explain_sample_rate,
+        "entries": list(reversed(slow_query_log.entries)),
+    }
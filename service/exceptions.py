@@ -12,3 +12,11 @@ class ProductNotAvailable(Exception):
 
 class ClientNotFound(Exception):
     pass
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class InvalidDateRange(Exception):
+    pass
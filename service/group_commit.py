@@ -0,0 +1,168 @@
+"""Group commit of add-to-cart requests.
+
+The requests of a short window (CART_BATCH_WINDOW_MS, or until
+CART_BATCH_MAX_ITEMS are waiting) are applied by one transaction, so
+they share the round trips and one commit (one WAL flush) instead of
+a commit each.
+Every caller gets the outcome of its own line."""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from service.cache import CLIENT_ORDER_SUM, STATISTIC_ORDER, statistic_cache
+from service.config import cart_batch_settings, logger
+from service.db_accessors import OrderProductAccessor
+from service.db_setup.db_settings import db_connector
+from service.instrumentation import Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_DELAY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+@dataclass
+class PendingLine:
+    order_id: int
+    product_id: int
+    quantity: int
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchMetrics:
+    def __init__(self) -> None:
+        self.sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_delay = Histogram(QUEUE_DELAY_BUCKETS)
+        self.duration = Histogram()
+        self.failed = 0
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for name, help_text, histogram in (
+            ("cart_batch_size", "Lines per batch", self.sizes),
+            (
+                "cart_batch_queue_delay_seconds",
+                "Wait of a line for its batch to start",
+                self.queue_delay,
+            ),
+            (
+                "cart_batch_duration_seconds",
+                "Transaction time of a batch",
+                self.duration,
+            ),
+        ):
+            lines += [
+                f"# HELP {name} {help_text}",
+                f"# TYPE {name} histogram",
+                *histogram.render(name),
+            ]
+        lines += [
+            "# HELP cart_batch_failed_total Batches failed as a whole",
+            "# TYPE cart_batch_failed_total counter",
+            f"cart_batch_failed_total {self.failed}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class CartBatcher:
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        window: float,
+        max_items: int,
+    ) -> None:
+        self.session_maker = session_maker
+        self.window = window
+        self.max_items = max_items
+        self.metrics = BatchMetrics()
+        self._pending: list[PendingLine] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def add(self, order_id: int, product_id: int, quantity: int):
+        """Waits for the batch of the line to commit. Raises OrderNotFound,
+        ProductNotFound or ProductNotAvailable for this line only.
+        A cancelled caller's line is still applied with its batch"""
+        loop = asyncio.get_running_loop()
+        line = PendingLine(
+            order_id, product_id, quantity, loop.create_future()
+        )
+        # nobody retrieves the exception when the caller was cancelled
+        line.future.add_done_callback(
+            lambda future: future.cancelled() or future.exception()
+        )
+        self._pending.append(line)
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        await asyncio.shield(line.future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._apply(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _apply(self, batch: list[PendingLine]) -> None:
+        started = time.perf_counter()
+        self.metrics.sizes.observe(len(batch))
+        for line in batch:
+            self.metrics.queue_delay.observe(started - line.queued_at)
+        try:
+            async with self.session_maker() as session:
+                outcomes = await OrderProductAccessor(session).add_to_orders(
+                    [
+                        (line.order_id, line.product_id, line.quantity)
+                        for line in batch
+                    ]
+                )
+        except Exception as exc:
+            self.metrics.failed += 1
+            logger.error(
+                "Cart batch of %d lines failed", len(batch), exc_info=exc
+            )
+            outcomes = [exc] * len(batch)
+        self.metrics.duration.observe(time.perf_counter() - started)
+
+        if any(outcome is None for outcome in outcomes):
+            await statistic_cache.invalidate(CLIENT_ORDER_SUM, STATISTIC_ORDER)
+        for line, outcome in zip(batch, outcomes):
+            if outcome is None:
+                line.future.set_result(None)
+            else:
+                line.future.set_exception(outcome)
+
+    async def close(self) -> None:
+        """Applies the waiting lines and waits for the running batches"""
+        self._flush()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+_cart_batcher: CartBatcher | None = None
+
+
+def get_cart_batcher() -> CartBatcher | None:
+    """The batcher of the app, None when CART_BATCH_WINDOW_MS is 0"""
+    global _cart_batcher
+    if _cart_batcher is None and cart_batch_settings["window_ms"] > 0:
+        _cart_batcher = CartBatcher(
+            db_connector.session_maker,
+            window=cart_batch_settings["window_ms"] / 1000,
+            max_items=cart_batch_settings["max_items"],
+        )
+    return _cart_batcher
+
+
+async def close_cart_batcher() -> None:
+    global _cart_batcher
+    if _cart_batcher is not None:
+        await _cart_batcher.close()
+        _cart_batcher = None
@@ -2,6 +2,8 @@ from fastapi import FastAPI, HTTPException, status
 
 from service.exceptions import (
     ClientNotFound,
+    InvalidCursor,
+    InvalidDateRange,
     OrderNotFound,
     ProductNotAvailable,
     ProductNotFound,
@@ -34,4 +36,12 @@ def add_exception_handlers(app: FastAPI):
     async def client_not_found_handler(request, exc):
         raise HTTPException(status_code=404, detail=str(exc))
 
+    @app.exception_handler(InvalidCursor)
+    async def invalid_cursor_handler(request, exc):
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    @app.exception_handler(InvalidDateRange)
+    async def invalid_date_range_handler(request, exc):
+        raise HTTPException(status_code=400, detail=str(exc))
+
     return app
@@ -0,0 +1,268 @@
+"""Per-request database instrumentation.
+
+Engine events add every statement of a request to the RequestMetrics of
+the current context, the middleware turns them into a Server-Timing
+header, a log record and the per-route series of /metrics."""
+
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from service.config import logger
+from service.logging_setup import request_id
+from service.slow_queries import slow_query_log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.rows = 0
+
+
+current_metrics: ContextVar[RequestMetrics | None] = ContextVar(
+    "current_metrics", default=None
+)
+
+
+def record_pool_wait(seconds: float) -> None:
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.pool_wait += seconds
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    slow_query_log.check(conn.connection, statement, parameters, elapsed)
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.statements += 1
+        metrics.db_time += elapsed
+        metrics.rows += max(cursor.rowcount, 0)
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("query_start")
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+    if event.contains(
+        sync_engine, "after_cursor_execute", _after_cursor_execute
+    ):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(le, count) pairs of the exposition format"""
+        total, result = 0, []
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        """_bucket, _sum and _count lines of the series with the labels"""
+        separator = "," if labels else ""
+        lines = [
+            f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}'
+            for bound, count in self.cumulative()
+        ]
+        series = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{series} {self.sum}")
+        lines.append(f"{name}_count{series} {self.count}")
+        return lines
+
+
+class RouteMetrics:
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.rows = 0
+
+    def add(self, metrics: RequestMetrics, elapsed: float) -> None:
+        self.latency.observe(elapsed)
+        self.statements += metrics.statements
+        self.db_time += metrics.db_time
+        self.pool_wait += metrics.pool_wait
+        self.rows += metrics.rows
+
+
+class MetricsRegistry:
+    """Series by (method, route template, status)"""
+
+    def __init__(self) -> None:
+        self.routes: dict[tuple[str, str, int], RouteMetrics] = {}
+
+    def add(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        metrics: RequestMetrics,
+        elapsed: float,
+    ) -> None:
+        key = (method, route, status)
+        if key not in self.routes:
+            self.routes[key] = RouteMetrics()
+        self.routes[key].add(metrics, elapsed)
+
+    def clear(self) -> None:
+        self.routes.clear()
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP http_request_duration_seconds Request latency",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route, status), series in self.routes.items():
+            labels = f'method="{method}",route="{route}",status="{status}"'
+            lines += series.latency.render(
+                "http_request_duration_seconds", labels
+            )
+        counters = (
+            ("db_statements_total", "SQL statements", "statements"),
+            ("db_time_seconds_total", "Time in SQL statements", "db_time"),
+            (
+                "db_pool_wait_seconds_total",
+                "Time waiting for a pool connection",
+                "pool_wait",
+            ),
+            ("db_rows_total", "Rows returned or affected", "rows"),
+        )
+        for name, help_text, attribute in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route, status), series in self.routes.items():
+                lines.append(
+                    f'{name}{{method="{method}",route="{route}",'
+                    f'status="{status}"}} {getattr(series, attribute)}'
+                )
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def server_timing(metrics: RequestMetrics, elapsed: float) -> str:
+    return (
+        f'db;dur={metrics.db_time * 1000:.3f};desc="{metrics.statements} '
+        f'statements, {metrics.rows} rows", '
+        f"pool;dur={metrics.pool_wait * 1000:.3f}, "
+        f"total;dur={elapsed * 1000:.3f}"
+    )
+
+
+def incoming_request_id(scope) -> str:
+    """The X-Request-ID of the caller (e.g. a proxy) or a new one"""
+    for name, value in scope["headers"]:
+        if name == b"x-request-id" and 0 < len(value) <= 128:
+            return value.decode("latin-1")
+    return uuid.uuid4().hex
+
+
+class InstrumentationMiddleware:
+    """Collects the metrics of every HTTP request and sets its request id,
+    which is in every log record of the request and in the response.
+    For a streaming response only the work done before
+    the headers are sent is in the Server-Timing header"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self._route_paths: dict | None = None
+
+    def route_path(self, scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        current_request_id = incoming_request_id(scope)
+        request_id_token = request_id.set(current_request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(metrics, time.perf_counter() - start)
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", header.encode()),
+                    (b"x-request-id", current_request_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_metrics.reset(token)
+            route = self.route_path(scope)
+            registry.add(scope["method"], route, status, metrics, elapsed)
+            logger.info(
+                "%s %s %s %.1fms, %d statements, db %.1fms",
+                scope["method"],
+                route,
+                status,
+                elapsed * 1000,
+                metrics.statements,
+                metrics.db_time * 1000,
+                extra={
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "db_statements": metrics.statements,
+                    "db_time_ms": round(metrics.db_time * 1000, 3),
+                    "db_pool_wait_ms": round(metrics.pool_wait * 1000, 3),
+                    "db_rows": metrics.rows,
+                },
+            )
+            request_id.reset(request_id_token)
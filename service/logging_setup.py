@@ -0,0 +1,154 @@
+"""Logging of the app: records are put on a queue on the calling thread,
+formatted and written by a QueueListener thread, so neither the message
+formatting nor the file I/O runs on the event loop.
+
+The lines are JSON objects with the request id of the record's context
+and the `extra` fields. Debug and info records of a logger can be sampled,
+e.g. LOG_SAMPLING="service.db_accessors=0.1" keeps 10% of them."""
+
+import atexit
+import json
+import logging
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+TEXT_FORMAT = (
+    "[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s "
+    "%(request_id)s - %(message)s"
+)
+
+# attributes of every LogRecord, the rest came from `extra`
+RECORD_ATTRIBUTES = frozenset(
+    logging.makeLogRecord({}).__dict__.keys()
+    | {"message", "asctime", "request_id"}
+)
+
+
+def parse_sampling(value: str) -> dict[str, float]:
+    """ "service.db_accessors=0.1,sqlalchemy=0" -> {name: rate}"""
+    rates = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, rate = item.split("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` part of the records below WARNING of a logger
+    and its children, the most specific logger name wins"""
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+
+    def rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "location": f"{record.module}:{record.lineno}",
+        }
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Only stamps the record with the request id and puts it on the queue.
+    The stdlib handler formats the message here, the listener does it
+    instead, so the logged arguments must not be changed after the call.
+    When the queue is full the record is dropped and counted"""
+
+    def __init__(self, records: queue.Queue) -> None:
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+queue_handler: AsyncQueueHandler | None = None
+_listener: QueueListener | None = None
+
+
+def configure_logging(
+    level: str,
+    filename: str | None,
+    log_format: str,
+    sampling: dict[str, float],
+    queue_size: int,
+) -> None:
+    """Replaces the handlers of the root logger with the queue handler"""
+    global queue_handler, _listener
+    stop_logging()
+
+    target = (
+        logging.FileHandler(filename) if filename else logging.StreamHandler()
+    )
+    target.setFormatter(
+        JsonFormatter()
+        if log_format == "json"
+        else logging.Formatter(TEXT_FORMAT, datefmt="%Y-%m-%d %H:%M:%S")
+    )
+    queue_handler = AsyncQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(
+        queue_handler.queue, target, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Writes the queued records and stops the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,217 @@
+"""Maintenance commands: python -m service.manage <command> [options]"""
+
+import argparse
+import asyncio
+
+from service.bulk_loader import CsvSource, SyntheticSource, load
+from service.config import STOCK_BUCKETS, partition_settings
+from service.db_accessors import (
+    PartitionAccessor,
+    RollupAccessor,
+    StockAccessor,
+)
+from service.db_setup.db_settings import db_connector
+
+
+async def shard_stock(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        await StockAccessor(session).shard_product(
+            args.product_id, args.buckets
+        )
+    print(f"Product {args.product_id}: stock split into {args.buckets}")
+
+
+async def unshard_stock(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        await StockAccessor(session).unshard_product(args.product_id)
+    print(f"Product {args.product_id}: stock moved back to the product")
+
+
+async def rebalance_stock(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        if args.product_id:
+            await StockAccessor(session).rebalance_product(args.product_id)
+            count = 1
+        else:
+            count = await StockAccessor(session).rebalance_all()
+    print(f"Rebalanced {count} product(s)")
+
+
+async def rebuild_sales_rollup(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        count = await RollupAccessor(session).rebuild_product_sales_daily()
+    print(f"product_sales_daily rebuilt: {count} row(s)")
+
+
+async def compact_sales_rollup(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        count = await RollupAccessor(session).compact_product_sales_daily()
+    print(f"product_sales_daily compacted: {count} day(s) folded")
+
+
+async def reconcile_client_totals(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        drift = await RollupAccessor(session).reconcile_client_order_totals(
+            repair=args.repair
+        )
+    for row in drift:
+        print(
+            f"client {row.client_id}: stored={row.stored} actual={row.actual}"
+        )
+    action = "repaired" if args.repair else "found"
+    print(f"Drift {action} for {len(drift)} client(s)")
+
+
+async def maintain_partitions(args: argparse.Namespace) -> None:
+    async with db_connector.session_maker() as session:
+        accessor = PartitionAccessor(session)
+        if not await accessor.is_partitioned():
+            print("order is not partitioned, run the migrations")
+            return
+        await session.commit()
+        created = await accessor.create_partitions(args.months_ahead)
+        archived, kept = await accessor.archive_partitions(
+            args.retention_months, args.archive_schema
+        )
+    for month in created:
+        print(f"{month:%Y-%m}: partitions created")
+    for month in archived:
+        print(f"{month:%Y-%m}: archived to {args.archive_schema}")
+    for month in kept:
+        print(f"{month:%Y-%m}: kept, has active orders")
+    print(
+        f"Created {len(created)}, archived {len(archived)}, "
+        f"kept {len(kept)} month(s)"
+    )
+
+
+async def load_data(args: argparse.Namespace) -> None:
+    if args.from_dir:
+        source = CsvSource(args.from_dir)
+    else:
+        source = SyntheticSource(
+            clients=args.clients,
+            products=args.products,
+            orders=args.orders,
+            items_per_order=args.items_per_order,
+            category_depth=args.category_depth,
+            category_fanout=args.category_fanout,
+        )
+    async with db_connector.session_maker() as session:
+        report = await load(session, source, drop_indexes=args.drop_indexes)
+    for table, entry in report.summary().items():
+        print(
+            f"{table}: {entry['rows']} row(s) in {entry['seconds']}s, "
+            f"{entry['rows_per_second']} rows/s"
+        )
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive int")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m service.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "shard-stock", help="split product stock into buckets"
+    )
+    command.add_argument("--product-id", type=positive_int, required=True)
+    command.add_argument("--buckets", type=positive_int, default=STOCK_BUCKETS)
+    command.set_defaults(handler=shard_stock)
+
+    command = commands.add_parser(
+        "unshard-stock", help="move bucket stock back to the product"
+    )
+    command.add_argument("--product-id", type=positive_int, required=True)
+    command.set_defaults(handler=unshard_stock)
+
+    command = commands.add_parser(
+        "rebalance-stock", help="spread stock evenly over buckets"
+    )
+    command.add_argument("--product-id", type=positive_int)
+    command.set_defaults(handler=rebalance_stock)
+
+    command = commands.add_parser(
+        "rebuild-sales-rollup",
+        help="recompute product_sales_daily from order items",
+    )
+    command.set_defaults(handler=rebuild_sales_rollup)
+
+    command = commands.add_parser(
+        "compact-sales-rollup",
+        help="fold the product_sales_daily buckets of the past days",
+    )
+    command.set_defaults(handler=compact_sales_rollup)
+
+    command = commands.add_parser(
+        "reconcile-client-totals",
+        help="compare client_order_totals with the order items",
+    )
+    command.add_argument(
+        "--repair", action="store_true", help="fix the drifted totals"
+    )
+    command.set_defaults(handler=reconcile_client_totals)
+
+    command = commands.add_parser(
+        "maintain-partitions",
+        help="create the coming order partitions, archive the old ones",
+    )
+    command.add_argument(
+        "--months-ahead",
+        type=int,
+        default=partition_settings["months_ahead"],
+    )
+    command.add_argument(
+        "--retention-months",
+        type=int,
+        default=partition_settings["retention_months"],
+        help="months before the current one which are never archived",
+    )
+    command.add_argument(
+        "--archive-schema", default=partition_settings["archive_schema"]
+    )
+    command.set_defaults(handler=maintain_partitions)
+
+    command = commands.add_parser(
+        "load-data",
+        help="bulk load catalog, clients and orders with COPY",
+    )
+    source = command.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--from-dir",
+        help="directory with categories.csv, products.csv, "
+        "clients.csv and orders.csv",
+    )
+    source.add_argument(
+        "--synthetic", action="store_true", help="generate the data"
+    )
+    command.add_argument("--clients", type=positive_int, default=1000)
+    command.add_argument("--products", type=positive_int, default=1000)
+    command.add_argument("--orders", type=positive_int, default=10000)
+    command.add_argument("--items-per-order", type=positive_int, default=3)
+    command.add_argument("--category-depth", type=positive_int, default=3)
+    command.add_argument("--category-fanout", type=positive_int, default=5)
+    command.add_argument(
+        "--drop-indexes",
+        action="store_true",
+        help="drop secondary indexes for the load and rebuild them after",
+    )
+    command.set_defaults(handler=load_data)
+
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    try:
+        await args.handler(args)
+    finally:
+        await db_connector.dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(build_parser().parse_args()))
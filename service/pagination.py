@@ -0,0 +1,25 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from service.exceptions import InvalidCursor
+
+
+def encode_cursor(after_id: int) -> str:
+    """Opaque keyset cursor: the last id of the returned page"""
+    data = json.dumps({"after": after_id}).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after_id = json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(f"Invalid cursor {cursor}") from exc
+    if not isinstance(after_id, int):
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+    return after_id
@@ -0,0 +1,164 @@
+"""StatisticAccessor on the asyncpg connection under the session.
+
+The SQL is compiled once from the StatisticAccessor statements and run by
+the driver directly, the records become tuple-backed rows. That skips the
+result processing of SQLAlchemy and its greenlet switch per call.
+The statements are not seen by the engine events (instrumentation and
+the slow query log). STATISTIC_ACCESSOR=asyncpg selects it."""
+
+from collections import namedtuple
+from functools import cache
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+
+from service.config import EXPORT_BATCH_SIZE
+from service.db_accessors import StatisticAccessor
+
+
+class RowMixin:
+    """Attribute access and iteration like Row, dict(row) like RowMapping"""
+
+    __slots__ = ()
+
+    def keys(self) -> tuple[str, ...]:
+        return self._fields
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+
+class ClientOrderSumRow(
+    RowMixin, namedtuple("ClientOrderSumRow", ("id", "name", "total_sum"))
+):
+    __slots__ = ()
+
+
+class SubcategoryCountRow(
+    RowMixin,
+    namedtuple("SubcategoryCountRow", ("title", "subcategories_count")),
+):
+    __slots__ = ()
+
+
+class TopProductRow(
+    RowMixin,
+    namedtuple(
+        "TopProductRow",
+        ("product_title", "top_parent_title", "total_quantity"),
+    ),
+):
+    __slots__ = ()
+
+
+class ProductSalesRow(
+    RowMixin,
+    namedtuple(
+        "ProductSalesRow",
+        ("product_id", "product_title", "top_parent_title", "total_quantity"),
+    ),
+):
+    __slots__ = ()
+
+
+_dialect = PGDialect_asyncpg()
+
+
+@cache
+def compiled_sql(statement) -> tuple[str, tuple[str, ...], dict]:
+    """SQL of a cached statement, the names of its $n parameters
+    and the values of those which are set in the statement"""
+    compiled = statement.compile(dialect=_dialect)
+    return str(compiled), tuple(compiled.positiontup or ()), compiled.params
+
+
+def positional(statement, params: dict) -> tuple[str, list]:
+    sql, names, defaults = compiled_sql(statement)
+    return sql, [
+        params[name] if name in params else defaults[name] for name in names
+    ]
+
+
+class RawStatisticAccessor(StatisticAccessor):
+    async def _driver_connection(self):
+        connection = await self.session.connection()
+        raw_connection = await connection.get_raw_connection()
+        return raw_connection.driver_connection
+
+    async def _fetch(self, statement, params: dict, row_type) -> list:
+        sql, args = positional(statement, params)
+        connection = await self._driver_connection()
+        records = await connection.fetch(sql, *args)
+        return [row_type._make(record) for record in records]
+
+    async def _stream_rows(
+        self, statement, params: dict, row_type
+    ) -> AsyncIterator[list]:
+        sql, args = positional(statement, params)
+        connection = await self._driver_connection()
+        # a cursor needs a transaction, nested in the session's one if
+        # that has started
+        async with connection.transaction():
+            batch = []
+            async for record in connection.cursor(
+                sql, *args, prefetch=EXPORT_BATCH_SIZE
+            ):
+                batch.append(row_type._make(record))
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    async def get_client_orders_sum(
+        self,
+        exact: bool = False,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ):
+        query = self.client_orders_sum_page_query(
+            exact, after_id is not None, limit is not None
+        )
+        return await self._fetch(
+            query, {"after_id": after_id, "limit": limit}, ClientOrderSumRow
+        )
+
+    async def stream_client_orders_sum(
+        self, exact: bool = False
+    ) -> AsyncIterator[list]:
+        query = self.client_orders_sum_page_query(exact, False, False)
+        async for rows in self._stream_rows(query, {}, ClientOrderSumRow):
+            yield rows
+
+    async def get_count_subcategories(self):
+        return await self._fetch(
+            self.count_subcategories_query(), {}, SubcategoryCountRow
+        )
+
+    async def get_top_selling_products(
+        self,
+        date_from=None,
+        date_to=None,
+        limit: int = 5,
+        category_id: Optional[int] = None,
+        level: int = 1,
+        per_category: bool = False,
+    ):
+        query, params = self.top_selling_products_statement(
+            date_from, date_to, limit, category_id, level, per_category
+        )
+        return await self._fetch(query, params, TopProductRow)
+
+    async def stream_product_sales(self) -> AsyncIterator[list]:
+        async for rows in self._stream_rows(
+            self.product_sales_query(), {}, ProductSalesRow
+        ):
+            yield rows
+
+
+STATISTIC_ACCESSORS: dict[str, type[StatisticAccessor]] = {
+    "sqlalchemy": StatisticAccessor,
+    "asyncpg": RawStatisticAccessor,
+}
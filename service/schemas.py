@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
 
 
 class UserInput(BaseModel):
@@ -19,3 +21,42 @@ class TopProducts(BaseModel):
 class ClientOrderSum(BaseModel):
     name: str
     total_sum: float
+
+
+class ClientOrderSumPage(BaseModel):
+    items: list[ClientOrderSum]
+    next_cursor: str | None = None
+
+
+class CartLine(BaseModel):
+    product_id: int = Field(..., gt=0)
+    quantity: int = Field(..., gt=0)
+
+
+class CartBatchInput(BaseModel):
+    order_id: int = Field(..., gt=0)
+    items: list[CartLine] = Field(..., min_length=1, max_length=200)
+
+
+class CartLineResult(BaseModel):
+    product_id: int
+    quantity: int
+    status: Literal["added", "not_found", "not_available"]
+    available: int | None = None
+
+
+class CartBatchResult(BaseModel):
+    order_id: int
+    results: list[CartLineResult]
+
+
+class ImportRowError(BaseModel):
+    line: int
+    reason: str
+
+
+class ImportResult(BaseModel):
+    inserted: int
+    updated: int
+    rejected: int
+    errors: list[ImportRowError]
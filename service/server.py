@@ -0,0 +1,91 @@
+"""Production server: python -m service.server [options]
+
+The app runs in --workers processes (WEB_WORKERS, 0 - one per CPU) on
+uvloop with the httptools parser. On SIGTERM a worker stops accepting
+connections, lets the running requests finish for at most
+WEB_GRACEFUL_TIMEOUT seconds, waits for the checked out connections
+to come back and closes its pool.
+With DB_CONNECTION_BUDGET the pool of every worker is cut down so that
+all the workers together stay within the budget."""
+
+import argparse
+import os
+
+import uvicorn
+
+from service.config import db_pool_settings, logger, server_settings
+from service.db_setup.db_settings import split_connection_budget
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m service.server")
+    parser.add_argument("--host", default=server_settings["host"])
+    parser.add_argument("--port", type=int, default=server_settings["port"])
+    parser.add_argument(
+        "--workers", type=int, default=server_settings["workers"]
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=server_settings["backlog"],
+        help="connections waiting to be accepted",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=server_settings["keep_alive"],
+        help="seconds an idle connection is kept open",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=server_settings["graceful_timeout"],
+    )
+    return parser
+
+
+def uvicorn_options(args: argparse.Namespace) -> dict:
+    return {
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "loop": server_settings["loop"],
+        "http": server_settings["http"],
+        "backlog": args.backlog,
+        "timeout_keep_alive": args.keep_alive,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "lifespan": "on",
+        # InstrumentationMiddleware logs every request
+        "access_log": False,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.workers < 1:
+        args.workers = os.cpu_count() or 1
+    # fails before any worker starts when the budget is too small
+    pool_size, max_overflow = split_connection_budget(
+        db_pool_settings["pool_size"],
+        db_pool_settings["max_overflow"],
+        db_pool_settings["connection_budget"],
+        args.workers,
+    )
+    # the workers are new processes, they read the settings again
+    os.environ["WEB_WORKERS"] = str(args.workers)
+    os.environ["WEB_GRACEFUL_TIMEOUT"] = str(args.graceful_timeout)
+    server_settings["workers"] = args.workers
+    server_settings["graceful_timeout"] = args.graceful_timeout
+    logger.warning(
+        "Starting %d worker(s) on %s:%d, DB pool %d + %d overflow each",
+        args.workers,
+        args.host,
+        args.port,
+        pool_size,
+        max_overflow,
+    )
+    uvicorn.run("service.__main__:app", **uvicorn_options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Slow query log: statements over the threshold are logged with their
+caller, a sampled part of them gets EXPLAIN (ANALYZE, BUFFERS).
+The last entries are kept in a ring buffer for /admin/slow-queries."""
+
+import json
+import random
+import re
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import greenlet
+
+from service.config import logger, slow_query_settings
+
+# EXPLAIN ANALYZE runs the statement once more
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|COPY|LOCK)\b", re.I)
+READS = re.compile(r"^\s*(SELECT|WITH)\b", re.I)
+
+
+def redact(parameters) -> list[str] | dict[str, str]:
+    """Only the types of the bound values are kept"""
+    if isinstance(parameters, dict):
+        return {
+            name: type(value).__name__ for name, value in parameters.items()
+        }
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return []
+
+
+def _frames():
+    frame = sys._getframe(1)
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+    # the statement runs in a greenlet of SQLAlchemy,
+    # the awaiting coroutines are on the stack of its parent
+    parent = greenlet.getcurrent().parent
+    frame = parent.gr_frame if parent is not None else None
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def find_caller() -> str | None:
+    """The innermost function of the service outside the db layer,
+    e.g. service.db_accessors.StatisticAccessor.get_top_selling_products"""
+    for frame in _frames():
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("service.") and not module.startswith(
+            ("service.db_setup", "service.instrumentation", __name__)
+        ):
+            return f"{module}.{frame.f_code.co_qualname}"
+    return None
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float,
+        explain_sample_rate: float,
+        buffer_size: int,
+    ) -> None:
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.entries: deque[dict] = deque(maxlen=buffer_size)
+
+    def check(self, connection, statement: str, parameters, elapsed: float):
+        """Called after every statement, connection is the DBAPI one"""
+        duration_ms = elapsed * 1000
+        if not self.threshold_ms or duration_ms < self.threshold_ms:
+            return
+        caller = find_caller()
+        logger.warning(
+            "Slow query %.1fms in %s: %s",
+            duration_ms,
+            caller,
+            statement,
+            extra={
+                "duration_ms": round(duration_ms, 3),
+                "caller": caller,
+                "parameters": redact(parameters),
+            },
+        )
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "caller": caller,
+            "statement": statement,
+            "parameters": redact(parameters),
+            "plan": None,
+        }
+        if (
+            self.explain_sample_rate
+            and random.random() < self.explain_sample_rate
+            and READS.match(statement)
+            and not WRITES.search(statement)
+        ):
+            entry["plan"] = self.explain(connection, statement, parameters)
+        self.entries.append(entry)
+
+    @staticmethod
+    def explain(connection, statement: str, parameters):
+        """Runs in the transaction of the slow statement,
+        with a cursor of its own to keep the fetched rows"""
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        # a failed EXPLAIN must not abort the transaction of the request
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}",
+                parameters,
+            )
+            plan = cursor.fetchone()[0]
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as exc:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            logger.warning("EXPLAIN of a slow query failed", exc_info=exc)
+            return None
+        finally:
+            cursor.close()
+        logger.info(
+            "EXPLAIN took %.1fms", (time.perf_counter() - start) * 1000
+        )
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+slow_query_log = SlowQueryLog(**slow_query_settings)
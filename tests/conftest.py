@@ -14,10 +14,17 @@ from sqlalchemy.ext.asyncio import (
 )
 
 from service.__main__ import app
-from service.db_setup.db_settings import get_session
+from service.cache import statistic_cache
+from service.db_setup.db_settings import (
+    get_read_session,
+    get_read_session_maker,
+    get_session,
+    get_session_maker,
+)
 from service.db_setup.models import (
     Base,
 )
+from service.instrumentation import instrument_engine
 
 from .fixtures import *
 
@@ -39,6 +46,7 @@ def apply_migrations():
 @pytest.fixture(scope="function")
 async def test_engine() -> AsyncGenerator[AsyncEngine, None]:
     engine = create_async_engine(TEST_DB_URL, echo=True)
+    instrument_engine(engine)
     try:
         yield engine
     finally:
@@ -80,6 +88,12 @@ async def client(
             yield sess
 
     app.dependency_overrides[get_session] = override_get_session
+    app.dependency_overrides[get_session_maker] = lambda: test_session_factory
+    app.dependency_overrides[get_read_session] = override_get_session
+    app.dependency_overrides[get_read_session_maker] = lambda: (
+        test_session_factory
+    )
+    await statistic_cache.clear()
 
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://test"
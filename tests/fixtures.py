@@ -1,8 +1,14 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import pytest_asyncio
 import sqlalchemy
 
+from service.db_accessors import (
+    RollupAccessor,
+    add_months,
+    create_partition_statements,
+    month_start,
+)
 from service.db_setup.models import Category, Client, Order, OrderItem, Product
 
 
@@ -86,10 +92,12 @@ async def prepare_orders_for_statistic(
         session.add_all([client])
         await session.flush()
 
+        # out of the default 30 days window of the top-selling report
+        old = datetime.now(timezone.utc) - timedelta(days=40)
+        for statement in create_partition_statements(month_start(old)):
+            await session.execute(sqlalchemy.text(statement))
         order = Order(client_id=client.id, date=datetime.now())
-        order_old = Order(
-            client_id=client.id, date=datetime.now() - timedelta(days=40)
-        )
+        order_old = Order(client_id=client.id, date=old, created_at=old)
         product1 = Product(
             title="SmartphoneX",
             price=10.0,
@@ -107,12 +115,14 @@ async def prepare_orders_for_statistic(
 
         order_item1 = OrderItem(
             order_id=order.id,
+            order_created_at=order.created_at,
             product_id=product1.id,
             quantity=2,
             price_at_time=10.0,
         )
         order_item2 = OrderItem(
             order_id=order.id,
+            order_created_at=order.created_at,
             product_id=product2.id,
             quantity=3,
             price_at_time=5.0,
@@ -120,9 +130,123 @@ async def prepare_orders_for_statistic(
 
         order_item3 = OrderItem(
             order_id=order_old.id,
+            order_created_at=order_old.created_at,
             product_id=product2.id,
             quantity=30,
             price_at_time=5.0,
         )
         session.add_all([order_item1, order_item2, order_item3])
         await session.commit()
+
+        await RollupAccessor(session).rebuild_product_sales_daily()
+        await RollupAccessor(session).reconcile_client_order_totals(
+            repair=True
+        )
+
+
+@pytest_asyncio.fixture(scope="function")
+async def prepare_products_for_batch(
+    apply_migrations, test_session_factory
+) -> None:
+    async with test_session_factory() as session:
+        client = Client(
+            name="Test Client",
+            email="test@example.com",
+            address="Test Address",
+        )
+        category = Category(title="Test Category 1")
+        session.add_all([category, client])
+        await session.flush()
+
+        order = Order(client_id=client.id)
+        product1 = Product(
+            title="Test Product 1",
+            price=10.0,
+            category_id=category.id,
+            quantity=5,
+        )
+        product2 = Product(
+            title="Test Product 2",
+            price=3.0,
+            category_id=category.id,
+            quantity=1,
+        )
+        session.add_all([order, product1, product2])
+        await session.commit()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def prepare_clients_with_orders(
+    apply_migrations, test_session_factory
+) -> None:
+    async with test_session_factory() as session:
+        clients = [
+            Client(name=f"Client {number}", email=f"client{number}@mail.com")
+            for number in range(5)
+        ]
+        session.add_all(clients)
+        await session.flush()
+        session.add_all([Order(client_id=client.id) for client in clients])
+        await session.commit()
+
+        await RollupAccessor(session).reconcile_client_order_totals(
+            repair=True
+        )
+
+
+@pytest_asyncio.fixture(scope="function")
+async def prepare_plan_dataset(apply_migrations, test_session_factory) -> None:
+    """Enough rows for the planner to prefer indexes where they help:
+    10 top categories with 9 subcategories each, 20000 products,
+    5000 clients, 20000 orders over a year and 60000 order items"""
+    statements = [
+        """
+        INSERT INTO category (title)
+        SELECT 'Top ' || g FROM generate_series(1, 10) g
+        """,
+        """
+        INSERT INTO category (title, parent_id)
+        SELECT 'Sub ' || g, g % 10 + 1 FROM generate_series(1, 90) g
+        """,
+        """
+        INSERT INTO client (name, email)
+        SELECT 'Client ' || g, 'client' || g || '@mail.com'
+        FROM generate_series(1, 5000) g
+        """,
+        """
+        INSERT INTO product (title, price, category_id, quantity)
+        SELECT 'Product ' || g, 10, g % 100 + 1, 1000
+        FROM generate_series(1, 20000) g
+        """,
+        """
+        INSERT INTO "order" (client_id, date, created_at)
+        SELECT g % 5000 + 1, moment, moment
+        FROM generate_series(1, 20000) g,
+            LATERAL (SELECT now() - (g % 365) * interval '1 day') AS m(moment)
+        """,
+        """
+        INSERT INTO order_item (
+            order_id, order_created_at, product_id, quantity, price_at_time
+        )
+        SELECT o.id, o.created_at, (g * 7 + g / 20000) % 20000 + 1, 1, 10
+        FROM generate_series(1, 60000) g
+        JOIN "order" AS o ON o.id = g % 20000 + 1
+        """,
+    ]
+    current = month_start(datetime.now(timezone.utc))
+    async with test_session_factory() as session:
+        for count in range(1, 13):
+            for statement in create_partition_statements(
+                add_months(current, -count)
+            ):
+                await session.execute(sqlalchemy.text(statement))
+        for statement in statements:
+            await session.execute(sqlalchemy.text(statement))
+        await session.commit()
+
+        await RollupAccessor(session).rebuild_product_sales_daily()
+        await RollupAccessor(session).reconcile_client_order_totals(
+            repair=True
+        )
+        await session.execute(sqlalchemy.text("ANALYZE"))
+        await session.commit()
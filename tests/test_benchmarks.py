@@ -0,0 +1,60 @@
+from benchmarks.accessors import CALLS
+from benchmarks.accessors import measure as measure_accessors
+from benchmarks.dataset import SCALES, seed
+from benchmarks.runner import SCENARIOS, Bounds, percentile, run_scenarios
+from benchmarks.statements import SHAPES, measure
+from service.db_accessors import StatisticAccessor
+
+
+def test_percentile_nearest_rank():
+    latencies = [float(number) for number in range(1, 101)]
+    assert percentile(latencies, 50) == 50.0
+    assert percentile(latencies, 99) == 99.0
+    assert percentile([7.0], 95) == 7.0
+
+
+async def test_benchmark_scenarios_on_tiny_dataset(
+    client, apply_migrations, test_session_factory
+):
+    scale = SCALES["tiny"]
+    await seed(test_session_factory, scale)
+    bounds = await Bounds.load(test_session_factory)
+    assert (bounds.clients, bounds.products, bounds.orders) == (
+        scale.clients,
+        scale.products,
+        scale.orders,
+    )
+
+    results = await run_scenarios(
+        client, bounds, list(SCENARIOS), requests=5, concurrency=2
+    )
+
+    assert set(results) == set(SCENARIOS)
+    for result in results.values():
+        assert result["requests"] == 5
+        assert result["errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+
+def test_statements_are_built_once():
+    query = StatisticAccessor.top_selling_products_query(True, True, False)
+    assert (
+        StatisticAccessor.top_selling_products_query(True, True, False)
+        is query
+    )
+
+    results = measure(calls=5)
+    assert set(results) == set(SHAPES)
+    for result in results.values():
+        assert result["rebuilt_us"] > 0
+        assert result["prebuilt_us"] > 0
+
+
+async def test_accessors_side_by_side(
+    prepare_orders_for_statistic, test_session_factory
+):
+    results = await measure_accessors(test_session_factory, calls=3)
+    assert set(results) == set(CALLS)
+    for result in results.values():
+        assert set(result) == {"sqlalchemy", "asyncpg"}
+        assert result["asyncpg"]["requests"] == 3
@@ -0,0 +1,150 @@
+import sqlalchemy as sa
+
+from service.bulk_loader import CsvSource, SyntheticSource, load
+from service.cache import MISSING, statistic_cache
+from service.db_setup.models import (
+    Category,
+    CategoryClosure,
+    Client,
+    ClientOrderTotal,
+    Order,
+    OrderItem,
+    Product,
+    ProductSalesDaily,
+)
+
+# test_load_csv_resolves_parents makes the partitions of 2026-01
+INDEXES_QUERY = (
+    "SELECT indexname FROM pg_indexes WHERE tablename NOT LIKE '%\\_y2026m01'"
+)
+
+
+async def count(session, model) -> int:
+    return (
+        await session.execute(sa.select(sa.func.count()).select_from(model))
+    ).scalar_one()
+
+
+async def test_load_synthetic(apply_migrations, test_session_factory):
+    source = SyntheticSource(
+        clients=30,
+        products=40,
+        orders=50,
+        items_per_order=3,
+        category_depth=2,
+        category_fanout=3,
+    )
+    await statistic_cache.backend.set("count-subcategories:", [], ttl=60)
+    async with test_session_factory() as session:
+        report = await load(session, source)
+
+        # the loaded categories are counted by the next request
+        assert (
+            await statistic_cache.backend.get("count-subcategories:")
+            is MISSING
+        )
+        assert await count(session, Category) == 3 + 9
+        # every category with itself, the second level with its parent
+        assert await count(session, CategoryClosure) == 12 + 9
+        assert await count(session, Product) == 40
+        assert await count(session, Client) == 30
+        assert await count(session, Order) == 50
+        assert await count(session, OrderItem) == 150
+
+        sold = (
+            await session.execute(
+                sa.select(
+                    sa.select(sa.func.sum(OrderItem.quantity))
+                    .scalar_subquery()
+                    .label("items"),
+                    sa.select(sa.func.sum(ProductSalesDaily.quantity))
+                    .scalar_subquery()
+                    .label("rollup"),
+                )
+            )
+        ).one()
+        assert sold.items == sold.rollup
+        assert await count(session, ClientOrderTotal) > 0
+
+    summary = report.summary()
+    assert summary["order_item"]["rows"] == 150
+    assert summary["order_item"]["rows_per_second"] > 0
+
+
+async def test_load_csv_resolves_parents(
+    apply_migrations, test_session_factory, tmp_path
+):
+    # a child is listed before its parent
+    (tmp_path / "categories.csv").write_text(
+        "key,title,parent_key\n"
+        "phones,Smartphones,electronics\n"
+        "electronics,Electronics,\n"
+        "android,Android Phones,phones\n"
+    )
+    (tmp_path / "products.csv").write_text(
+        "title,price,category_key,quantity\nPixel,499.90,android,7\n"
+    )
+    (tmp_path / "clients.csv").write_text(
+        "name,email,address\nAnna,anna@mail.com,\n"
+    )
+    (tmp_path / "orders.csv").write_text(
+        "order_key,client_id,date,product_id,quantity,price_at_time\n"
+        "a,1,2026-01-02T10:00:00,1,2,499\n"
+    )
+
+    async with test_session_factory() as session:
+        indexes = set(
+            (await session.execute(sa.text(INDEXES_QUERY))).scalars()
+        )
+        await session.commit()
+
+        await load(session, CsvSource(tmp_path), drop_indexes=True)
+
+        parents = dict(
+            (
+                await session.execute(
+                    sa.select(Category.title, Category.parent_id)
+                )
+            ).all()
+        )
+        titles = dict(
+            (
+                await session.execute(sa.select(Category.id, Category.title))
+            ).all()
+        )
+        assert titles[parents["Android Phones"]] == "Smartphones"
+        assert titles[parents["Smartphones"]] == "Electronics"
+        assert parents["Electronics"] is None
+
+        top_parent = (
+            await session.execute(
+                sa.select(Category.title)
+                .join(
+                    CategoryClosure,
+                    CategoryClosure.ancestor_id == Category.id,
+                )
+                .join(
+                    Product,
+                    Product.category_id == CategoryClosure.descendant_id,
+                )
+                .where(Category.parent_id.is_(None))
+            )
+        ).scalar_one()
+        assert top_parent == "Electronics"
+
+        total = (
+            await session.execute(sa.select(ClientOrderTotal.total_sum))
+        ).scalar_one()
+        assert total == 998
+
+        partition = (
+            await session.execute(
+                sa.text('SELECT tableoid::regclass FROM "order"')
+            )
+        ).scalar_one()
+        assert str(partition) == "order_y2026m01"
+
+        assert (
+            set((await session.execute(sa.text(INDEXES_QUERY))).scalars())
+            == indexes
+        )
@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+from service.cache import (
+    MISSING,
+    CachedStatisticAccessor,
+    InMemoryCache,
+    StatisticCache,
+)
+
+
+async def test_in_memory_cache_lru():
+    cache = InMemoryCache(max_entries=2)
+    await cache.set("a:", 1, ttl=60)
+    await cache.set("b:", 2, ttl=60)
+    assert await cache.get("a:") == 1
+    await cache.set("c:", 3, ttl=60)
+
+    assert await cache.get("b:") is MISSING
+    assert await cache.get("a:") == 1
+    assert await cache.get("c:") == 3
+
+
+async def test_in_memory_cache_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("service.cache.time.monotonic", lambda: now)
+    cache = InMemoryCache(max_entries=10)
+    await cache.set("a:", 1, ttl=5)
+    assert await cache.get("a:") == 1
+
+    now += 5
+    assert await cache.get("a:") is MISSING
+
+
+async def test_in_memory_cache_max_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("service.cache.time.monotonic", lambda: now)
+    cache = InMemoryCache(max_entries=10, max_ttl=5)
+    await cache.set("a:", 1, ttl=60)
+
+    now += 5
+    assert await cache.get("a:") is MISSING
+
+
+async def test_concurrent_misses_are_coalesced():
+    cache = StatisticCache(InMemoryCache(max_entries=10))
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [calls]
+
+    results = await asyncio.gather(
+        *[cache.get_or_load("statistic-order:", 60, loader) for _ in range(5)]
+    )
+    assert results == [[1]] * 5
+    assert calls == 1
+    assert await cache.get_or_load("statistic-order:", 60, loader) == [1]
+
+
+async def test_invalidate():
+    cache = StatisticCache(InMemoryCache(max_entries=10))
+
+    async def loader():
+        return 1
+
+    await cache.get_or_load("client-order-sum:", 60, loader)
+    await cache.get_or_load("statistic-order:", 60, loader)
+    await cache.invalidate("client-order-sum")
+
+    assert await cache.backend.get("client-order-sum:") is MISSING
+    assert await cache.backend.get("statistic-order:") == 1
+
+
+async def test_value_loaded_before_invalidation_is_not_stored():
+    cache = StatisticCache(InMemoryCache(max_entries=10))
+    loading = asyncio.Event()
+
+    async def loader():
+        loading.set()
+        await asyncio.sleep(0.01)
+        return "stale"
+
+    task = asyncio.create_task(
+        cache.get_or_load("client-order-sum:", 60, loader)
+    )
+    await loading.wait()
+    await cache.invalidate("client-order-sum")
+
+    assert await task == "stale"
+    assert await cache.backend.get("client-order-sum:") is MISSING
+
+
+async def test_invalidation_is_shared_through_the_backend():
+    """Two workers on one backend: a value loaded by one of them while
+    the other invalidates is not stored"""
+    backend = InMemoryCache(max_entries=10)
+    first, second = StatisticCache(backend), StatisticCache(backend)
+    loading = asyncio.Event()
+
+    async def loader():
+        loading.set()
+        await asyncio.sleep(0.01)
+        return "stale"
+
+    task = asyncio.create_task(
+        first.get_or_load("client-order-sum:", 60, loader)
+    )
+    await loading.wait()
+    await second.invalidate("client-order-sum")
+
+    assert await task == "stale"
+    assert await backend.get("client-order-sum:") is MISSING
+
+
+async def test_failed_load_is_not_shared():
+    cache = StatisticCache(InMemoryCache(max_entries=10))
+
+    async def failing_loader():
+        await asyncio.sleep(0.01)
+        raise ValueError("db is down")
+
+    async def loader():
+        return 1
+
+    first = asyncio.create_task(
+        cache.get_or_load("statistic-order:", 60, failing_loader)
+    )
+    await asyncio.sleep(0)
+    second = await cache.get_or_load("statistic-order:", 60, loader)
+
+    assert second == 1
+    with pytest.raises(ValueError):
+        await first
+
+
+async def test_max_ttl_caps_the_ttls(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("service.cache.time.monotonic", lambda: now)
+    cache = StatisticCache(InMemoryCache(max_entries=10))
+    calls = 0
+
+    class Accessor:
+        async def get_count_subcategories(self):
+            nonlocal calls
+            calls += 1
+            return calls
+
+    replica = CachedStatisticAccessor(Accessor(), cache, max_ttl=5)
+    assert await replica.get_count_subcategories() == 1
+    now += 4
+    assert await replica.get_count_subcategories() == 1
+    now += 1
+    assert await replica.get_count_subcategories() == 2
+
+    primary = CachedStatisticAccessor(Accessor(), cache)
+    now += 5
+    assert await primary.get_count_subcategories() == 3
+    now += 5
+    assert await primary.get_count_subcategories() == 3
@@ -1,11 +1,40 @@
+import asyncio
 import logging
 import time
 from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 
+import pytest
 import sqlalchemy as sa
 
-from service.db_accessors import OrderClientAccessor, StatisticAccessor
-from service.db_setup.models import Category, Product
+from service.db_accessors import (
+    AtomicOrderProductAccessor,
+    OrderClientAccessor,
+    OrderProductAccessor,
+    RollupAccessor,
+    StatisticAccessor,
+    StockAccessor,
+    add_months,
+    create_partition_statements,
+    month_start,
+    sales_bucket,
+)
+from service.db_setup.models import (
+    Category,
+    CategoryClosure,
+    ClientOrderTotal,
+    Order,
+    OrderItem,
+    Product,
+    ProductSalesDaily,
+    ProductStockBucket,
+)
+from service.exceptions import (
+    OrderNotFound,
+    ProductNotAvailable,
+    ProductNotFound,
+)
+from service.raw_accessors import RawStatisticAccessor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
@@ -70,3 +99,457 @@ async def test_run_sql(
 
         for child_id, top_parent_id, _ in results:
             logger.info(f"Category {child_id} -> Top Parent: {top_parent_id}")
+
+
+async def test_atomic_add_product_to_order(
+    prepare_product_and_order, test_session_factory
+):
+    async with test_session_factory() as session:
+        accessor = AtomicOrderProductAccessor(session)
+        await accessor.add_product_to_order(1, 1, 1)
+        await accessor.add_product_to_order(1, 1, 1)
+
+        product = await session.get(Product, 1)
+        await session.refresh(product)
+        assert product.quantity == 0
+        order_item = (
+            await session.execute(
+                sa.select(OrderItem).where(
+                    OrderItem.order_id == 1, OrderItem.product_id == 1
+                )
+            )
+        ).scalar_one()
+        assert order_item.quantity == 2
+        assert order_item.price_at_time == 10
+        sold = await session.scalar(
+            sa.select(sa.func.sum(ProductSalesDaily.quantity))
+        )
+        assert sold == 2
+        total = (
+            await session.execute(sa.select(ClientOrderTotal.total_sum))
+        ).scalar_one()
+        assert total == 20
+
+
+@pytest.mark.parametrize(
+    "order_id, product_id, quantity, error",
+    [
+        (9999, 1, 1, OrderNotFound),
+        (1, 9999, 1, ProductNotFound),
+        (1, 1, 3, ProductNotAvailable),
+    ],
+)
+async def test_atomic_add_product_to_order_errors(
+    prepare_product_and_order,
+    test_session_factory,
+    order_id,
+    product_id,
+    quantity,
+    error,
+):
+    async with test_session_factory() as session:
+        accessor = AtomicOrderProductAccessor(session)
+        with pytest.raises(error):
+            await accessor.add_product_to_order(order_id, product_id, quantity)
+
+        product = await session.get(Product, 1)
+        assert product.quantity == 2
+        order_items = (await session.execute(sa.select(OrderItem))).all()
+        assert order_items == []
+
+
+async def get_buckets(session, product_id):
+    return (
+        (
+            await session.execute(
+                sa.select(ProductStockBucket.quantity)
+                .where(ProductStockBucket.product_id == product_id)
+                .order_by(ProductStockBucket.bucket)
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+
+async def test_sharded_stock(prepare_products_for_batch, test_session_factory):
+    async with test_session_factory() as session:
+        stock_accessor = StockAccessor(session)
+        await stock_accessor.shard_product(1, 3)
+        assert await get_buckets(session, 1) == [2, 2, 1]
+        assert await stock_accessor.get_stock(1) == 5
+        await session.commit()
+
+        # no single bucket holds 3, so the buckets are drained together
+        await OrderProductAccessor(session).add_product_to_order(1, 1, 3)
+        assert await stock_accessor.get_stock(1) == 2
+        await session.commit()
+
+        with pytest.raises(ProductNotAvailable):
+            await OrderProductAccessor(session).add_product_to_order(1, 1, 3)
+
+        await AtomicOrderProductAccessor(session).add_product_to_order(1, 1, 1)
+        results = await OrderProductAccessor(session).add_products_to_order(
+            1, [(1, 1), (1, 1)]
+        )
+        assert [result["status"] for result in results] == [
+            "added",
+            "not_available",
+        ]
+        assert results[1]["available"] == 0
+
+        order_item = (
+            await session.execute(
+                sa.select(OrderItem).where(OrderItem.product_id == 1)
+            )
+        ).scalar_one()
+        assert order_item.quantity == 5
+        await session.commit()
+
+        await stock_accessor.unshard_product(1)
+        product = await session.get(Product, 1)
+        assert product.stock_buckets == 0
+        assert product.quantity == 0
+        assert await get_buckets(session, 1) == []
+
+
+async def test_rebalance_stock(
+    prepare_products_for_batch, test_session_factory
+):
+    async with test_session_factory() as session:
+        stock_accessor = StockAccessor(session)
+        await stock_accessor.shard_product(1, 2)
+        await session.execute(
+            sa.update(ProductStockBucket)
+            .where(ProductStockBucket.bucket == 0)
+            .values(quantity=0)
+        )
+        await session.commit()
+
+        assert await stock_accessor.rebalance_all() == 1
+        assert await get_buckets(session, 1) == [1, 1]
+        product = await session.get(Product, 1)
+        await session.refresh(product)
+        assert product.quantity == 2
+
+
+async def test_sharded_stock_concurrent_orders(
+    prepare_products_for_batch, test_session_factory
+):
+    orders_count = 8
+    async with test_session_factory() as session:
+        session.add_all([Order(client_id=1) for _ in range(orders_count)])
+        await session.commit()
+        await StockAccessor(session).shard_product(1, 3)
+
+    async def add(order_id):
+        async with test_session_factory() as session:
+            try:
+                await OrderProductAccessor(session).add_product_to_order(
+                    order_id, 1, 1
+                )
+            except ProductNotAvailable:
+                return False
+            return True
+
+    added = await asyncio.gather(
+        *[add(order_id) for order_id in range(2, orders_count + 2)]
+    )
+    assert sum(added) == 5
+
+    async with test_session_factory() as session:
+        assert await StockAccessor(session).get_stock(1) == 0
+
+
+async def test_sales_rollup_buckets(
+    prepare_products_for_batch, test_session_factory
+):
+    """Open transactions of different connections record a sale
+    of the same product without waiting for each other"""
+    sessions = [test_session_factory() for _ in range(8)]
+    try:
+        buckets = {}
+        for session in sessions:
+            await session.begin()
+            bucket = await session.scalar(sa.select(sales_bucket()))
+            buckets.setdefault(bucket, session)
+        first, second = list(buckets.values())[:2]
+
+        today = datetime.now(timezone.utc).date()
+        await OrderProductAccessor(first)._record_sales({(1, today): 1})
+        await second.execute(sa.text("SET LOCAL lock_timeout = '1s'"))
+        await OrderProductAccessor(second)._record_sales({(1, today): 2})
+        await first.commit()
+        await second.commit()
+    finally:
+        for session in sessions:
+            await session.close()
+
+    async with test_session_factory() as session:
+        rows = (
+            await session.execute(
+                sa.select(ProductSalesDaily.quantity).order_by(
+                    ProductSalesDaily.quantity
+                )
+            )
+        ).scalars()
+        assert rows.all() == [1, 2]
+
+
+async def test_compact_sales_rollup(
+    prepare_products_for_batch, test_session_factory
+):
+    today = datetime.now(timezone.utc).date()
+    yesterday, earlier = today - timedelta(days=1), today - timedelta(days=2)
+    rows = [
+        (earlier, 3, 4),
+        (yesterday, 0, 1),
+        (yesterday, 1, 2),
+        (yesterday, 2, 3),
+        (today, 0, 1),
+        (today, 5, 1),
+    ]
+    async with test_session_factory() as session:
+        await session.execute(
+            sa.insert(ProductSalesDaily),
+            [
+                {"product_id": 1, "day": day, "bucket": bucket, "quantity": n}
+                for day, bucket, n in rows
+            ],
+        )
+        await session.commit()
+
+        rollup = RollupAccessor(session)
+        assert await rollup.compact_product_sales_daily() == 2
+        assert await rollup.compact_product_sales_daily() == 0
+        stored = (
+            await session.execute(
+                sa.select(
+                    ProductSalesDaily.day,
+                    ProductSalesDaily.bucket,
+                    ProductSalesDaily.quantity,
+                ).order_by(ProductSalesDaily.day, ProductSalesDaily.bucket)
+            )
+        ).all()
+        assert stored == [
+            (earlier, 0, 4),
+            (yesterday, 0, 6),
+            (today, 0, 1),
+            (today, 5, 1),
+        ]
+
+
+async def test_sales_rollup_matches_rebuild(
+    prepare_products_for_batch, test_session_factory
+):
+    """Sales count on the day the order was created, which a rebuild
+    from the order items can tell, not on the day of the add"""
+    created_at = add_months(
+        month_start(datetime.now(timezone.utc)), -1
+    ) + timedelta(days=14)
+    async with test_session_factory() as session:
+        for statement in create_partition_statements(month_start(created_at)):
+            await session.execute(sa.text(statement))
+        order = Order(
+            client_id=1,
+            created_at=datetime.combine(
+                created_at, datetime.min.time(), timezone.utc
+            ),
+        )
+        session.add(order)
+        await session.commit()
+
+        await OrderProductAccessor(session).add_product_to_order(
+            order.id, 1, 1
+        )
+        await AtomicOrderProductAccessor(session).add_product_to_order(
+            order.id, 1, 1
+        )
+        await OrderProductAccessor(session).add_products_to_order(
+            order.id, [(1, 1), (2, 1)]
+        )
+        await OrderProductAccessor(session).add_to_orders([(order.id, 1, 1)])
+
+        sales_query = (
+            sa.select(
+                ProductSalesDaily.product_id,
+                ProductSalesDaily.day,
+                sa.func.sum(ProductSalesDaily.quantity),
+            )
+            .group_by(ProductSalesDaily.product_id, ProductSalesDaily.day)
+            .order_by(ProductSalesDaily.product_id)
+        )
+        sales = (await session.execute(sales_query)).all()
+        assert sales == [(1, created_at, 4), (2, created_at, 1)]
+        await session.commit()
+
+        await RollupAccessor(session).rebuild_product_sales_daily()
+        assert (await session.execute(sales_query)).all() == sales
+
+
+async def test_top_selling_default_window(
+    prepare_products_for_batch, test_session_factory
+):
+    today = datetime.now(timezone.utc).date()
+    async with test_session_factory() as session:
+        session.add_all(
+            [
+                ProductSalesDaily(
+                    product_id=1, day=today - timedelta(days=29), quantity=1
+                ),
+                ProductSalesDaily(
+                    product_id=2, day=today - timedelta(days=30), quantity=5
+                ),
+            ]
+        )
+        await session.commit()
+
+        results = await StatisticAccessor(session).get_top_selling_products()
+        assert [row["product_title"] for row in results] == ["Test Product 1"]
+
+
+async def test_category_closure_is_maintained(
+    prepare_subcategories, test_session_factory
+):
+    """The closure table matches the hierarchy after inserts,
+    re-parenting and deleting a category"""
+
+    async def closure(session):
+        result = await session.execute(
+            sa.select(
+                CategoryClosure.ancestor_id,
+                CategoryClosure.descendant_id,
+                CategoryClosure.depth,
+            )
+        )
+        return set(result.all())
+
+    async def expected_closure(session):
+        parents = dict(
+            (await session.execute(sa.select(Category.id, Category.parent_id)))
+            .tuples()
+            .all()
+        )
+        expected = set()
+        for category_id in parents:
+            ancestor_id, depth = category_id, 0
+            while ancestor_id is not None:
+                expected.add((ancestor_id, category_id, depth))
+                ancestor_id, depth = parents[ancestor_id], depth + 1
+        return expected
+
+    async with test_session_factory() as session:
+        assert await closure(session) == await expected_closure(session)
+
+        laptops = (
+            await session.execute(
+                sa.select(Category).where(Category.title == "Laptops")
+            )
+        ).scalar_one()
+        smartphones = (
+            await session.execute(
+                sa.select(Category).where(Category.title == "Smartphones")
+            )
+        ).scalar_one()
+        laptops.parent_id = smartphones.id
+        await session.commit()
+        assert await closure(session) == await expected_closure(session)
+
+        await session.delete(smartphones)
+        await session.commit()
+        assert await closure(session) == await expected_closure(session)
+        await session.refresh(laptops)
+        assert laptops.parent_id is None
+
+
+async def test_reconcile_client_order_totals(
+    prepare_orders_for_statistic, test_session_factory
+):
+    async with test_session_factory() as session:
+        rollup_accessor = RollupAccessor(session)
+        assert await rollup_accessor.reconcile_client_order_totals() == []
+
+        await session.execute(sa.update(ClientOrderTotal).values(total_sum=1))
+        await session.commit()
+
+        drift = await rollup_accessor.reconcile_client_order_totals()
+        assert [tuple(row) for row in drift] == [(1, 1, 185)]
+
+        await rollup_accessor.reconcile_client_order_totals(repair=True)
+        assert await rollup_accessor.reconcile_client_order_totals() == []
+
+
+async def test_raw_statistic_accessor_matches(
+    prepare_orders_for_statistic, test_session_factory
+):
+    async def read(accessor):
+        streamed = [
+            [tuple(row) for row in rows]
+            async for rows in accessor.stream_product_sales()
+        ]
+        streamed += [
+            [tuple(row) for row in rows]
+            async for rows in accessor.stream_client_orders_sum(exact=True)
+        ]
+        return (
+            [tuple(row) for row in await accessor.get_client_orders_sum()],
+            [
+                tuple(row)
+                for row in await accessor.get_client_orders_sum(
+                    exact=True, after_id=0, limit=10
+                )
+            ],
+            [dict(row) for row in await accessor.get_count_subcategories()],
+            [
+                dict(row)
+                for row in await accessor.get_top_selling_products(
+                    limit=1, level=2, per_category=True
+                )
+            ],
+            [
+                dict(row)
+                for row in await accessor.get_top_selling_products(
+                    category_id=1
+                )
+            ],
+            streamed,
+        )
+
+    async with test_session_factory() as session:
+        expected = await read(StatisticAccessor(session))
+        await session.commit()
+        raw = RawStatisticAccessor(session)
+        assert await read(raw) == expected
+        assert expected[0] == [(1, "Test Client", 185)]
+
+        row = (await raw.get_top_selling_products())[0]
+        assert row.product_title == row["product_title"] == row[0]
+        assert not hasattr(row, "__dict__")
+
+
+async def test_repair_large_client_order_totals_drift(
+    prepare_orders_for_statistic, test_session_factory
+):
+    """More stale totals than the 32767 parameters of a statement"""
+    async with test_session_factory() as session:
+        await session.execute(
+            sa.text(
+                "INSERT INTO client (name, email) "
+                "SELECT 'client', 'drift' || n || '@mail.ru' "
+                "FROM generate_series(1, 40000) AS n"
+            )
+        )
+        await session.execute(
+            sa.text(
+                "INSERT INTO client_order_totals (client_id, total_sum) "
+                "SELECT id, 1 FROM client WHERE email LIKE 'drift%'"
+            )
+        )
+        await session.commit()
+
+        rollup_accessor = RollupAccessor(session)
+        drift = await rollup_accessor.reconcile_client_order_totals(
+            repair=True
+        )
+        assert len(drift) == 40000
+        assert await rollup_accessor.reconcile_client_order_totals() == []
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+
+from service.db_accessors import RollupAccessor
+from service.db_setup.models import (
+    ClientOrderTotal,
+    OrderItem,
+    Product,
+    ProductSalesDaily,
+)
+from service.exceptions import (
+    OrderNotFound,
+    ProductNotAvailable,
+    ProductNotFound,
+)
+from service.group_commit import CartBatcher
+
+
+async def test_batch_applies_every_line_on_its_own(
+    prepare_products_for_batch, test_session_factory
+):
+    batcher = CartBatcher(test_session_factory, window=0.05, max_items=64)
+    lines = [
+        (1, 1, 2),
+        (1, 2, 1),
+        (1, 2, 1),
+        (99, 1, 1),
+        (1, 42, 1),
+        (1, 1, 2),
+    ]
+    outcomes = await asyncio.gather(
+        *(batcher.add(*line) for line in lines), return_exceptions=True
+    )
+
+    assert outcomes[0] is None and outcomes[1] is None
+    assert outcomes[5] is None
+    assert isinstance(outcomes[2], ProductNotAvailable)
+    assert str(outcomes[2]) == "Insufficient stock. Available: 0"
+    assert isinstance(outcomes[3], OrderNotFound)
+    assert isinstance(outcomes[4], ProductNotFound)
+    assert batcher.metrics.sizes.count == 1
+    assert batcher.metrics.sizes.sum == len(lines)
+    assert "cart_batch_size_count 1" in batcher.metrics.render()
+
+    async with test_session_factory() as session:
+        stock = dict(
+            (await session.execute(sa.select(Product.id, Product.quantity)))
+            .tuples()
+            .all()
+        )
+        assert stock == {1: 1, 2: 0}
+        items = (
+            await session.execute(
+                sa.select(OrderItem.product_id, OrderItem.quantity).order_by(
+                    OrderItem.product_id
+                )
+            )
+        ).all()
+        assert [tuple(item) for item in items] == [(1, 4), (2, 1)]
+        assert (
+            await session.scalar(sa.select(ClientOrderTotal.total_sum)) == 43
+        )
+        sold = await session.scalar(
+            sa.select(sa.func.sum(ProductSalesDaily.quantity))
+        )
+        assert sold == 5
+        await session.commit()
+        assert (
+            await RollupAccessor(session).reconcile_client_order_totals() == []
+        )
+
+
+async def test_batch_is_flushed_at_max_items(
+    prepare_products_for_batch, test_session_factory
+):
+    batcher = CartBatcher(test_session_factory, window=10, max_items=2)
+    await asyncio.wait_for(
+        asyncio.gather(batcher.add(1, 1, 1), batcher.add(1, 2, 1)), timeout=5
+    )
+    assert batcher.metrics.sizes.count == 1
+
+    waiting = asyncio.create_task(batcher.add(1, 1, 1))
+    await asyncio.sleep(0)
+    await batcher.close()
+    await waiting
+    assert batcher.metrics.sizes.count == 2
+    with pytest.raises(ProductNotAvailable):
+        await CartBatcher(test_session_factory, 0, 1).add(1, 2, 1)
@@ -1,9 +1,30 @@
+import asyncio
+import csv
+import io
+import json
 import logging
+from datetime import date, timedelta
 
+import msgpack
 import pytest
 import sqlalchemy
 
-from service.db_setup.models import OrderItem
+from service.cache import statistic_cache
+from service.catalog_import import (
+    MAX_LINE_BYTES,
+    MAX_RECORD_LINES,
+    RowRejected,
+    read_lines,
+)
+from service.db_accessors import OrderProductAccessor, StockAccessor
+from service.db_setup.models import (
+    Client,
+    OrderItem,
+    Product,
+    ProductSalesDaily,
+)
+from service.group_commit import CartBatcher
+from service.slow_queries import slow_query_log
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -13,7 +34,10 @@ async def test_client_order_sum_handler(client, prepare_orders_for_statistic):
     url = "client-order-sum"
     response = await client.get(url)
     assert response.status_code == 200
-    assert response.json() == [{"name": "Test Client", "total_sum": 185.0}]
+    assert response.json() == {
+        "items": [{"name": "Test Client", "total_sum": 185.0}],
+        "next_cursor": None,
+    }
 
 
 async def test_add_to_order_handler(client, prepare_product_and_order):
@@ -196,3 +220,621 @@ async def test_create_order_handler(client, prepare_product_and_order):
     url = "/create-order"
     response = await client.post(f"{url}?client_id={1}")
     assert response.status_code == 200
+
+
+async def test_add_batch_to_cart_handler(
+    client, prepare_products_for_batch, test_session_factory
+):
+    response = await client.post(
+        "/add-to-cart-batch",
+        json={
+            "order_id": 1,
+            "items": [
+                {"product_id": 2, "quantity": 1},
+                {"product_id": 1, "quantity": 2},
+                {"product_id": 9999, "quantity": 1},
+                {"product_id": 1, "quantity": 10},
+                {"product_id": 1, "quantity": 3},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "order_id": 1,
+        "results": [
+            {
+                "product_id": 2,
+                "quantity": 1,
+                "status": "added",
+                "available": None,
+            },
+            {
+                "product_id": 1,
+                "quantity": 2,
+                "status": "added",
+                "available": None,
+            },
+            {
+                "product_id": 9999,
+                "quantity": 1,
+                "status": "not_found",
+                "available": None,
+            },
+            {
+                "product_id": 1,
+                "quantity": 10,
+                "status": "not_available",
+                "available": 3,
+            },
+            {
+                "product_id": 1,
+                "quantity": 3,
+                "status": "added",
+                "available": None,
+            },
+        ],
+    }
+
+    async with test_session_factory() as session:
+        stock = (
+            await session.execute(
+                sqlalchemy.select(Product.id, Product.quantity).order_by(
+                    Product.id
+                )
+            )
+        ).all()
+        assert stock == [(1, 0), (2, 0)]
+        items = (
+            await session.execute(
+                sqlalchemy.select(
+                    OrderItem.product_id, OrderItem.quantity
+                ).order_by(OrderItem.product_id)
+            )
+        ).all()
+        assert items == [(1, 5), (2, 1)]
+
+
+async def test_add_batch_to_cart_existing_item(
+    client, prepare_products_for_batch, test_session_factory
+):
+    url = "/add-to-cart"
+    response = await client.post(url + "?order_id=1&product_id=1&quantity=1")
+    assert response.status_code == 200
+
+    response = await client.post(
+        "/add-to-cart-batch",
+        json={"order_id": 1, "items": [{"product_id": 1, "quantity": 2}]},
+    )
+    assert response.status_code == 200
+
+    async with test_session_factory() as session:
+        order_item = (
+            await session.execute(
+                sqlalchemy.select(OrderItem).where(OrderItem.product_id == 1)
+            )
+        ).scalar_one()
+        assert order_item.quantity == 3
+
+
+async def test_add_batch_to_cart_order_not_found(
+    client, prepare_products_for_batch
+):
+    response = await client.post(
+        "/add-to-cart-batch",
+        json={"order_id": 9999, "items": [{"product_id": 1, "quantity": 1}]},
+    )
+    assert response.status_code == 404
+
+
+async def test_add_batch_to_cart_empty_items_422(client):
+    response = await client.post(
+        "/add-to-cart-batch", json={"order_id": 1, "items": []}
+    )
+    assert response.status_code == 422
+
+
+async def test_add_to_cart_updates_sales_rollup(
+    client, prepare_products_for_batch, test_session_factory
+):
+    response = await client.post(
+        "/add-to-cart?order_id=1&product_id=1&quantity=2"
+    )
+    assert response.status_code == 200
+    response = await client.post(
+        "/add-to-cart-batch",
+        json={
+            "order_id": 1,
+            "items": [
+                {"product_id": 1, "quantity": 1},
+                {"product_id": 2, "quantity": 1},
+            ],
+        },
+    )
+    assert response.status_code == 200
+
+    async with test_session_factory() as session:
+        sales = (
+            await session.execute(
+                sqlalchemy.select(
+                    ProductSalesDaily.product_id,
+                    sqlalchemy.func.sum(ProductSalesDaily.quantity),
+                )
+                .group_by(ProductSalesDaily.product_id)
+                .order_by(ProductSalesDaily.product_id)
+            )
+        ).all()
+        assert sales == [(1, 3), (2, 1)]
+
+    response = await client.get("/statistic-order")
+    assert response.json() == [
+        {
+            "product_name": "Test Product 1",
+            "category_name": "Test Category 1",
+            "total_quantity": 3,
+        },
+        {
+            "product_name": "Test Product 2",
+            "category_name": "Test Category 1",
+            "total_quantity": 1,
+        },
+    ]
+
+
+async def test_client_order_sum_is_maintained(
+    client, prepare_products_for_batch
+):
+    response = await client.post("/create-order?client_id=1")
+    assert response.status_code == 200
+    response = await client.get("/client-order-sum")
+    assert response.json()["items"] == [
+        {"name": "Test Client", "total_sum": 0.0}
+    ]
+
+    await client.post("/add-to-cart?order_id=1&product_id=1&quantity=2")
+    await client.post(
+        "/add-to-cart-batch",
+        json={
+            "order_id": 1,
+            "items": [
+                {"product_id": 1, "quantity": 1},
+                {"product_id": 2, "quantity": 1},
+            ],
+        },
+    )
+
+    expected = [{"name": "Test Client", "total_sum": 33.0}]
+    response = await client.get("/client-order-sum")
+    assert response.json()["items"] == expected
+    response = await client.get("/client-order-sum?exact=true")
+    assert response.json()["items"] == expected
+
+
+async def test_statistics_cache_is_invalidated_by_add_to_cart(
+    client, prepare_products_for_batch
+):
+    response = await client.get("/statistic-order")
+    assert response.json() == []
+
+    await client.post("/add-to-cart?order_id=1&product_id=1&quantity=2")
+
+    response = await client.get("/statistic-order")
+    assert response.json() == [
+        {
+            "product_name": "Test Product 1",
+            "category_name": "Test Category 1",
+            "total_quantity": 2,
+        }
+    ]
+
+
+@pytest.mark.parametrize("exact", ["false", "true"])
+async def test_client_order_sum_pagination(
+    client, prepare_clients_with_orders, exact
+):
+    cursor = None
+    pages = []
+    while True:
+        params = {"limit": 2, "exact": exact}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/client-order-sum", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        pages.append([item["name"] for item in page["items"]])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert pages == [
+        ["Client 0", "Client 1"],
+        ["Client 2", "Client 3"],
+        ["Client 4"],
+    ]
+
+
+async def test_client_order_sum_invalid_cursor(client):
+    response = await client.get("/client-order-sum?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+async def test_export_client_order_sum_ndjson(
+    client, prepare_clients_with_orders, monkeypatch
+):
+    # several batches are read from the cursor
+    monkeypatch.setattr("service.db_accessors.EXPORT_BATCH_SIZE", 2)
+    response = await client.get("/export/client-order-sum")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["name"] for row in rows] == [
+        f"Client {number}" for number in range(5)
+    ]
+    assert {row["total_sum"] for row in rows} == {0}
+
+
+async def test_export_client_order_sum_csv(
+    client, prepare_orders_for_statistic
+):
+    response = await client.get(
+        "/export/client-order-sum", params={"format": "csv", "exact": "true"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "name", "total_sum"]
+    assert [row[1:] for row in rows[1:]] == [["Test Client", "185"]]
+
+
+async def test_export_product_sales(client, prepare_orders_for_statistic):
+    response = await client.get("/export/product-sales")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [
+        (row["product_title"], row["top_parent_title"], row["total_quantity"])
+        for row in rows
+    ] == [("SmartphoneX", "Electronics", 2), ("BookA", "Books", 33)]
+
+
+async def test_export_unknown_format(client):
+    response = await client.get("/export/product-sales?format=xml")
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        (
+            {"from": str(date.today() - timedelta(days=45))},
+            [("BookA", "Books", 33), ("SmartphoneX", "Electronics", 2)],
+        ),
+        ({"limit": 1}, [("BookA", "Books", 3)]),
+        (
+            {"to": str(date.today() - timedelta(days=1))},
+            [],
+        ),
+        # the subtree of Electronics
+        ({"category_id": 1}, [("SmartphoneX", "Electronics", 2)]),
+        # Books has no subcategories
+        ({"level": 2}, [("SmartphoneX", "Smartphones", 2)]),
+        (
+            {"per_category": "true", "limit": 1},
+            [("BookA", "Books", 3), ("SmartphoneX", "Electronics", 2)],
+        ),
+    ],
+)
+async def test_statistics_handler_params(
+    client, prepare_orders_for_statistic, params, expected
+):
+    response = await client.get("/statistic-order", params=params)
+    assert response.status_code == 200
+    assert [
+        (row["product_name"], row["category_name"], row["total_quantity"])
+        for row in response.json()
+    ] == expected
+
+
+async def test_statistics_handler_invalid_range(client):
+    response = await client.get(
+        "/statistic-order", params={"from": "2026-02-01", "to": "2026-01-01"}
+    )
+    assert response.status_code == 400
+
+
+async def test_import_products(
+    client, prepare_product_and_order, test_session_factory
+):
+    body = "\n".join(
+        [
+            json.dumps({"id": 1, "price": "12.50", "quantity": 5}),
+            json.dumps({"title": "New", "price": 3, "category_id": 1}),
+            json.dumps({"id": 999, "price": 1}),
+            json.dumps({"title": "No price", "category_id": 1}),
+            "not json",
+            json.dumps({"title": "Lost", "price": 1, "category_id": 42}),
+            json.dumps({"id": 1, "quantity": 7}),
+        ]
+    )
+    response = await client.post("/import/products", content=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"], result["rejected"]) == (
+        1,
+        1,
+        5,
+    )
+    assert [error["line"] for error in result["errors"]] == [1, 3, 4, 5, 6]
+    assert result["errors"][0]["reason"] == "superseded by a later line"
+
+    async with test_session_factory() as session:
+        products = (
+            await session.execute(
+                sqlalchemy.select(
+                    Product.title, Product.price, Product.quantity
+                ).order_by(Product.id)
+            )
+        ).all()
+    # the last line for product 1 keeps the price it does not mention
+    assert [
+        (title, float(price), quantity) for title, price, quantity in products
+    ] == [
+        ("Test Product 1", 10.0, 7),
+        ("New", 3.0, 0),
+    ]
+
+
+async def test_import_rejects_out_of_range_values(
+    client, prepare_product_and_order, test_session_factory
+):
+    body = "\n".join(
+        [
+            json.dumps({"title": "NaN", "price": "NaN", "category_id": 1}),
+            json.dumps({"title": "sNaN", "price": "sNaN", "category_id": 1}),
+            json.dumps(
+                {"title": "Inf", "price": "Infinity", "category_id": 1}
+            ),
+            json.dumps({"title": "Big", "price": "1e20", "category_id": 1}),
+            json.dumps({"id": 99999999999, "price": 1}),
+            json.dumps({"id": 1, "quantity": 2**31}),
+            json.dumps({"title": "Fine", "price": "2.5", "category_id": 1}),
+        ]
+    )
+    response = await client.post("/import/products", content=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["rejected"]) == (1, 6)
+    assert [error["line"] for error in result["errors"]] == [1, 2, 3, 4, 5, 6]
+
+    async with test_session_factory() as session:
+        titles = (
+            await session.execute(
+                sqlalchemy.select(Product.title).order_by(Product.id)
+            )
+        ).scalars()
+        assert titles.all() == ["Test Product 1", "Fine"]
+
+
+async def test_import_refreshes_sharded_stock(
+    client, prepare_product_and_order, test_session_factory
+):
+    async with test_session_factory() as session:
+        await StockAccessor(session).shard_product(1, 2)
+        await OrderProductAccessor(session).add_product_to_order(1, 1, 1)
+
+    response = await client.post(
+        "/import/products", content=json.dumps({"id": 1, "price": "11"})
+    )
+    assert response.json()["updated"] == 1
+    async with test_session_factory() as session:
+        product = await session.get(Product, 1)
+    # the stale total of the last rebalance is replaced by the buckets'
+    assert (product.quantity, float(product.price)) == (1, 11.0)
+
+
+async def test_import_clients_csv(
+    client, prepare_product_and_order, test_session_factory
+):
+    body = (
+        "email,name,address\n"
+        'test@example.com,Renamed,"Line 1\nLine 2"\n'
+        "new@example.com,New Client,\n"
+        "nameless@example.com,,\n"
+        "too,many,fields,here\n"
+    )
+    response = await client.post(
+        "/import/clients", params={"format": "csv"}, content=body
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["updated"], result["rejected"]) == (
+        1,
+        1,
+        2,
+    )
+    assert [error["line"] for error in result["errors"]] == [5, 6]
+
+    async with test_session_factory() as session:
+        clients = (
+            await session.execute(
+                sqlalchemy.select(
+                    Client.email, Client.name, Client.address
+                ).order_by(Client.id)
+            )
+        ).all()
+    assert clients == [
+        ("test@example.com", "Renamed", "Line 1\nLine 2"),
+        ("new@example.com", "New Client", None),
+    ]
+
+
+async def test_import_rejects_unreadable_records(
+    client, prepare_product_and_order
+):
+    body = (
+        b"email,name,address\n"
+        b"bad\xff@example.com,Bad,\n"
+        b'open@example.com,Open,"never closed\n'
+        + b"more\n" * (MAX_RECORD_LINES - 1)
+        + b"later@example.com,Later,\n"
+    )
+    response = await client.post(
+        "/import/clients", params={"format": "csv"}, content=body
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["rejected"]) == (1, 2)
+    assert result["errors"] == [
+        {"line": 2, "reason": "invalid UTF-8"},
+        {"line": 3, "reason": "unterminated quoted field"},
+    ]
+
+
+async def test_read_lines_drops_long_lines():
+    async def body():
+        yield b"first\n" + b"x" * MAX_LINE_BYTES
+        yield b"x" * MAX_LINE_BYTES
+        yield b"x\nlast"
+
+    lines = [line async for line in read_lines(body())]
+    assert lines[0] == "first"
+    assert isinstance(lines[1], RowRejected)
+    assert lines[2] == "last"
+
+
+async def test_server_timing_and_metrics(client, prepare_orders_for_statistic):
+    response = await client.get("/statistic-order")
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    statements = int(timing.split('desc="')[1].split(" ")[0])
+    assert statements >= 1
+
+    response = await client.get(
+        "/statistic-order", headers={"x-request-id": "req-1"}
+    )
+    assert response.headers["x-request-id"] == "req-1"
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert "log_records_dropped 0" in response.text
+    assert response.headers["content-type"].startswith("text/plain")
+    labels = 'method="GET",route="/statistic-order",status="200"'
+    assert f"http_request_duration_seconds_count{{{labels}}}" in response.text
+    assert f'{{{labels},le="+Inf"}}' in response.text
+    assert f"db_statements_total{{{labels}}}" in response.text
+
+
+async def test_slow_query_log(
+    client, prepare_orders_for_statistic, monkeypatch
+):
+    monkeypatch.setattr(slow_query_log, "threshold_ms", 0.001)
+    monkeypatch.setattr(slow_query_log, "explain_sample_rate", 1.0)
+    slow_query_log.clear()
+
+    response = await client.get("/statistic-order")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+    response = await client.get("/admin/slow-queries")
+    entries = response.json()["entries"]
+    entry = next(
+        entry
+        for entry in entries
+        if entry["caller"]
+        == "service.db_accessors.StatisticAccessor.get_top_selling_products"
+    )
+    assert entry["parameters"] == ["date", "date", "int"]
+    plan = entry["plan"][0]
+    assert "Execution Time" in plan
+    assert "Shared Hit Blocks" in plan["Plan"]
+
+
+async def test_fast_responses_match_the_models(
+    client, prepare_orders_for_statistic, monkeypatch
+):
+    urls = ("/client-order-sum", "/count-subcategories", "/statistic-order")
+    expected = {}
+    for url in urls:
+        response = await client.get(url)
+        assert response.status_code == 200
+        expected[url] = response.json()
+
+    monkeypatch.setattr("service.endpoints.data_handlers.FAST_RESPONSES", True)
+    for url in urls:
+        response = await client.get(url)
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected[url]
+
+        response = await client.get(
+            url, headers={"accept": "application/msgpack"}
+        )
+        assert response.headers["content-type"] == "application/msgpack"
+        assert msgpack.unpackb(response.content) == expected[url]
+
+
+async def test_gzip_for_large_responses(client):
+    response = await client.get(
+        "/openapi.json", headers={"accept-encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "/client-order-sum" in response.json()["paths"]
+
+    response = await client.get("/pool-status")
+    assert "content-encoding" not in response.headers
+
+
+async def test_handlers_with_raw_statistic_accessor(
+    client, prepare_orders_for_statistic, monkeypatch
+):
+    urls = (
+        "/client-order-sum?exact=true",
+        "/count-subcategories",
+        "/statistic-order?per_category=true",
+        "/export/client-order-sum",
+        "/export/product-sales?format=csv",
+    )
+    expected = {}
+    for url in urls:
+        expected[url] = (await client.get(url)).text
+
+    for module in ("data_handlers", "export_handlers"):
+        monkeypatch.setattr(
+            f"service.endpoints.{module}.STATISTIC_ACCESSOR", "asyncpg"
+        )
+    await statistic_cache.clear()
+    for url in urls:
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert response.text == expected[url]
+
+
+async def test_add_to_cart_group_commit(
+    client, prepare_products_for_batch, test_session_factory, monkeypatch
+):
+    batcher = CartBatcher(test_session_factory, window=0.05, max_items=64)
+    monkeypatch.setattr("service.group_commit._cart_batcher", batcher)
+
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                "/add-to-cart",
+                params={
+                    "order_id": order_id,
+                    "product_id": product_id,
+                    "quantity": 1,
+                },
+            )
+            for order_id, product_id in ((1, 1), (1, 2), (1, 2), (2, 1))
+        )
+    )
+    assert [response.status_code for response in responses] == [
+        200,
+        200,
+        400,
+        404,
+    ]
+    assert responses[2].json() == {
+        "detail": "Insufficient stock. Available: 0"
+    }
+
+    response = await client.get("/metrics")
+    assert "cart_batch_size_count 1" in response.text
+    assert "cart_batch_size_sum 4" in response.text
@@ -0,0 +1,56 @@
+import json
+import logging
+import queue
+
+from service.logging_setup import (
+    AsyncQueueHandler,
+    JsonFormatter,
+    SamplingFilter,
+    parse_sampling,
+    request_id,
+)
+
+
+def make_record(name="service.db_accessors", level=logging.DEBUG, **extra):
+    record = logging.LogRecord(
+        name, level, __file__, 1, "order %s, %s", (1, [2]), None
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_queue_handler_defers_formatting():
+    handler = AsyncQueueHandler(queue.Queue(1))
+    token = request_id.set("abc")
+    try:
+        handler.handle(make_record(duration_ms=1.5))
+        handler.handle(make_record())
+    finally:
+        request_id.reset(token)
+
+    record = handler.queue.get_nowait()
+    assert record.args == (1, [2])
+    assert record.request_id == "abc"
+    assert handler.dropped == 1
+
+    line = json.loads(JsonFormatter().format(record))
+    assert line["message"] == "order 1, [2]"
+    assert line["request_id"] == "abc"
+    assert line["duration_ms"] == 1.5
+    assert line["level"] == "DEBUG"
+
+
+def test_sampling_filter(monkeypatch):
+    rates = parse_sampling("service=0.5, service.db_accessors=0")
+    assert rates == {"service": 0.5, "service.db_accessors": 0.0}
+    sampling = SamplingFilter(rates)
+    monkeypatch.setattr("random.random", lambda: 0.3)
+
+    assert not sampling.filter(make_record("service.db_accessors.x"))
+    assert sampling.filter(
+        make_record("service.db_accessors", logging.WARNING)
+    )
+    assert sampling.filter(make_record("service.config", logging.INFO))
+    assert sampling.filter(make_record("sqlalchemy.engine"))
+    monkeypatch.setattr("random.random", lambda: 0.7)
+    assert not sampling.filter(make_record("service.config", logging.INFO))
@@ -0,0 +1,204 @@
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+
+from service.db_accessors import (
+    OrderProductAccessor,
+    PartitionAccessor,
+    RollupAccessor,
+    add_months,
+    create_partition_statements,
+    month_start,
+    partition_name,
+)
+from service.db_setup.models import Client, ClientOrderTotal, ProductSalesDaily
+
+ARCHIVE_SCHEMA = "archive_test"
+
+
+async def add_old_order(session, month, client_id, active) -> None:
+    """An order created at the start of month with one item of product 1"""
+    order_id = (
+        await session.execute(
+            sa.text(
+                'INSERT INTO "order" (client_id, active, created_at) '
+                "VALUES (:client_id, :active, :created_at) RETURNING id"
+            ),
+            {"client_id": client_id, "active": active, "created_at": month},
+        )
+    ).scalar_one()
+    await session.execute(
+        sa.text(
+            "INSERT INTO order_item (order_id, order_created_at, "
+            "product_id, quantity, price_at_time) "
+            "VALUES (:order_id, :created_at, 1, 1, 10)"
+        ),
+        {"order_id": order_id, "created_at": month},
+    )
+
+
+async def test_create_partitions(
+    prepare_product_and_order, test_session_factory
+):
+    current = month_start(datetime.now(timezone.utc))
+    last = add_months(current, 3)
+    async with test_session_factory() as session:
+        await OrderProductAccessor(session).add_product_to_order(1, 1, 1)
+        partitions = (
+            await session.execute(
+                sa.text(
+                    'SELECT "order".tableoid::regclass::text, '
+                    "order_item.tableoid::regclass::text "
+                    'FROM "order" JOIN order_item '
+                    'ON order_item.order_id = "order".id'
+                )
+            )
+        ).one()
+        assert partitions == (
+            partition_name("order", current),
+            partition_name("order_item", current),
+        )
+
+        for table in ("order_item", "order"):
+            partition = partition_name(table, last)
+            await session.execute(
+                sa.text(
+                    f'ALTER TABLE "{table}" DETACH PARTITION "{partition}"'
+                )
+            )
+            await session.execute(sa.text(f'DROP TABLE "{partition}"'))
+        await session.commit()
+
+        accessor = PartitionAccessor(session)
+        assert await accessor.create_partitions(months_ahead=3) == [last]
+        assert await accessor.create_partitions(months_ahead=3) == []
+        async with session.begin():
+            assert await accessor.get_partition_months() == [
+                add_months(current, count) for count in range(4)
+            ]
+
+
+async def test_archive_partitions(
+    prepare_product_and_order, test_session_factory
+):
+    current = month_start(datetime.now(timezone.utc))
+    inactive_month, active_month = (
+        add_months(current, -14),
+        add_months(current, -13),
+    )
+    async with test_session_factory() as session:
+        for month, active in ((inactive_month, 0), (active_month, 1)):
+            for statement in create_partition_statements(month):
+                await session.execute(sa.text(statement))
+            await add_old_order(session, month, client_id=1, active=active)
+        await session.commit()
+
+        try:
+            archived, kept = await PartitionAccessor(
+                session
+            ).archive_partitions(retention_months=12, schema=ARCHIVE_SCHEMA)
+            assert archived == [inactive_month]
+            assert kept == [active_month]
+
+            async with session.begin():
+                # the order of the prepared fixture and the active one
+                assert (
+                    await session.scalar(
+                        sa.text('SELECT count(*) FROM "order"')
+                    )
+                    == 2
+                )
+                for table in ("order", "order_item"):
+                    archive = (
+                        f'{ARCHIVE_SCHEMA}."'
+                        f'{partition_name(table, inactive_month)}"'
+                    )
+                    assert (
+                        await session.scalar(
+                            sa.text(f"SELECT count(*) FROM {archive}")
+                        )
+                        == 1
+                    )
+                    assert not await session.scalar(
+                        sa.text(
+                            "SELECT count(*) FROM pg_constraint "
+                            "WHERE conrelid = CAST(:archive AS regclass) "
+                            "AND contype = 'f'"
+                        ),
+                        {"archive": archive},
+                    )
+        finally:
+            await session.rollback()
+            await session.execute(
+                sa.text(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE")
+            )
+            await session.commit()
+
+
+async def test_archive_keeps_statistic_consistent(
+    prepare_product_and_order, test_session_factory
+):
+    current = month_start(datetime.now(timezone.utc))
+    old_month = add_months(current, -14)
+    async with test_session_factory() as session:
+        for statement in create_partition_statements(old_month):
+            await session.execute(sa.text(statement))
+        session.add(Client(name="Old Client", email="old@example.com"))
+        await session.flush()
+        # client 1 has a live order as well, client 2 only the old ones
+        for client_id in (1, 2):
+            await add_old_order(session, old_month, client_id, active=0)
+        await session.commit()
+        await OrderProductAccessor(session).add_product_to_order(1, 1, 2)
+
+        rollup = RollupAccessor(session)
+        await rollup.rebuild_product_sales_daily()
+        await rollup.reconcile_client_order_totals(repair=True)
+
+        async def statistic():
+            async with session.begin():
+                totals = (
+                    await session.execute(
+                        sa.select(
+                            ClientOrderTotal.client_id,
+                            ClientOrderTotal.total_sum,
+                        ).order_by(ClientOrderTotal.client_id)
+                    )
+                ).all()
+                sales = (
+                    await session.execute(
+                        sa.select(
+                            ProductSalesDaily.day,
+                            sa.func.sum(ProductSalesDaily.quantity),
+                        )
+                        .group_by(ProductSalesDaily.day)
+                        .order_by(ProductSalesDaily.day)
+                    )
+                ).all()
+            return totals, sales
+
+        totals, sales = await statistic()
+        assert totals == [(1, 30), (2, 10)]
+        assert [row[0] for row in sales][0] == old_month
+
+        try:
+            archived, _ = await PartitionAccessor(session).archive_partitions(
+                retention_months=12, schema=ARCHIVE_SCHEMA
+            )
+            assert archived == [old_month]
+
+            totals, sales = await statistic()
+            assert totals == [(1, 20)]
+            assert [day for day, _ in sales] == [
+                datetime.now(timezone.utc).date()
+            ]
+
+            assert await rollup.reconcile_client_order_totals() == []
+            await rollup.rebuild_product_sales_daily()
+            assert await statistic() == (totals, sales)
+        finally:
+            await session.rollback()
+            await session.execute(
+                sa.text(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE")
+            )
+            await session.commit()
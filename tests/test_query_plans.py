@@ -0,0 +1,218 @@
+"""The accessor queries are run over a seeded dataset, every statement
+they send is EXPLAINed and must not read a large table sequentially,
+except the tables a whole-table export reads to the end"""
+
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+from service.config import SALES_ROLLUP_BUCKETS
+from service.db_accessors import (
+    AtomicOrderProductAccessor,
+    OrderProductAccessor,
+    RollupAccessor,
+    StatisticAccessor,
+)
+
+LARGE_TABLES = {
+    "client",
+    "client_order_totals",
+    "order",
+    "order_item",
+    "product",
+    "product_sales_daily",
+}
+
+# order_y2026m10 is a partition of order
+PARTITION_SUFFIX = re.compile(r"_y\d{4}m\d{2}$")
+
+TODAY = date.today()
+
+
+async def consume(stream) -> None:
+    async for _ in stream:
+        pass
+
+
+ACCESSOR_CALLS = {
+    "client_orders_sum_page": lambda session: StatisticAccessor(
+        session
+    ).get_client_orders_sum(after_id=2500, limit=101),
+    "client_orders_sum_exact_page": lambda session: StatisticAccessor(
+        session
+    ).get_client_orders_sum(exact=True, after_id=2500, limit=101),
+    "top_selling_one_day": lambda session: StatisticAccessor(
+        session
+    ).get_top_selling_products(date_from=TODAY, date_to=TODAY),
+    "top_selling_subtree": lambda session: StatisticAccessor(
+        session
+    ).get_top_selling_products(
+        date_from=TODAY - timedelta(days=7), category_id=11
+    ),
+    "top_selling_per_category": lambda session: StatisticAccessor(
+        session
+    ).get_top_selling_products(
+        date_from=TODAY - timedelta(days=7), per_category=True
+    ),
+    "top_selling_nested_level": lambda session: StatisticAccessor(
+        session
+    ).get_top_selling_products(date_from=TODAY - timedelta(days=7), level=2),
+    "count_subcategories": lambda session: StatisticAccessor(
+        session
+    ).get_count_subcategories(),
+    # the exports (NDJSON and CSV alike) read every row
+    "export_client_orders_sum": lambda session: consume(
+        StatisticAccessor(session).stream_client_orders_sum()
+    ),
+    "export_client_orders_sum_exact": lambda session: consume(
+        StatisticAccessor(session).stream_client_orders_sum(exact=True)
+    ),
+    "export_product_sales": lambda session: consume(
+        StatisticAccessor(session).stream_product_sales()
+    ),
+    "add_product_to_order": lambda session: OrderProductAccessor(
+        session
+    ).add_product_to_order(order_id=1, product_id=1, quantity=1),
+    "add_product_to_order_atomic": lambda session: AtomicOrderProductAccessor(
+        session
+    ).add_product_to_order(order_id=1, product_id=1, quantity=1),
+    "add_products_to_order": lambda session: OrderProductAccessor(
+        session
+    ).add_products_to_order(order_id=1, lines=[(1, 1), (2, 1), (3, 1)]),
+    "add_to_orders": lambda session: OrderProductAccessor(
+        session
+    ).add_to_orders([(1, 1, 1), (2, 2, 1), (2, 3, 1)]),
+}
+
+# the whole-table aggregates read these tables to the end anyway,
+# a sequential scan is their best plan
+FULL_READS = {
+    "export_client_orders_sum_exact": {"client", "order", "order_item"},
+    "export_product_sales": {"product_sales_daily"},
+}
+
+
+@contextmanager
+def captured_statements(engine):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        # an executemany is planned as any one of its parameter sets
+        statements.append(
+            (statement, parameters[0] if executemany else parameters)
+        )
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+
+def sequential_scans(plan: dict, empty: set[str]) -> list[str]:
+    """Tables read sequentially, a scan of an empty partition
+    (e.g. one of the coming months) reads nothing"""
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        relation = plan["Relation Name"]
+        if relation not in empty:
+            scans.append(PARTITION_SUFFIX.sub("", relation))
+    for subplan in plan.get("Plans", []):
+        scans.extend(sequential_scans(subplan, empty))
+    return scans
+
+
+@pytest.mark.parametrize("call", ACCESSOR_CALLS.keys())
+async def test_accessor_queries_use_indexes(
+    prepare_plan_dataset, test_engine, test_session_factory, call
+):
+    async with test_session_factory() as session:
+        with captured_statements(test_engine) as statements:
+            await ACCESSOR_CALLS[call](session)
+            await session.commit()
+
+    assert statements
+    async with test_engine.connect() as conn:
+        empty_partitions = set(
+            (
+                await conn.exec_driver_sql(
+                    "SELECT relname FROM pg_class "
+                    "WHERE relispartition AND relpages = 0"
+                )
+            ).scalars()
+        )
+        for statement, parameters in statements:
+            result = await conn.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {statement}", parameters
+            )
+            plan = result.scalar_one()[0]["Plan"]
+            scans = sequential_scans(plan, empty_partitions)
+            assert not set(scans) & (
+                LARGE_TABLES - FULL_READS.get(call, set())
+            ), (
+                statement,
+                plan,
+            )
+
+
+def rows_read(plan: dict, table: str) -> int:
+    """Rows returned by the scans of table in an EXPLAIN ANALYZE plan"""
+    rows = plan["Actual Rows"] if plan.get("Relation Name") == table else 0
+    return rows + sum(
+        rows_read(subplan, table) for subplan in plan.get("Plans", [])
+    )
+
+
+async def test_top_selling_reads_a_row_per_product_and_day(
+    prepare_plan_dataset, test_engine, test_session_factory
+):
+    """After the compaction a 30 days window reads one rollup row per
+    product and past day, the buckets only for the current day"""
+    date_from = TODAY - timedelta(days=29)
+    async with test_session_factory() as session:
+        # the sales of every day as if spread over all the buckets
+        await session.execute(
+            text(
+                "INSERT INTO product_sales_daily "
+                "(product_id, day, bucket, quantity) "
+                "SELECT product_id, day, spread.bucket, 1 "
+                "FROM product_sales_daily, "
+                "generate_series(1, :buckets - 1) AS spread(bucket)"
+            ),
+            {"buckets": SALES_ROLLUP_BUCKETS},
+        )
+        await session.commit()
+        await RollupAccessor(session).compact_product_sales_daily()
+        async with session.begin():
+            product_days, today_rows = (
+                await session.execute(
+                    text(
+                        "SELECT count(*) FILTER (WHERE bucket = 0), "
+                        "count(*) FILTER (WHERE day = CAST(:today AS date)) "
+                        "FROM product_sales_daily "
+                        "WHERE day BETWEEN :date_from AND :today"
+                    ),
+                    {"date_from": date_from, "today": TODAY},
+                )
+            ).one()
+
+        with captured_statements(test_engine) as statements:
+            await StatisticAccessor(session).get_top_selling_products(
+                date_from=date_from, date_to=TODAY
+            )
+            await session.commit()
+
+    today_products = today_rows // SALES_ROLLUP_BUCKETS
+    assert product_days > today_products > 0
+    async with test_engine.connect() as conn:
+        [(statement, parameters)] = statements
+        result = await conn.exec_driver_sql(
+            f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", parameters
+        )
+        plan = result.scalar_one()[0]["Plan"]
+    assert rows_read(plan, "product_sales_daily") == (
+        product_days + today_products * (SALES_ROLLUP_BUCKETS - 1)
+    )
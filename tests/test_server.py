@@ -0,0 +1,14 @@
+from service.server import build_parser, uvicorn_options
+
+
+def test_uvicorn_options():
+    options = uvicorn_options(
+        build_parser().parse_args(
+            ["--workers", "3", "--keep-alive", "10", "--backlog", "512"]
+        )
+    )
+    assert options["workers"] == 3
+    assert options["timeout_keep_alive"] == 10
+    assert options["backlog"] == 512
+    assert (options["loop"], options["http"]) == ("uvloop", "httptools")
+    assert options["access_log"] is False